@@ -12,5 +12,6 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ShopNest.settings')
+os.environ.setdefault('ASYNC_VIEWS', 'true')                  # served by uvicorn --> the async views (shop/async_views.py)
 
 application = get_asgi_application()
@@ -17,9 +17,10 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
-from django.conf.urls.static import static
 from django.conf import settings
 
+from shop.assets import asset_urls
+
 urlpatterns = [
     path('admin/', admin.site.urls),
 
@@ -33,6 +34,7 @@ urlpatterns = [
 
 
 
-# media file setup
+# media & static files (ETag, Range, precompressed copies, long cache for hashed names -- see shop/assets.py)
 
-urlpatterns += static(settings.MEDIA_URL, document_root = settings.MEDIA_ROOT)              # MEDIA_URL & MEDIA_ROOT are in settings.py
\ No newline at end of file
+urlpatterns += asset_urls(settings.MEDIA_URL, settings.MEDIA_ROOT)              # MEDIA_URL & MEDIA_ROOT are in settings.py
+urlpatterns += asset_urls(settings.STATIC_URL, settings.STATIC_ROOT)            # filled by collectstatic
\ No newline at end of file
@@ -27,3 +27,30 @@ admin.site.register(models.OrderItem)
 
 
 
+
+
+
+# background jobs
+@admin.register(models.Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'kind', 'status', 'attempts', 'run_after', 'created_at']
+    list_filter = ['status', 'kind']
+
+
+
+
+# payment callbacks (see payments.py)
+@admin.register(models.Payment)
+class PaymentAdmin(admin.ModelAdmin):
+    list_display = ['tran_id', 'order', 'status', 'source', 'amount', 'attempts', 'created_at']
+    list_filter = ['status', 'source']
+    search_fields = ['tran_id', 'val_id']
+
+
+
+
+# canceled orders moved out of the order table (see lifecycle.py)
+@admin.register(models.ArchivedOrder)
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    list_display = ['order_id', 'user', 'email', 'total_amount', 'canceled_at', 'archived_at']
+    search_fields = ['order_id', 'email']
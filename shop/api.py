@@ -0,0 +1,273 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.db.models import Count, Max
+from django.http import JsonResponse, StreamingHttpResponse, Http404
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.views.decorators.http import require_GET
+
+from . import models
+from .pagination import SORTS, get_sort, after_cursor, cursor_for, InvalidCursor
+from .views import filter_products, InvalidFilter
+
+
+
+# Read-only JSON catalog API (categories, products, product detail, ratings)
+#
+# ?fields=id,name,price  --> only these fields (and only their columns are loaded)
+# ?cursor=..&limit=..    --> keyset paging, same cursors as the product list (pagination.py)
+#
+# Every response has a strong ETag. It is made from a narrow query (ids + updated_at + the columns that change
+# without touching updated_at: stock & rating counters, related slugs/names), so a client sending it back in
+# If-None-Match gets a 304 after that 1 query: no rows loaded, nothing serialized.
+# Lists are written out row by row (StreamingHttpResponse), a big page is never built as 1 string in memory.
+
+
+PAGE_SIZE = getattr(settings, 'API_PAGE_SIZE', 50)
+MAX_PAGE_SIZE = getattr(settings, 'API_MAX_PAGE_SIZE', 500)
+
+ITERATOR_CHUNK = 200
+
+
+
+class InvalidQuery(ValueError):
+    pass
+
+
+
+
+# field --> (columns it needs, value)
+CATEGORY_FIELDS = {
+    'id' : (['id'], lambda c: c.id),
+    'name' : (['name'], lambda c: c.name),
+    'slug' : (['slug'], lambda c: c.slug),
+    'description' : (['description'], lambda c: c.description),
+    'url' : (['slug'], lambda c: reverse('product_list_by_category', args=[c.slug])),
+}
+
+PRODUCT_FIELDS = {
+    'id' : (['id'], lambda p: p.id),
+    'name' : (['name'], lambda p: p.name),
+    'slug' : (['slug'], lambda p: p.slug),
+    'category' : (['category__slug'], lambda p: p.category.slug),
+    'description' : (['description'], lambda p: p.description),
+    'price' : (['price'], lambda p: str(p.price)),
+    'stock' : (['stock'], lambda p: p.stock),
+    'available' : (['available'], lambda p: p.available),
+    'rating_avg' : (['rating_avg'], lambda p: float(p.rating_avg)),
+    'rating_count' : (['rating_count'], lambda p: p.rating_count),
+    'image' : (['image'], lambda p: p.image.url if p.image else None),
+    'url' : (['slug'], lambda p: reverse('product_detail', args=[p.slug])),
+    'created_at' : (['created_at'], lambda p: p.created_at.isoformat()),
+    'updated_at' : (['updated_at'], lambda p: p.updated_at.isoformat()),
+}
+
+PRODUCT_LIST_FIELDS = [field for field in PRODUCT_FIELDS if field != 'description']               # long text --> only when asked for
+
+RATING_FIELDS = {
+    'id' : (['id'], lambda r: r.id),
+    'user' : (['user__username'], lambda r: r.user.username),
+    'rating' : (['rating'], lambda r: r.rating),
+    'comment' : (['comment'], lambda r: r.comment),
+    'created_at' : (['created_at'], lambda r: r.created_at.isoformat()),
+    'updated_at' : (['updated_at'], lambda r: r.updated_at.isoformat()),
+}
+
+
+# changed with update() (no updated_at): stock at checkout, rating counters in refresh_rating_stats()
+PRODUCT_VERSION = ['updated_at', 'stock', 'rating_count', 'rating_sum']
+RATING_VERSION = ['updated_at']
+
+
+
+
+def select_fields(request, available, default):
+    requested = [field.strip() for field in request.GET.get('fields', '').split(',') if field.strip()]
+    if not requested:
+        return list(default)
+
+    unknown = [field for field in requested if field not in available]
+    if unknown:
+        raise InvalidQuery(f"Unknown fields: {', '.join(unknown)}")
+    return list(dict.fromkeys(requested))                                          # keep the order, drop repeats
+
+
+
+def page_limit(request):
+    try:
+        limit = int(request.GET.get('limit') or PAGE_SIZE)
+    except ValueError:
+        raise InvalidQuery('limit must be a number')
+
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise InvalidQuery(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+    return limit
+
+
+
+def columns(fields, available):
+    return list(dict.fromkeys(column for field in fields for column in available[field][0]))
+
+
+# columns of other tables (category slug, username): they change without the row's updated_at changing
+def related_columns(fields, available):
+    return [column for column in columns(fields, available) if '__' in column]
+
+
+# select_related() + only() for the chosen fields
+def load(queryset, fields, available):
+    needed = columns(fields, available)
+    related = {column.split('__')[0] for column in needed if '__' in column}
+    return queryset.select_related(*related).only(*needed)
+
+
+
+
+def make_etag(*parts):
+    return '"%s"' % hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+# 304 if the client already has this version, else None
+def not_modified(request, etag):
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        response['ETag'] = etag
+        patch_cache_control(response, no_cache=True)
+    return response
+
+
+
+def stream_json(rows, fields, available, etag, **extra):
+    def chunks():
+        yield '{"results":['
+        for i, row in enumerate(rows):
+            yield (',' if i else '') + json.dumps({field : available[field][1](row) for field in fields})
+        yield ']'
+        for key, value in extra.items():
+            yield f',{json.dumps(key)}:{json.dumps(value)}'
+        yield '}'
+
+    response = StreamingHttpResponse(chunks(), content_type='application/json')
+    response['ETag'] = etag
+    patch_cache_control(response, no_cache=True)                                   # keep it, but ask (If-None-Match) every time
+    return response
+
+
+
+def bad_request(error):
+    return JsonResponse({'error' : str(error)}, status=400)
+
+
+
+
+# 1 page of a keyset-paged list: the version query, then (unless 304) the rows themselves
+def paged_list(request, queryset, sort, fields, available, version, name):
+    limit = page_limit(request)
+    queryset = after_cursor(queryset, sort, request.GET.get('cursor'))
+    sort_field, _ = SORTS[sort]
+
+    head = list(queryset.values_list('id', sort_field, *version, *related_columns(fields, available))[:limit + 1])
+
+    next_cursor = None
+    if len(head) > limit:
+        head = head[:limit]
+        next_cursor = cursor_for(sort, head[-1][1], head[-1][0])
+
+    etag = make_etag(name, fields, head, next_cursor)
+    response = not_modified(request, etag)
+    if response is not None:
+        return response
+
+    ids = [row[0] for row in head]
+    rows = load(queryset.filter(id__in=ids), fields, available).iterator(chunk_size=ITERATOR_CHUNK) if ids else []
+    return stream_json(rows, fields, available, etag, next_cursor=next_cursor)
+
+
+
+
+
+
+
+# /api/categories/
+@require_GET
+def categories(request):
+    try:
+        fields = select_fields(request, CATEGORY_FIELDS, CATEGORY_FIELDS)
+    except InvalidQuery as e:
+        return bad_request(e)
+
+    version = models.Category.objects.aggregate(count=Count('id'), updated=Max('updated_at'))         # a delete changes the count
+    etag = make_etag('categories', fields, version['count'], version['updated'])
+
+    response = not_modified(request, etag)
+    if response is not None:
+        return response
+
+    rows = load(models.Category.objects.order_by('name', 'id'), fields, CATEGORY_FIELDS).iterator(chunk_size=ITERATOR_CHUNK)
+    return stream_json(rows, fields, CATEGORY_FIELDS, etag)
+
+
+
+
+# /api/products/?category=..&min_price=..&max_price=..&rating=..&search=..&sort=..&cursor=..&limit=..&fields=..
+# same filters & sorts as the product list page
+@require_GET
+def products(request):
+    queryset = models.Product.objects.filter(available=True)                           # same products as the detail endpoint
+    if request.GET.get('category'):
+        queryset = queryset.filter(category__slug=request.GET['category'])
+
+    try:
+        fields = select_fields(request, PRODUCT_FIELDS, PRODUCT_LIST_FIELDS)
+        return paged_list(
+            request, filter_products(request, queryset, strict=True), get_sort(request), fields, PRODUCT_FIELDS, PRODUCT_VERSION, 'products'
+        )
+    except (InvalidQuery, InvalidCursor, InvalidFilter) as e:
+        return bad_request(e)
+
+
+
+
+# /api/products/<slug>/
+@require_GET
+def product_detail(request, slug):
+    try:
+        fields = select_fields(request, PRODUCT_FIELDS, PRODUCT_FIELDS)
+    except InvalidQuery as e:
+        return bad_request(e)
+
+    product = models.Product.objects.filter(slug=slug, available=True)
+    version = product.values_list('id', *PRODUCT_VERSION, *related_columns(fields, PRODUCT_FIELDS)).first()
+    if version is None:
+        raise Http404('No such product')
+
+    etag = make_etag('product', fields, version)
+    response = not_modified(request, etag)
+    if response is not None:
+        return response
+
+    product = load(product, fields, PRODUCT_FIELDS).get(id=version[0])
+    response = JsonResponse({field : PRODUCT_FIELDS[field][1](product) for field in fields})
+    response['ETag'] = etag
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+
+
+# /api/products/<slug>/ratings/   newest first
+@require_GET
+def product_ratings(request, slug):
+    product_id = models.Product.objects.filter(slug=slug, available=True).values_list('id', flat=True).first()
+    if product_id is None:
+        raise Http404('No such product')
+
+    try:
+        fields = select_fields(request, RATING_FIELDS, RATING_FIELDS)
+        return paged_list(
+            request, models.Rating.objects.filter(product_id=product_id), 'newest', fields, RATING_FIELDS, RATING_VERSION, 'ratings'
+        )
+    except (InvalidQuery, InvalidCursor) as e:
+        return bad_request(e)
@@ -0,0 +1,274 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import FileSystemStorage
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, Http404, StreamingHttpResponse
+from django.urls import re_path
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+
+try:
+    import brotli                                                                   # optional; without it only .gz copies are made
+except ImportError:
+    brotli = None
+
+
+
+# Static & media serving
+# Without a CDN every image/css request reaches a Python worker, so that worker should answer cheaply:
+#   - file names carry a content hash (style.3f2a9c1b7e4d.css) --> the browser may cache them forever
+#   - ETag / If-None-Match --> 304 without a body for everything else
+#   - Range requests --> 206 (video, big images, resumed downloads)
+#   - precompressed .br / .gz copies are sent when the browser accepts them (made once at collectstatic)
+
+
+IMMUTABLE = 'public, max-age=31536000, immutable'                                  # 1 year; the name changes when the content does
+REVALIDATE = 'public, max-age=0, must-revalidate'                                  # unhashed name --> ask every time, usually a 304
+
+HASHED_NAME = re.compile(r'\.[0-9a-f]{12}\.[^./]+$|(^|/)[0-9a-f]{64}/')             # name.<hash12>.ext  or  .../<sha256>/... (image derivatives)
+
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]                                        # preferred first
+
+COMPRESSIBLE = ('text/', 'application/javascript', 'application/json', 'image/svg+xml', 'application/xml')
+MIN_COMPRESS_SIZE = 1024
+
+CHUNK_SIZE = 64 * 1024
+
+
+
+
+# Precompressed copies
+
+def is_compressible(path):
+    content_type = mimetypes.guess_type(path)[0] or ''
+    return content_type.startswith(COMPRESSIBLE)
+
+
+
+# writes path.gz (and path.br) next to the file, only if they are actually smaller
+def compress_file(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    if len(data) < MIN_COMPRESS_SIZE:
+        return []
+
+    written = []
+    compressors = [('.gz', lambda d: gzip.compress(d, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        compressors.insert(0, ('.br', lambda d: brotli.compress(d, quality=11)))
+
+    for suffix, compress in compressors:
+        compressed = compress(data)
+        if len(compressed) < len(data):
+            with open(path + suffix, 'wb') as f:
+                f.write(compressed)
+            written.append(path + suffix)
+
+    return written
+
+
+
+
+# Storages (settings.STORAGES)
+
+# collectstatic --> style.css is copied as style.<hash12>.css (+ .gz/.br); {% static %} returns the hashed name
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    manifest_strict = False
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+
+        if dry_run:
+            return
+
+        for name in self.hashed_files.values():
+            if is_compressible(name):
+                compress_file(self.path(name))
+
+    def url(self, name, force=False):
+        try:
+            return super().url(name, force)
+        except ValueError:                                                          # not collected yet (dev / tests) --> plain name
+            return FileSystemStorage.url(self, name)
+
+
+
+# Uploads are saved as products/2026/01/29/shirt.<hash12>.jpg
+# The same picture uploaded twice --> the same file, stored once
+class HashedMediaStorage(FileSystemStorage):
+    unhashed_dirs = ('derivatives/',)                                               # already keyed by content hash (images.py)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+
+        if name.startswith(self.unhashed_dirs):
+            return super().save(name, content, max_length)
+
+        digest = hashlib.sha256()
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        if hasattr(content, 'seek'):
+            content.seek(0)
+
+        root, ext = os.path.splitext(name)
+        name = f'{root}.{digest.hexdigest()[:12]}{ext}'
+
+        if self.exists(name):                                                       # same content is already there
+            return name.replace('\\', '/')
+
+        return super().save(name, content, max_length)
+
+
+
+
+# Serving
+
+def etag_for(stat, encoding=''):
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}{"-" + encoding if encoding else ""}"'
+
+
+
+def accepted_encodings(request):
+    header = request.headers.get('Accept-Encoding', '')
+    accepted = set()
+
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        if params.strip().replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        accepted.add(coding.strip().lower())
+
+    return accepted
+
+
+
+# "bytes=500-999" / "bytes=500-" / "bytes=-500"  -->  (start, end) inclusive; None = not satisfiable
+# multiple ranges are answered with the whole file (allowed by RFC 9110)
+def parse_range(header, size):
+    match = re.fullmatch(r'bytes=(\d*)-(\d*)', header.strip())
+    if not match or match.groups() == ('', ''):
+        return 'ignore'
+
+    start, end = match.groups()
+
+    if start == '':                                                                 # last N bytes
+        length = int(end)
+        if length == 0:
+            return None
+        return max(size - length, 0), size - 1
+
+    start = int(start)
+    end = size - 1 if end == '' else min(int(end), size - 1)
+
+    if start >= size or start > end:
+        return None
+
+    return start, end
+
+
+
+def read_range(f, start, length):
+    f.seek(start)
+    try:
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+
+@require_safe
+def serve(request, path, document_root):
+    try:
+        fullpath = safe_join(document_root, path)
+    except SuspiciousFileOperation:                                                 # ../ outside the root
+        raise Http404
+
+    if not os.path.isfile(fullpath):
+        raise Http404
+
+    content_type = mimetypes.guess_type(fullpath)[0] or 'application/octet-stream'
+    range_header = request.headers.get('Range')
+
+
+    # pick the precompressed copy (not for range requests: ranges are on the plain bytes)
+    encoding, served_path = '', fullpath
+    if not range_header:
+        accepted = accepted_encodings(request)
+        for coding, suffix in ENCODINGS:
+            if coding in accepted and os.path.isfile(fullpath + suffix):
+                encoding, served_path = coding, fullpath + suffix
+                break
+
+    stat = os.stat(served_path)
+    etag = etag_for(stat, encoding)
+
+
+    headers = {
+        'ETag' : etag,
+        'Last-Modified' : http_date(stat.st_mtime),
+        'Cache-Control' : IMMUTABLE if HASHED_NAME.search(path) else REVALIDATE,
+        'Accept-Ranges' : 'bytes',
+        'Vary' : 'Accept-Encoding',
+    }
+
+
+    if_none_match = request.headers.get('If-None-Match', '')
+    if if_none_match == '*' or etag in [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]:
+        response = HttpResponseNotModified()
+        for key, value in headers.items():
+            response[key] = value
+        return response
+
+
+    if range_header and request.headers.get('If-Range', etag) in (etag, headers['Last-Modified']):
+        byte_range = parse_range(range_header, stat.st_size)
+
+        if byte_range is None:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stat.st_size}'
+            return response
+
+        if byte_range != 'ignore':
+            start, end = byte_range
+            response = StreamingHttpResponse(
+                read_range(open(served_path, 'rb'), start, end - start + 1), status=206, content_type=content_type
+            )
+            response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+            response['Content-Length'] = str(end - start + 1)
+            for key, value in headers.items():
+                response[key] = value
+            return response
+
+
+    response = FileResponse(open(served_path, 'rb'), content_type=content_type)
+    response['Content-Length'] = str(stat.st_size)
+    if encoding:
+        response['Content-Encoding'] = encoding
+    for key, value in headers.items():
+        response[key] = value
+    return response
+
+
+
+# urlpatterns += asset_urls(settings.MEDIA_URL, settings.MEDIA_ROOT)
+def asset_urls(prefix, document_root):
+    prefix = prefix.lstrip('/')
+    if not prefix or '://' in prefix:                                               # served somewhere else (CDN)
+        return []
+
+    return [re_path(rf'^{re.escape(prefix)}(?P<path>.*)$', serve, {'document_root': str(document_root)})]
@@ -0,0 +1,209 @@
+from asgiref.sync import sync_to_async
+
+from django.shortcuts import render, redirect, aget_object_or_404
+from django.http import JsonResponse
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.cache import never_cache
+
+from . import models
+from . import views
+from .forms import RatingForm
+from .cart import aget_cart_summary
+from .context_processor import arefresh_cart_items_count, cart_count_key
+from .recommendations import related_products as related_products_for
+from .sslcommerz import agenerate_sslcommerz_payment
+from .gateway import GatewayError
+from .pagecache import anonymous_page_cache
+
+from django.core.cache import cache
+
+
+
+# Async versions of the catalog, cart & payment views (ASGI deployment, settings.ASYNC_VIEWS)
+# Same URLs, templates and messages as views.py.
+#
+# While a request waits for the database or the payment gateway, the worker serves other requests
+# (no thread is held per waiting request). Data is loaded with the async ORM; template rendering
+# and the raw-SQL parts (facets, full-text search, cursor pagination) stay sync and run in a thread.
+
+
+arender = sync_to_async(render)
+
+
+
+
+# Home page
+@anonymous_page_cache
+async def home(request):
+    featured_products = [product async for product in models.Product.objects.filter(available=True).order_by('-created_at')[:8]]
+    categories = [category async for category in models.Category.objects.all()]
+
+    context = {
+        'featured_products' : featured_products,
+        'categories' : categories
+    }
+
+    return await arender(request, 'shop/home.html', context)
+
+
+
+
+# All Product List page (filters, facets, search & pagination: see views.product_list_context)
+@anonymous_page_cache
+async def product_list(request, category_slug = None):
+    context = await sync_to_async(views.product_list_context)(request, category_slug)
+    return await arender(request, 'shop/product_list.html', context)
+
+
+
+
+# Single product details page
+async def product_detail(request, slug):
+    product = await aget_object_or_404(models.Product.objects.select_related('category'), slug = slug, available = True)
+    related_products = await sync_to_async(related_products_for)(product)
+
+    user = await request.auser()
+    user_rating = None
+
+    if user.is_authenticated:
+        user_rating = await models.Rating.objects.filter(product=product, user=user).afirst()
+
+
+    context = {
+        'product' : product,
+        'related_products' : related_products,
+        'user_rating' : user_rating,
+        'rating_form' : RatingForm(instance=user_rating)
+    }
+
+    return await arender(request, 'shop/product_detail.html', context)
+
+
+
+
+
+
+
+
+
+# Cart
+
+@never_cache
+async def cart_count(request):
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({'count' : 0})
+
+    count = await cache.aget(cart_count_key(user.id))
+    if count is None:
+        count = await arefresh_cart_items_count(user)
+
+    return JsonResponse({'count' : count})
+
+
+
+@login_required
+async def cart_detail(request):
+    summary = await aget_cart_summary(await request.auser())
+    return await arender(request, 'shop/cart.html', {'cart' : summary.cart, 'summary' : summary})
+
+
+
+@login_required
+async def cart_add(request, product_id):
+    user = await request.auser()
+    product = await aget_object_or_404(models.Product, id = product_id)
+    cart, _ = await models.Cart.objects.aget_or_create(user = user)
+
+    try:
+        cart_item = await models.CartItem.objects.aget(cart=cart, product=product)
+        if cart_item.quantity >= product.stock:
+            messages.warning(request, f"Cannot add more {product.name}. Only {product.stock} in stock!")
+        else:
+            cart_item.quantity += 1
+            await cart_item.asave()
+            messages.success(request, f"{product.name} has been added to your cart!")
+
+    except models.CartItem.DoesNotExist:
+        await models.CartItem.objects.acreate(cart=cart, product = product, quantity = 1)
+        messages.success(request, f"{product.name} has been added to your cart!")
+
+    await arefresh_cart_items_count(user)
+    return redirect('product_detail', slug=product.slug)
+
+
+
+@login_required
+async def cart_update(request, product_id):
+    user = await request.auser()
+    cart = await aget_object_or_404(models.Cart, user=user)
+    product = await aget_object_or_404(models.Product, id=product_id)
+    cart_item = await aget_object_or_404(models.CartItem, cart=cart, product=product)
+
+    quantity = int(request.POST.get('quantity', 1))
+
+    if quantity > product.stock:
+        messages.warning(request, f"Cannot add {quantity} items. Only {product.stock} in stock!")
+        quantity = product.stock
+
+    if quantity <= 0:
+        await cart_item.adelete()
+        messages.success(request, f"{product.name} has been removed from your cart!")
+    else:
+        cart_item.quantity = quantity
+        await cart_item.asave()
+        messages.success(request, f"Cart updated successfully!!")
+
+    await arefresh_cart_items_count(user)
+    return redirect('cart_detail')
+
+
+
+@login_required
+async def cart_remove(request, product_id):
+    user = await request.auser()
+    cart = await aget_object_or_404(models.Cart, user=user)
+    product = await aget_object_or_404(models.Product, id=product_id)
+    cart_item = await aget_object_or_404(models.CartItem, cart=cart, product=product)
+
+    await cart_item.adelete()
+    messages.success(request, f"{product.name} has been Deleted from your cart!")
+    await arefresh_cart_items_count(user)
+
+    return redirect('cart_detail')
+
+
+
+
+
+
+
+
+
+# Payment Process
+# the gateway call is awaited (httpx, see gateway.py) --> a slow gateway doesn't hold a worker thread
+
+@csrf_exempt
+@login_required
+async def payment_process(request):
+    order_id = await request.session.aget('order_id')
+
+    if not order_id:
+        return redirect('home')
+
+    order = await aget_object_or_404(models.Order, id=order_id)
+
+    try:
+        payment_data = await agenerate_sslcommerz_payment(request, order)
+    except GatewayError:
+        messages.error(request, 'Payment gateway is not responding. Please Try again.')
+        return redirect('checkout')
+
+
+    if payment_data.get('status') == 'SUCCESS':
+        return redirect(payment_data['GatewayPageURL'])
+
+    messages.error(request, 'Payment gateway error. Please Try again.')
+    return redirect('checkout')
@@ -0,0 +1,438 @@
+import json
+import os
+import queue
+import random
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import models, fake_gateway
+
+
+
+# Benchmark suite for the shop flows
+# Every scenario is 1 "user action" (may be more than 1 request, e.g. add to cart + open cart).
+#
+# 2 drivers:
+#   client : Django test Client in this process --> exact queries per request; the whole run is rolled back
+#   http   : real HTTP against a running server (gunicorn/uvicorn/runserver), N threads
+#            queries per request come from the 'Server-Timing' header (settings.SERVER_TIMING)
+#
+# Result (JSON): per scenario requests, errors, p50/p95/p99 ms, throughput and queries per request,
+# plus the git commit, so 2 runs can be compared (compare()).
+#
+# compare_servers(): the same load against a WSGI (gunicorn, threads) and an ASGI (uvicorn, async views) deployment
+
+
+SCENARIOS = ['home', 'product_list', 'product_filters', 'search', 'category', 'product_detail', 'cart', 'checkout']
+
+# these call the payment gateway --> point SSLCOMMERZ_PAYMENT_URL at the fake gateway (compare_servers() does)
+GATEWAY_SCENARIOS = ['payment', 'mixed']
+
+LOGIN_SCENARIOS = ['cart', 'checkout', 'payment', 'mixed']
+
+# mixed load: mostly browsing, some cart & checkout (+ payment) --> weights
+MIXED = {
+    'home' : 15, 'product_list' : 15, 'product_filters' : 10, 'search' : 10, 'category' : 10, 'product_detail' : 20,
+    'cart' : 12, 'payment' : 8,
+}
+
+SEARCH_WORDS = ['shirt', 'blue', 'jeans', 'cotton', 'jacket', 'premium', 'sneaker', 'watch']
+
+CHECKOUT_DATA = {
+    'first_name' : 'Bench', 'last_name' : 'User', 'email' : 'bench@example.com', 'address' : 'Road 1',
+    'phone' : '01700000000', 'postal_code' : '1200', 'city' : 'Dhaka', 'note' : 'benchmark',
+}
+
+SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries')
+
+
+
+
+# Drivers
+# get/post return (status, queries or None)
+
+# a Host the project accepts ('testserver' is only allowed while running the tests)
+def local_host():
+    hosts = [host for host in settings.ALLOWED_HOSTS if host != '*' and '://' not in host and not host.startswith('.')]
+    return 'localhost' if 'localhost' in hosts or not hosts else hosts[0]
+
+
+class ClientDriver:
+    name = 'client'
+
+    def __init__(self):
+        self.client = Client(HTTP_HOST=local_host())
+
+    def login(self, username, password):
+        return self.client.login(username=username, password=password)
+
+    def request(self, method, path, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(path, data or {})
+        return response.status_code, len(queries.captured_queries)
+
+    def get(self, path, params=None):
+        return self.request('get', path, params)
+
+    def post(self, path, data=None):
+        return self.request('post', path, data)
+
+
+
+class HttpDriver:
+    name = 'http'
+
+    def __init__(self, base_url, timeout=30):
+        import requests
+
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+        self.timeout = timeout
+
+    # the settings mark the session/csrf cookies 'Secure' (TLS proxy in production);
+    # against a plain-http local server they still have to be sent back
+    def keep_cookies(self, response):
+        if self.base_url.startswith('http://'):
+            for cookie in self.session.cookies:
+                cookie.secure = False
+        return response
+
+    def csrf_token(self):
+        if 'csrftoken' not in self.session.cookies:
+            self.keep_cookies(self.session.get(self.base_url + reverse('login'), timeout=self.timeout))
+        return self.session.cookies.get('csrftoken', '')
+
+    def login(self, username, password):
+        token = self.csrf_token()
+        response = self.session.post(
+            self.base_url + reverse('login'), {'username' : username, 'password' : password, 'csrfmiddlewaretoken' : token},
+            headers={'Referer' : self.base_url + reverse('login')}, allow_redirects=False, timeout=self.timeout,
+        )
+        self.keep_cookies(response)
+        return response.status_code == 302
+
+    def result(self, response):
+        self.keep_cookies(response)
+        match = SERVER_TIMING_QUERIES.search(response.headers.get('Server-Timing', ''))
+        return response.status_code, int(match.group(1)) if match else None
+
+    def get(self, path, params=None):
+        return self.result(self.session.get(self.base_url + path, params=params, allow_redirects=False, timeout=self.timeout))
+
+    def post(self, path, data=None):
+        data = {**(data or {}), 'csrfmiddlewaretoken' : self.csrf_token()}
+        return self.result(self.session.post(
+            self.base_url + path, data, headers={'Referer' : self.base_url + path}, allow_redirects=False, timeout=self.timeout,
+        ))
+
+
+
+
+# Scenarios: 1 action --> list of (status, queries)
+
+class Catalog:
+    """Ids/slugs the scenarios pick from (loaded once)."""
+
+    def __init__(self, limit=5000):
+        products = models.Product.objects.filter(available=True, stock__gt=0).order_by('id').values_list('id', 'slug')[:limit]
+        self.products = list(products)
+        self.categories = list(models.Category.objects.values_list('slug', flat=True))
+
+        if not self.products or not self.categories:
+            raise ValueError('No products to benchmark; run "python manage.py generate_catalog" first')
+
+
+
+def run_scenario(name, driver, rng, catalog):
+    product_id, slug = rng.choice(catalog.products)
+
+    if name == 'home':
+        return [driver.get(reverse('home'))]
+
+    if name == 'product_list':
+        return [driver.get(reverse('product_list'))]
+
+    if name == 'product_filters':
+        low = rng.randrange(100, 20000)
+        params = rng.choice([
+            {'sort' : 'price_low'}, {'sort' : 'rating'}, {'rating' : rng.randint(1, 4)},
+            {'min_price' : low, 'max_price' : low + rng.randrange(500, 10000)},
+        ])
+        return [driver.get(reverse('product_list'), params)]
+
+    if name == 'search':
+        return [driver.get(reverse('product_list'), {'search' : rng.choice(SEARCH_WORDS)})]
+
+    if name == 'category':
+        return [driver.get(reverse('product_list_by_category', args=[rng.choice(catalog.categories)]))]
+
+    if name == 'product_detail':
+        return [driver.get(reverse('product_detail', args=[slug]))]
+
+    if name == 'cart':
+        return [driver.post(reverse('cart_add', args=[product_id])), driver.get(reverse('cart_detail'))]
+
+    if name == 'checkout':
+        return [
+            driver.post(reverse('cart_add', args=[product_id])),
+            driver.get(reverse('checkout')),
+            driver.post(reverse('checkout'), CHECKOUT_DATA),                       # --> redirect to the gateway (not followed)
+        ]
+
+    if name == 'payment':                                                           # checkout + the gateway call (slow, external)
+        return [
+            driver.post(reverse('cart_add', args=[product_id])),
+            driver.post(reverse('checkout'), CHECKOUT_DATA),
+            driver.get(reverse('payment_process')),                                 # --> redirect to the gateway's page (not followed)
+        ]
+
+    if name == 'mixed':
+        return run_scenario(rng.choices(list(MIXED), weights=list(MIXED.values()))[0], driver, rng, catalog)
+
+    raise ValueError(f'Unknown scenario {name!r}')
+
+
+
+
+# Statistics
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    if len(latencies) == 1:
+        return latencies * 3
+    quantiles = statistics.quantiles(latencies, n=100)
+    return quantiles[49], quantiles[94], quantiles[98]
+
+
+
+def summarize(samples, elapsed):
+    latencies = [latency * 1000 for latency, _, _ in samples]
+    queries = [count for _, _, counts in samples for count in counts if count is not None]
+    p50, p95, p99 = percentiles(latencies)
+
+    return {
+        'requests' : len(samples),
+        'errors' : sum(1 for _, failed, _ in samples if failed),
+        'p50_ms' : round(p50, 2),
+        'p95_ms' : round(p95, 2),
+        'p99_ms' : round(p99, 2),
+        'throughput_rps' : round(len(samples) / elapsed, 2) if elapsed else None,
+        'queries_per_request' : round(sum(queries) / len(queries), 2) if queries else None,
+    }
+
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+
+
+# Runner
+# users: [(username, password)] --> logged-in scenarios (cart, checkout) rotate through them
+
+def run(scenarios=SCENARIOS, requests_per_scenario=100, warmup=5, concurrency=1, driver='client',
+        base_url=None, users=(), seed=42):
+
+    rng = random.Random(seed)
+    catalog = Catalog()
+    results = {}
+
+    if driver == 'client':
+        make_driver, concurrency = ClientDriver, 1
+    else:
+        make_driver = lambda: HttpDriver(base_url)
+
+
+    with transaction.atomic() if driver == 'client' else nullcontext():             # client driver: leave the database as it was
+        for name in scenarios:
+            drivers = [make_driver() for _ in range(concurrency)]                   # fresh sessions per scenario
+
+            if name in LOGIN_SCENARIOS:
+                if not users:
+                    raise ValueError(f'Scenario {name!r} needs a user (generate_catalog creates them)')
+                for i, each in enumerate(drivers):
+                    each.login(*users[i % len(users)])
+
+            results[name] = run_one(name, drivers, rng, catalog, requests_per_scenario, warmup)
+
+        if driver == 'client':
+            transaction.set_rollback(True)
+
+
+    return {
+        'commit' : git_commit(),
+        'created_at' : timezone.now().isoformat(),
+        'driver' : driver,
+        'base_url' : base_url,
+        'concurrency' : concurrency,
+        'seed' : seed,
+        'catalog' : {'products' : models.Product.objects.count(), 'categories' : len(catalog.categories)},
+        'scenarios' : results,
+    }
+
+
+
+# 1 driver (session) per thread: a thread takes a free driver, runs 1 action, gives it back
+def run_one(name, drivers, rng, catalog, count, warmup):
+    free = queue.Queue()
+    for driver in drivers:
+        free.put(driver)
+
+    seeds = [rng.random() for _ in range(warmup + count)]
+
+    def action(index):
+        driver = free.get()
+        start = time.perf_counter()
+        try:
+            responses = run_scenario(name, driver, random.Random(seeds[index]), catalog)
+            failed = any(status >= 400 for status, _ in responses)
+        except Exception:                                                           # connection errors etc. count as failures
+            responses, failed = [], True
+        finally:
+            free.put(driver)
+        return time.perf_counter() - start, failed, [queries for _, queries in responses]
+
+
+    for index in range(warmup):                                                     # caches, connections, ...
+        action(index)
+
+    start = time.perf_counter()
+    if len(drivers) == 1:
+        samples = [action(index) for index in range(warmup, warmup + count)]
+    else:
+        with ThreadPoolExecutor(len(drivers)) as pool:
+            samples = list(pool.map(action, range(warmup, warmup + count)))
+    elapsed = time.perf_counter() - start
+
+    return summarize(samples, elapsed)
+
+
+
+
+# WSGI vs ASGI
+# every server runs the project with a fake payment gateway (gateway_latency seconds per call), so the
+# checkout part of the load waits on the network like in production
+
+SERVERS = {
+    'wsgi' : ['{python}', '-m', 'gunicorn', 'ShopNest.wsgi:application', '--bind', '127.0.0.1:{port}', '--workers', '{workers}', '--threads', '{threads}'],
+    'asgi' : ['{python}', '-m', 'uvicorn', 'ShopNest.asgi:application', '--port', '{port}', '--workers', '{workers}', '--no-access-log'],
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+
+@contextmanager
+def serve(argv, env=None, timeout=30, **options):
+    port = free_port()
+    argv = [part.format(port=port, python=sys.executable, **options) for part in argv]
+
+    process = subprocess.Popen(argv, env={**os.environ, **(env or {})}, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            if process.poll() is not None:
+                raise ValueError(f'{" ".join(argv)} exited with code {process.returncode} (is it installed?)')
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise ValueError(f'{" ".join(argv)} did not start within {timeout}s')
+                time.sleep(0.2)
+
+        yield f'http://127.0.0.1:{port}'
+
+    finally:
+        process.terminate()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+
+def compare_servers(servers=('wsgi', 'asgi'), scenarios=('mixed',), requests_per_scenario=200, concurrency=32,
+                    workers=2, threads=8, gateway_latency=0.3, users=(), seed=42, warmup=10):
+
+    gateway = fake_gateway.make_server(latency=gateway_latency)
+    threading.Thread(target=gateway.serve_forever, daemon=True).start()
+
+    env = {
+        'SSLCOMMERZ_PAYMENT_URL' : fake_gateway.base_url(gateway) + fake_gateway.PAYMENT_PATH,
+        'SSLCOMMERZ_VALIDATION_URL' : fake_gateway.base_url(gateway) + fake_gateway.VALIDATION_PATH,
+    }
+    results = {}
+
+    try:
+        for name in servers:
+            with serve(SERVERS[name], env, workers=workers, threads=threads) as url:
+                results[name] = run(
+                    scenarios=scenarios, requests_per_scenario=requests_per_scenario, warmup=warmup,
+                    concurrency=concurrency, driver='http', base_url=url, users=users, seed=seed,
+                )
+    finally:
+        gateway.shutdown()
+        gateway.server_close()
+
+    return results
+
+
+
+
+# Comparing 2 runs
+# regression = p95 slower by more than 'threshold' percent, or more queries per request, or new errors
+
+def compare(baseline, current, threshold=20.0):
+    rows, regressions = [], []
+
+    for name, now in current['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if before is None:
+            continue
+
+        change = (now['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0.0
+        rows.append((name, before['p95_ms'], now['p95_ms'], change, before['queries_per_request'], now['queries_per_request']))
+
+        if change > threshold:
+            regressions.append(f'{name}: p95 {before["p95_ms"]}ms --> {now["p95_ms"]}ms (+{change:.0f}%)')
+        if (before['queries_per_request'] or 0) < (now['queries_per_request'] or 0):
+            regressions.append(f'{name}: queries per request {before["queries_per_request"]} --> {now["queries_per_request"]}')
+        if now['errors'] > before['errors']:
+            regressions.append(f'{name}: errors {before["errors"]} --> {now["errors"]}')
+
+    return rows, regressions
+
+
+
+def save(result, path):
+    with open(path, 'w') as f:
+        json.dump(result, f, indent=2)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
@@ -0,0 +1,466 @@
+import logging
+import pickle
+import re
+import socket
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+
+from . import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+
+# 2-tier cache backend (settings.CACHES)
+#   L1 : in this process, LRU bounded by entries and bytes --> no network round trip for hot keys
+#   L2 : shared Redis (or anything speaking the Redis protocol) --> same data for every worker
+#
+# An L1 copy of an L2 value is trusted for L1_TIMEOUT seconds only (writes in other workers show up after that;
+# writes in this worker show up at once). L1_TIMEOUT 0 --> L1 is only used while L2 is unavailable (sessions).
+# No LOCATION, or L2 unreachable --> L1 alone, like the local-memory backend (RETRY_SECONDS before trying L2 again).
+#
+# Hit ratios per tier: shop.metrics counters cache.<name>_l1.hits / misses, cache.<name>_l2.hits / misses
+# Memory per tier: stats()   (both on /metrics/)
+#
+# Several aliases may share 1 Redis database (default & sessions do), so clear() only deletes the keys under this
+# alias's KEY_PREFIX (SCAN + DEL), never FLUSHDB. Give every alias on the same CACHE_URL its own KEY_PREFIX.
+
+
+FAILED = object()                                                                   # L2 call failed --> fall back to L1
+
+SCAN_COUNT = 1000                                                                   # keys per SCAN round trip in clear()
+
+
+class ResponseError(Exception):
+    pass
+
+
+
+# Values: ints as digits (so INCRBY works on them in L2), everything else pickled
+def dumps(value):
+    if isinstance(value, int) and not isinstance(value, bool):
+        return str(value).encode()
+    return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def loads(data):
+    try:
+        return int(data)
+    except ValueError:
+        return pickle.loads(data)
+
+
+
+
+# L1
+
+class LocalLRU:
+
+    def __init__(self, max_entries=10000, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.evictions = 0
+        self._data = OrderedDict()                                                  # key --> (data, expires or None), oldest use first
+        self._lock = threading.Lock()
+
+    def _pop(self, key):
+        data, _ = self._data.pop(key)
+        self.bytes -= len(data)
+
+    def _live(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        if item[1] is not None and item[1] <= time.monotonic():
+            self._pop(key)
+            return None
+        return item
+
+    def get(self, key):
+        with self._lock:
+            item = self._live(key)
+            if item is None:
+                return None
+            self._data.move_to_end(key)
+            return item[0]
+
+    def set(self, key, data, timeout=None):
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+            if len(data) > self.max_bytes or not self.max_entries:
+                return
+
+            self._data[key] = (data, None if timeout is None else time.monotonic() + timeout)
+            self.bytes += len(data)
+
+            while len(self._data) > self.max_entries or self.bytes > self.max_bytes:
+                self._pop(next(iter(self._data)))
+                self.evictions += 1
+
+    def add(self, key, data, timeout=None):
+        with self._lock:
+            if self._live(key) is not None:
+                return False
+        self.set(key, data, timeout)
+        return True
+
+    def incr(self, key, delta):
+        with self._lock:
+            item = self._live(key)
+            if item is None:
+                raise ValueError(f"Key '{key}' not found")
+
+            value = int(item[0]) + delta
+            data = str(value).encode()
+            self.bytes += len(data) - len(item[0])
+            self._data[key] = (data, item[1])
+            return value
+
+    def touch(self, key, timeout=None):
+        with self._lock:
+            item = self._live(key)
+            if item is None:
+                return False
+            self._data[key] = (item[0], None if timeout is None else time.monotonic() + timeout)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            if self._live(key) is None:
+                return False
+            self._pop(key)
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries' : len(self._data), 'bytes' : self.bytes, 'max_entries' : self.max_entries,
+                'max_bytes' : self.max_bytes, 'evictions' : self.evictions,
+            }
+
+
+
+
+# L2 client: just enough of the Redis protocol (RESP) for a cache; 1 connection per thread
+# redis://[:password@]host[:port][/db]
+
+class RespClient:
+
+    def __init__(self, url, timeout=0.5):
+        url = urlparse(url)
+        self.host = url.hostname or '127.0.0.1'
+        self.port = url.port or 6379
+        self.password = url.password
+        self.db = int(url.path.strip('/') or 0)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._local.sock, self._local.reader = sock, sock.makefile('rb')
+
+        if self.password:
+            self.pipeline([('AUTH', self.password)])
+        if self.db:
+            self.pipeline([('SELECT', self.db)])
+
+    def close(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is not None:
+            self._local.reader.close()
+            sock.close()
+            self._local.sock = None
+
+    @staticmethod
+    def encode(command):
+        parts = [b'*%d\r\n' % len(command)]
+        for arg in command:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(parts)
+
+    def read(self):
+        line = self._local.reader.readline()
+        if not line:
+            raise ConnectionError('Connection closed by the server')
+
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode()
+        if kind == b'-':
+            return ResponseError(rest.decode())
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            if int(rest) < 0:
+                return None
+            data = self._local.reader.read(int(rest) + 2)
+            return data[:-2]
+        if kind == b'*':
+            return None if int(rest) < 0 else [self.read() for _ in range(int(rest))]
+        raise ConnectionError(f'Unexpected reply {line!r}')
+
+    # several commands in 1 round trip --> list of replies
+    def pipeline(self, commands):
+        if getattr(self._local, 'sock', None) is None:
+            self.connect()
+
+        try:
+            self._local.sock.sendall(b''.join(self.encode(command) for command in commands))
+            replies = [self.read() for _ in commands]
+        except (OSError, ConnectionError):
+            self.close()
+            raise
+
+        for reply in replies:
+            if isinstance(reply, ResponseError):
+                raise reply
+        return replies
+
+    def execute(self, *command):
+        return self.pipeline([command])[0]
+
+
+
+
+class TieredCache(BaseCache):
+
+    def __init__(self, server, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+
+        self.name = options.get('NAME', 'default')
+        self.l1 = LocalLRU(options.get('L1_MAX_ENTRIES', 10000), options.get('L1_MAX_BYTES', 64 * 1024 * 1024))
+        self.l1_timeout = options.get('L1_TIMEOUT', 5)
+        self.retry_seconds = options.get('RETRY_SECONDS', 5)
+        self.l2 = RespClient(server, options.get('SOCKET_TIMEOUT', 0.5)) if server else None
+
+        self._down_until = 0
+        self._diverged = False                                                      # L1 got writes while L2 was down
+
+
+    # L2 helpers
+
+    def l2_available(self):
+        return self.l2 is not None and time.monotonic() >= self._down_until
+
+    def l2_call(self, *commands):
+        if not self.l2_available():
+            return FAILED
+
+        try:
+            replies = self.l2.pipeline(commands)
+        except (OSError, ConnectionError) as error:
+            self._down_until = time.monotonic() + self.retry_seconds
+            metrics.incr(f'cache.{self.name}_l2.errors')
+            logger.warning('Cache %s: L2 unavailable (%s), using the local cache for %ss', self.name, error, self.retry_seconds)
+            return FAILED
+
+        if self._diverged:                                                          # back again: local-only writes are not in L2
+            self._diverged = False
+            self.l1.clear()
+        return replies if len(commands) > 1 else replies[0]
+
+    def ttl(self, timeout):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        return timeout                                                              # None = forever, <= 0 = expired at once
+
+    # how long L1 may keep a copy
+    def l1_ttl(self, timeout, l2_failed):
+        if l2_failed or self.l2 is None:
+            return timeout
+        if not self.l1_timeout:
+            return 0
+        return self.l1_timeout if timeout is None else min(timeout, self.l1_timeout)
+
+    def set_command(self, key, data, timeout, *flags):
+        if timeout is None:
+            return ('SET', key, data, *flags)
+        return ('SET', key, data, 'PX', max(int(timeout * 1000), 1), *flags)
+
+    def keep_local(self, key, data, timeout, l2_failed):
+        local = self.l1_ttl(timeout, l2_failed)
+        if l2_failed and self.l2 is not None:
+            self._diverged = True
+
+        if local == 0:
+            self.l1.delete(key)
+        else:
+            self.l1.set(key, data, local)
+
+    def l1_in_use(self):
+        return self.l2 is None or self.l1_timeout or not self.l2_available()
+
+
+    # Cache API
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self.get_many_keys([key]).get(key, default)
+
+    def get_many(self, keys, version=None):
+        keys = {self.make_and_validate_key(key, version=version) : key for key in keys}
+        found = self.get_many_keys(list(keys))
+        return {keys[key] : value for key, value in found.items()}
+
+    def get_many_keys(self, keys):
+        found, missing = {}, []
+
+        for key in keys:
+            data = self.l1.get(key)
+            if data is None:
+                missing.append(key)
+            else:
+                found[key] = loads(data)
+
+        if self.l1_in_use():
+            metrics.incr(f'cache.{self.name}_l1.hits', len(found))
+            metrics.incr(f'cache.{self.name}_l1.misses', len(missing))
+
+        if not missing or not self.l2_available():
+            return found
+
+        replies = self.l2_call(('MGET', *missing))
+        if replies is FAILED:
+            return found
+
+        hits = 0
+        for key, data in zip(missing, replies):
+            if data is not None:
+                hits += 1
+                found[key] = loads(data)
+                if self.l1_timeout:
+                    self.l1.set(key, data, self.l1_timeout)
+
+        metrics.incr(f'cache.{self.name}_l2.hits', hits)
+        metrics.incr(f'cache.{self.name}_l2.misses', len(missing) - hits)
+        return found
+
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key : value}, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self.ttl(timeout)
+        items = [(self.make_and_validate_key(key, version=version), dumps(value)) for key, value in data.items()]
+
+        if timeout is not None and timeout <= 0:
+            self.delete_many_keys([key for key, _ in items])
+            return []
+
+        if items:
+            reply = self.l2_call(*[self.set_command(key, value, timeout) for key, value in items])
+            for key, value in items:
+                self.keep_local(key, value, timeout, reply is FAILED)
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        timeout, data = self.ttl(timeout), dumps(value)
+
+        reply = self.l2_call(self.set_command(key, data, timeout, 'NX'))
+        if reply is FAILED:
+            self._diverged = self.l2 is not None
+            return self.l1.add(key, data, timeout)
+        if reply is None:                                                           # already there
+            return False
+
+        self.keep_local(key, data, timeout, False)
+        return True
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_and_validate_key(key, version=version)
+
+        reply = self.l2_call(('EXISTS', key))
+        if reply is FAILED:
+            self._diverged = self.l2 is not None
+            return self.l1.incr(key, delta)
+        if not reply:
+            raise ValueError(f"Key '{key}' not found")
+
+        value = self.l2_call(('INCRBY', key, delta))
+        if value is FAILED:
+            raise ValueError(f"Key '{key}' could not be incremented")
+
+        self.keep_local(key, str(value).encode(), None, False)
+        return value
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        timeout = self.ttl(timeout)
+
+        command = ('PERSIST', key) if timeout is None else ('PEXPIRE', key, max(int(timeout * 1000), 1))
+        reply = self.l2_call(command)
+
+        local = self.l1.touch(key, self.l1_ttl(timeout, reply is FAILED))
+        return local if reply is FAILED else bool(reply)
+
+    def delete(self, key, version=None):
+        return bool(self.delete_many_keys([self.make_and_validate_key(key, version=version)]))
+
+    def delete_many(self, keys, version=None):
+        self.delete_many_keys([self.make_and_validate_key(key, version=version) for key in keys])
+
+    def delete_many_keys(self, keys):
+        if not keys:
+            return 0
+        local = sum(self.l1.delete(key) for key in keys)
+        reply = self.l2_call(('DEL', *keys))
+        return local if reply is FAILED else reply
+
+    # only this alias's keys: the database may hold other aliases (sessions) too
+    def clear(self):
+        self.l1.clear()
+
+        pattern = re.sub(r'([\\*?\[\]])', r'\\\1', self.key_prefix) + ':*'             # make_key(): '<prefix>:<version>:<key>'
+        cursor = b'0'
+        while True:
+            reply = self.l2_call(('SCAN', cursor, 'MATCH', pattern, 'COUNT', SCAN_COUNT))
+            if reply is FAILED:
+                return
+
+            cursor, keys = reply
+            if keys and self.l2_call(('DEL', *keys)) is FAILED:
+                return
+            if cursor == b'0':                                                   # back at the start --> every key seen
+                return
+
+    def close(self, **kwargs):
+        pass                                                                        # keep the L2 connection for the next request
+
+
+    # Memory & state per tier (/metrics/)
+
+    def stats(self):
+        stats = {'l1' : self.l1.stats()}
+        if self.l2 is None:
+            return stats
+
+        info = self.l2_call(('INFO', 'memory'), ('DBSIZE',))
+        if info is FAILED:
+            stats['l2'] = {'available' : False}
+            return stats
+
+        memory = dict(
+            line.split(':', 1) for line in info[0].decode().splitlines() if ':' in line
+        )
+        stats['l2'] = {
+            'available' : True, 'keys' : info[1],
+            'used_memory' : int(memory.get('used_memory', 0)), 'maxmemory' : int(memory.get('maxmemory', 0)),
+        }
+        return stats
@@ -0,0 +1,98 @@
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+from . import metrics
+
+
+
+# Product card fragments
+# A card (image, name, price, star loop, buttons) is the same for every visitor, so its HTML is cached per product.
+#
+# The key holds everything the card shows from the product row:
+#   card:<version>:<style>:<id>:<updated_at>:<rating_count>:<rating_avg>:<stock state>:<image hash>
+#   - product saved           --> updated_at changes           --> new key
+#   - rating added/changed    --> rating_count/rating_avg change (written with update(), no Product signal) --> new key
+#   - category saved/deleted  --> <version> is bumped by signals.py --> every card key changes
+# Old entries are never deleted, they just stop being asked for and expire.
+#
+# The csrf token differs per visitor, so the card is cached with a placeholder that is swapped on the way out.
+
+
+STYLES = {
+    'home' : 'shop/partials/product_card_home.html',
+    'list' : 'shop/partials/product_card_list.html',
+    'related' : 'shop/partials/product_card_related.html',
+}
+
+CACHE_TIMEOUT = 60 * 60
+VERSION_KEY = 'cards:version'
+
+CSRF_PLACEHOLDER = 'csrf-token-placeholder-9f1c'
+
+
+
+def get_version():
+    return cache.get_or_set(VERSION_KEY, 1, None)
+
+
+def invalidate():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:                                                                # key missing (cache restarted)
+        cache.set(VERSION_KEY, 1, None)
+
+
+
+def stock_state(product):
+    if product.stock <= 0:
+        return 'out'
+    return 'low' if product.stock <= 5 else 'in'
+
+
+
+def cache_key(product, style, version):
+    return ':'.join(str(part) for part in (
+        'card', version, style, product.id, product.updated_at.timestamp(),
+        product.rating_count, product.rating_avg, stock_state(product), product.image_variants.get('hash', ''),
+    ))
+
+
+
+def render_card(product, style):
+    return render_to_string(STYLES[style], {'product' : product, 'csrf_token' : CSRF_PLACEHOLDER})
+
+
+
+
+# HTML of all cards of a page: 1 get_many + 1 set_many for the misses
+# Cards with a search snippet depend on the query --> rendered every time, not cached
+def render_cards(products, style, csrf_token=''):
+    products = list(products)
+    version = get_version()
+
+    cacheable = {cache_key(product, style, version) : product for product in products if not getattr(product, 'search_snippet', None)}
+    cached = cache.get_many(list(cacheable))
+    missed = {}
+
+    html = []
+    for product in products:
+        if getattr(product, 'search_snippet', None):
+            html.append(render_card(product, style))
+            continue
+
+        key = cache_key(product, style, version)
+        card = cached.get(key)
+
+        if card is None:
+            card = missed[key] = render_card(product, style)
+
+        html.append(card)
+
+
+    if missed:
+        cache.set_many(missed, CACHE_TIMEOUT)
+
+    metrics.incr('cache.product_card.hits', len(cacheable) - len(missed))
+    metrics.incr('cache.product_card.misses', len(missed))
+
+    return ''.join(html).replace(CSRF_PLACEHOLDER, str(csrf_token))
@@ -0,0 +1,89 @@
+from dataclasses import dataclass
+from decimal import Decimal
+
+from django.db.models import Prefetch
+
+from . import models
+
+
+
+# Cart summary
+# The cart & checkout pages used to call cart.items.all / get_total_items / get_total_price many times,
+# and every call queried the items again (+ 1 query per item for 'item.product').
+# Here the cart is loaded once (cart + items with product & category = 2 queries),
+# the line costs & totals are calculated once, and the template gets a read-only snapshot.
+
+
+@dataclass(frozen=True)
+class CartLine:
+    item : models.CartItem
+    product : models.Product
+    quantity : int
+    cost : Decimal                                                                      # quantity * price
+
+
+
+@dataclass(frozen=True)
+class CartSummary:
+    cart : models.Cart
+    lines : tuple
+    total_items : int
+    total_price : Decimal
+
+    def __bool__(self):                                                                 # {% if summary %} --> cart has items
+        return bool(self.lines)
+
+    def __len__(self):
+        return len(self.lines)
+
+
+
+
+def cart_queryset(user):
+    items = models.CartItem.objects.select_related('product__category').order_by('id')
+    return models.Cart.objects.prefetch_related(Prefetch('items', queryset=items)).filter(user=user)
+
+
+def load_cart(user):
+    return cart_queryset(user).first()
+
+
+async def aload_cart(user):
+    return await cart_queryset(user).afirst()
+
+
+
+def summarize_cart(cart):
+    lines = tuple(
+        CartLine(item=item, product=item.product, quantity=item.quantity, cost=item.quantity * item.product.price)
+        for item in cart.items.all()                                                   # prefetched --> no query
+    ) if cart else ()
+
+    return CartSummary(
+        cart=cart,
+        lines=lines,
+        total_items=sum(line.quantity for line in lines),
+        total_price=sum((line.cost for line in lines), Decimal('0')),
+    )
+
+
+
+# cart of the user (created if missing) + its summary
+def get_cart_summary(user):
+    cart = load_cart(user)
+
+    if cart is None:
+        cart = models.Cart.objects.create(user=user)
+
+    return summarize_cart(cart)
+
+
+
+async def aget_cart_summary(user):
+    cart = await aload_cart(user)
+
+    if cart is None:
+        cart = await models.Cart.objects.acreate(user=user)
+        return CartSummary(cart=cart, lines=(), total_items=0, total_price=Decimal('0'))     # new cart: nothing to load
+
+    return summarize_cart(cart)
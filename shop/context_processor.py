@@ -1,13 +1,56 @@
-from .models import Cart
+from django.core.cache import cache
+from django.db.models import Sum
+
+from .models import CartItem
+
+
+
+# Number of items in the user's cart (shown in the navbar of every page)
+# Cached per user, so most page views run no cart query at all
+# The cart views call 'refresh_cart_items_count()' after every change (write-through)
+
+CART_COUNT_TIMEOUT = 60 * 5
+
+
+def cart_count_key(user_id):
+    return f'cart_items_count:{user_id}'
+
+
+
+# 1 SUM() query instead of loading every cart item
+def count_cart_items(user_id):
+    return CartItem.objects.filter(cart__user_id=user_id).aggregate(total=Sum('quantity'))['total'] or 0
+
+
+async def acount_cart_items(user_id):
+    return (await CartItem.objects.filter(cart__user_id=user_id).aaggregate(total=Sum('quantity')))['total'] or 0
+
+
+
+# count --> already known by the caller (e.g. 0 after checkout), no query needed
+def refresh_cart_items_count(user, count=None):
+    if count is None:
+        count = count_cart_items(user.id)
+    cache.set(cart_count_key(user.id), count, CART_COUNT_TIMEOUT)
+    return count
+
+
+async def arefresh_cart_items_count(user, count=None):
+    if count is None:
+        count = await acount_cart_items(user.id)
+    await cache.aset(cart_count_key(user.id), count, CART_COUNT_TIMEOUT)
+    return count
+
+
 
 def cart_items_count(request):
     if request.user.is_authenticated:
-        try:
-            cart = Cart.objects.get(user=request.user)
-            return {'cart_items_count' : cart.get_total_items()}                      # "cart_items_count" can be used globally in very view
+        count = cache.get(cart_count_key(request.user.id))
+
+        if count is None:
+            count = refresh_cart_items_count(request.user)
 
-        except Cart.DoesNotExist:
-            {'cart_items_count' : 0}
+        return {'cart_items_count' : count}                      # "cart_items_count" can be used globally in very view
 
 
-    return {'cart_items_count' : 0}
\ No newline at end of file
+    return {'cart_items_count' : 0}
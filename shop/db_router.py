@@ -0,0 +1,117 @@
+import random
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+
+
+# Primary / replica routing
+#   - reads of the catalog pages (settings.REPLICA_VIEWS, GET/HEAD) --> a random replica
+#   - everything else (cart, checkout, payment, admin, workers, commands) --> the primary ('default')
+#   - read-your-writes: once a request writes, the rest of it reads the primary, and a short-lived cookie
+#     keeps the same visitor on the primary for settings.REPLICA_STICKY_SECONDS (the replicas may lag behind)
+# Without replicas (settings.DATABASE_REPLICAS empty) everything goes to 'default'.
+
+
+STICKY_COOKIE = 'db_primary_until'
+
+
+class RoutingState:
+
+    def __init__(self, replica_allowed=False):
+        self.replica_allowed = replica_allowed
+        self.wrote = False
+
+
+_state = ContextVar('shop_db_routing', default=None)
+
+
+
+
+class PrimaryReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        replicas = getattr(settings, 'DATABASE_REPLICAS', [])
+
+        if replicas and state is not None and state.replica_allowed and not state.wrote:
+            return random.choice(replicas)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True                                                      # read-your-writes from here on
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True                                                                 # replicas hold the same data as the primary
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
+
+
+
+
+def pinned_to_primary(request):
+    try:
+        return float(request.COOKIES.get(STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        state = RoutingState()
+        token = _state.set(state)
+
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+
+        return self.pin(request, response, state)
+
+    async def __acall__(self, request):
+        state = RoutingState()
+        token = _state.set(state)
+
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+
+        return self.pin(request, response, state)
+
+    def pin(self, request, response, state):
+        if state.wrote or request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            sticky = getattr(settings, 'REPLICA_STICKY_SECONDS', 5)
+            response.set_cookie(STICKY_COOKIE, f'{time.time() + sticky:.3f}', max_age=sticky, httponly=True, samesite='Lax')
+
+        return response
+
+    # the view is known only now; session/auth reads before this point use the primary
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        state = _state.get()
+        match = request.resolver_match
+
+        state.replica_allowed = (
+            request.method in ('GET', 'HEAD')
+            and match is not None and match.url_name in getattr(settings, 'REPLICA_VIEWS', [])
+            and not pinned_to_primary(request)
+            and not state.wrote
+        )
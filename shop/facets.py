@@ -0,0 +1,177 @@
+import hashlib
+from decimal import Decimal, InvalidOperation
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, When, Value, IntegerField, BooleanField, Count, Min, Max
+
+from . import models, search
+
+
+
+# Facets for the product list sidebar
+# price min/max + price histogram + products per category + products per rating
+#
+# All of it comes from 1 grouped query:
+#   SELECT category_id, rating_bucket, price_bucket, rating_avg >= <rating filter>, COUNT(*), MIN(price), MAX(price)
+#   ... GROUP BY category_id, rating_bucket, price_bucket, rating_avg >= <rating filter>
+# and the result is cached per filter set until a product/category is saved or deleted (see signals.py)
+#
+# Which filters a facet respects:
+#   category counts --> search + rating (so the other categories still show their counts)
+#   rating counts   --> search + category
+#   price facts     --> search + category + rating (not the price filter, so the price inputs keep the full range)
+
+
+PRICE_EDGES = [0, 500, 1000, 2500, 5000, 10000, 25000, 50000]                     # histogram buckets (BDT); last bucket = 50000+
+
+RATING_LEVELS = [5, 4, 3, 2, 1]
+
+CACHE_TIMEOUT = 60 * 15
+VERSION_KEY = 'facets:version'
+
+
+
+def get_version():
+    return cache.get_or_set(VERSION_KEY, 1, None)
+
+
+# called on every product/category write --> every cached facet becomes stale at once
+def invalidate():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:                                                                # key missing (cache restarted)
+        cache.set(VERSION_KEY, 1, None)
+
+# rating saved --> the product's rating_avg is written with update() in the same, not yet committed transaction (no Product signal),
+
+# rating saved --> the product's rating_avg is written later in the same transaction (update_rating_stats, no signal),
+# so once more after the commit, otherwise a request running meanwhile could cache the old rating buckets
+def invalidate_on_commit():
+    invalidate()
+
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(invalidate)
+
+
+
+
+# same rules as the product list (views.number_param): Decimal, anything else / negative --> no rating filter
+def parse_rating(rating):
+    try:
+        rating = Decimal(str(rating).strip()) if rating else Decimal(0)
+    except InvalidOperation:
+        return Decimal(0)
+
+    if not rating.is_finite() or rating < 0:
+        return Decimal(0)
+    return rating.normalize()                                                         # '3.50' & '3.5' --> 1 cache key
+
+
+
+# same filters in a different spelling/order --> same cache key
+def normalize_filters(category_slug, search_text, rating):
+    search_text = ' '.join(search.tokenize(search_text or ''))
+    return category_slug or '', search_text, parse_rating(rating)
+
+
+
+def cache_key(filters):
+    digest = hashlib.md5(repr(filters).encode()).hexdigest()
+    return f'facets:{get_version()}:{digest}'
+
+
+
+
+def rating_bucket():
+    return Case(
+        *[When(rating_avg__gte=level, then=Value(level)) for level in RATING_LEVELS],
+        default=Value(0), output_field=IntegerField()
+    )
+
+
+def price_bucket():
+    return Case(
+        *[When(price__gte=edge, then=Value(i)) for i, edge in reversed(list(enumerate(PRICE_EDGES)))],
+        default=Value(0), output_field=IntegerField()
+    )
+
+
+
+
+def get_facets(category_slug=None, search_text=None, rating=None):
+    filters = normalize_filters(category_slug, search_text, rating)
+    key = cache_key(filters)
+
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_facets(*filters)
+        cache.set(key, facets, CACHE_TIMEOUT)
+
+    return facets
+
+
+
+def compute_facets(category_slug, search_text, rating):
+    products = models.Product.objects.all()
+
+    if search_text:
+        products = search.search_products(products, search_text)
+
+
+    # the 1 grouped query; 'selected' = passes the rating filter, which need not be a whole star (3.5)
+    selected = Case(When(rating_avg__gte=rating, then=Value(True)), default=Value(False), output_field=BooleanField())
+    rows = list(
+        products.order_by()
+        .annotate(rating_bucket=rating_bucket(), price_bucket=price_bucket(), selected=selected)
+        .values('category_id', 'rating_bucket', 'price_bucket', 'selected')
+        .annotate(count=Count('id'), min_price=Min('price'), max_price=Max('price'))
+    )
+
+    categories = list(models.Category.objects.values('id', 'name', 'slug'))
+    category_id = next((c['id'] for c in categories if c['slug'] == category_slug), None)
+
+
+
+    # products per category
+    category_counts = {}
+    for row in rows:
+        if row['selected']:
+            category_counts[row['category_id']] = category_counts.get(row['category_id'], 0) + row['count']
+
+    for c in categories:
+        c['count'] = category_counts.get(c['id'], 0)
+
+
+    in_category = [row for row in rows if category_id is None or row['category_id'] == category_id]
+
+
+    # products per rating ('4' --> products with 4+ stars, same as the rating filter)
+    rating_counts = {
+        level : sum(row['count'] for row in in_category if row['rating_bucket'] >= level)
+        for level in RATING_LEVELS
+    }
+
+
+    # price min/max & histogram
+    selected = [row for row in in_category if row['selected']]
+
+    histogram = []
+    for i, edge in enumerate(PRICE_EDGES):
+        count = sum(row['count'] for row in selected if row['price_bucket'] == i)
+        upper = PRICE_EDGES[i + 1] if i + 1 < len(PRICE_EDGES) else None
+        histogram.append({'low' : edge, 'high' : upper, 'count' : count})
+
+    largest = max([bar['count'] for bar in histogram] + [1])
+    for bar in histogram:
+        bar['percent'] = round(bar['count'] * 100 / largest)                          # bar height in the sidebar
+
+
+    return {
+        'min_price' : min((row['min_price'] for row in selected), default=None),
+        'max_price' : max((row['max_price'] for row in selected), default=None),
+        'categories' : categories,
+        'rating_counts' : rating_counts,
+        'price_histogram' : histogram,
+        'total' : sum(row['count'] for row in selected),
+    }
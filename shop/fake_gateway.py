@@ -0,0 +1,156 @@
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+
+from html import escape
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
+
+
+
+# Local stand-in for the SSLCommerz sandbox
+# Lets you run checkout & benchmark the gateway client offline, with controllable latency and failures
+#
+# POST /gwprocess/v4/api.php          --> start a payment: {'status': 'SUCCESS', 'GatewayPageURL': ...}
+# GET  /pay/<session>/                --> payment page with "Pay" / "Fail" / "Cancel" buttons (posts back to the shop)
+# GET  /validator/api/validationserverAPI.php?val_id=..  --> {'status': 'VALID', ...}
+#
+# Start it with: python manage.py run_fake_sslcommerz --port 8001 --latency 0.2 --fail-rate 0.1
+# and point the settings at it:
+# SSLCOMMERZ_PAYMENT_URL=http://127.0.0.1:8001/gwprocess/v4/api.php
+# SSLCOMMERZ_VALIDATION_URL=http://127.0.0.1:8001/validator/api/validationserverAPI.php
+
+
+PAYMENT_PATH = '/gwprocess/v4/api.php'
+VALIDATION_PATH = '/validator/api/validationserverAPI.php'
+
+
+
+class FakeGatewayHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'                                                   # keep-alive, like the real gateway
+
+
+    def log_message(self, format, *args):                                           # quiet
+        pass
+
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def simulate(self):
+        server = self.server
+        if server.latency:
+            time.sleep(random.uniform(0, 2 * server.latency))                       # average = latency
+
+        if random.random() < server.fail_rate:
+            self.send_json({'status' : 'FAILED', 'failedreason' : 'simulated outage'}, status=503)
+            return False
+        return True
+
+
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        form = {key : values[0] for key, values in parse_qs(self.rfile.read(length).decode()).items()}
+
+        if urlparse(self.path).path != PAYMENT_PATH:
+            return self.send_json({'status' : 'FAILED'}, status=404)
+        if not self.simulate():
+            return
+
+        session = uuid.uuid4().hex
+        with self.server.lock:
+            self.server.sessions[session] = form
+
+        host = f'http://{self.server.server_address[0]}:{self.server.server_address[1]}'
+        self.send_json({'status' : 'SUCCESS', 'sessionkey' : session, 'GatewayPageURL' : f'{host}/pay/{session}/'})
+
+
+
+    def do_GET(self):
+        url = urlparse(self.path)
+
+        if url.path == VALIDATION_PATH:
+            if not self.simulate():
+                return
+            val_id = parse_qs(url.query).get('val_id', [''])[0]
+            with self.server.lock:
+                payment = self.server.validations.get(val_id)
+
+            if not payment:
+                return self.send_json({'status' : 'INVALID_TRANSACTION'})
+            return self.send_json({'status' : 'VALID', 'val_id' : val_id, **payment})
+
+
+        if url.path.startswith('/pay/'):
+            session = url.path.strip('/').split('/')[-1]
+            with self.server.lock:
+                form = self.server.sessions.get(session)
+            if not form:
+                return self.send_json({'status' : 'FAILED'}, status=404)
+
+            val_id = uuid.uuid4().hex[:12]
+            with self.server.lock:
+                self.server.validations[val_id] = {
+                    'tran_id' : form.get('tran_id'), 'amount' : form.get('total_amount'), 'currency' : form.get('currency', 'BDT')
+                }
+
+            fields = (
+                f'<input type="hidden" name="tran_id" value="{escape(form.get("tran_id", ""))}">'
+                f'<input type="hidden" name="val_id" value="{val_id}">'
+                f'<input type="hidden" name="amount" value="{escape(form.get("total_amount", ""))}">'
+                '<input type="hidden" name="status" value="VALID">'
+            )
+            page = (
+                '<h1>Fake SSLCommerz</h1>'
+                f'<form method="post" action="{escape(form.get("success_url", ""))}">{fields}<button>Pay</button></form>'
+                f'<form method="post" action="{escape(form.get("fail_url", ""))}">{fields}<button>Fail</button></form>'
+                f'<form method="post" action="{escape(form.get("cancel_url", ""))}">{fields}<button>Cancel</button></form>'
+            ).encode()
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Content-Length', str(len(page)))
+            self.end_headers()
+            self.wfile.write(page)
+            return
+
+        self.send_json({'status' : 'FAILED'}, status=404)
+
+
+
+
+class FakeGatewayServer(ThreadingHTTPServer):
+
+    def handle_error(self, request, client_address):
+        if isinstance(sys.exc_info()[1], ConnectionError):                         # the client gave up (timeouts, benchmarks): expected, stay quiet
+            return
+        super().handle_error(request, client_address)
+
+
+
+
+# host/port 0 --> random free port (tests)
+def make_server(host='127.0.0.1', port=0, latency=0.0, fail_rate=0.0):
+    server = FakeGatewayServer((host, port), FakeGatewayHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.fail_rate = fail_rate
+    server.sessions = {}
+    server.validations = {}
+    server.lock = threading.Lock()
+    return server
+
+
+def base_url(server):
+    return f'http://{server.server_address[0]}:{server.server_address[1]}'
@@ -0,0 +1,144 @@
+import fnmatch
+import threading
+import time
+from socketserver import ThreadingTCPServer, StreamRequestHandler
+
+
+
+# Local stand-in for Redis (the L2 of shop/cachetier.py)
+# In-memory, speaks the Redis protocol for the commands the cache uses; lets you run the 2-tier cache
+# (and the tests) without a Redis server.
+#
+# Start it with: python manage.py run_fake_redis --port 6380
+# and point the settings at it: CACHE_URL=redis://127.0.0.1:6380/0
+
+
+class FakeRedisHandler(StreamRequestHandler):
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+
+        command = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            command.append(self.rfile.read(length + 2)[:-2])
+        return command
+
+
+    def reply(self, value):
+        if value is None:
+            return b'$-1\r\n'
+        if isinstance(value, bool):
+            return b'+OK\r\n' if value else b'$-1\r\n'
+        if isinstance(value, int):
+            return b':%d\r\n' % value
+        if isinstance(value, Exception):
+            return b'-ERR %s\r\n' % str(value).encode()
+        if isinstance(value, list):
+            return b'*%d\r\n' % len(value) + b''.join(self.reply(item) for item in value)
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+
+
+    def handle(self):
+        while True:
+            command = self.read_command()
+            if command is None:
+                return
+            try:
+                result = self.server.run(command[0].upper().decode(), command[1:])
+            except Exception as error:                                              # bad arguments --> error reply, like Redis
+                result = error
+            self.wfile.write(self.reply(result))
+
+
+
+
+class FakeRedisServer(ThreadingTCPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, FakeRedisHandler)
+        self.data = {}                                                              # key --> (value, expires or None)
+        self.lock = threading.Lock()
+        self.commands = 0
+
+
+    def live(self, key):
+        item = self.data.get(key)
+        if item is not None and item[1] is not None and item[1] <= time.monotonic():
+            del self.data[key]
+            return None
+        return item
+
+
+    def run(self, name, args):
+        with self.lock:
+            self.commands += 1
+
+            if name in ('PING', 'AUTH', 'SELECT'):
+                return True
+            if name == 'GET':
+                item = self.live(args[0])
+                return item and item[0]
+            if name == 'MGET':
+                return [(self.live(key) or (None,))[0] for key in args]
+            if name == 'SET':
+                return self.set(args)
+            if name == 'DEL':
+                return sum(1 for key in args if self.live(key) and self.data.pop(key))
+            if name == 'EXISTS':
+                return sum(1 for key in args if self.live(key))
+            if name == 'INCRBY':
+                value, expires = self.live(args[0]) or (b'0', None)
+                value = int(value) + int(args[1])
+                self.data[args[0]] = (str(value).encode(), expires)
+                return value
+            if name in ('PEXPIRE', 'PERSIST'):
+                item = self.live(args[0])
+                if item is None:
+                    return 0
+                self.data[args[0]] = (item[0], time.monotonic() + int(args[1]) / 1000 if name == 'PEXPIRE' else None)
+                return 1
+            if name == 'SCAN':                                                      # 1 pass over everything: cursor '0' back at once
+                options = [arg.upper() for arg in args[1:]]
+                pattern = args[1:][options.index(b'MATCH') + 1] if b'MATCH' in options else b'*'
+                return [b'0', [key for key in list(self.data) if fnmatch.fnmatchcase(key, pattern) and self.live(key)]]
+            if name == 'FLUSHDB':
+                self.data.clear()
+                return True
+            if name == 'DBSIZE':
+                return len(self.data)
+            if name == 'INFO':
+                used = sum(len(key) + len(value) for key, (value, _) in self.data.items())
+                return f'# Memory\r\nused_memory:{used}\r\nmaxmemory:0\r\n'.encode()
+
+            raise ValueError(f"unknown command '{name}'")
+
+
+    # SET key value [PX ms] [NX]
+    def set(self, args):
+        key, value, options = args[0], args[1], [arg.upper() for arg in args[2:]]
+        expires = None
+
+        if b'PX' in options:
+            expires = time.monotonic() + int(options[options.index(b'PX') + 1]) / 1000
+        if b'NX' in options and self.live(key) is not None:
+            return None
+
+        self.data[key] = (value, expires)
+        return True
+
+
+
+
+# port 0 --> random free port (tests)
+def make_server(host='127.0.0.1', port=0):
+    return FakeRedisServer((host, port))
+
+
+def redis_url(server):
+    return f'redis://{server.server_address[0]}:{server.server_address[1]}/0'
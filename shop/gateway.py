@@ -0,0 +1,346 @@
+import asyncio
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+try:
+    import httpx                                                                    # async HTTP client (optional)
+except ImportError:
+    httpx = None
+
+
+
+# SSLCommerz HTTP client
+#
+# 1. 1 shared requests.Session --> keep-alive connection pool (no new TCP/TLS handshake per payment)
+# 2. connect & read timeouts, and a cap on the whole call (retries + backoff) --> a slow gateway can't hold a worker for long
+# 3. retry with jittered exponential backoff for connection errors, timeouts and 502/503/504
+#    a POST (start a payment) is only retried when it never reached the gateway (connect failed):
+#    after a read timeout or a 5xx the gateway may have opened the session already
+# 4. circuit breaker --> after too many failures in a row, fail fast for a while instead of waiting on a dead gateway;
+#    4xx answers are our mistake, not a gateway failure, and don't count
+# 5. async methods for ASGI views: httpx.AsyncClient (1 pool per event loop, closed when that loop ends), same
+#    timeouts/retries/breaker; without httpx the blocking call runs in a worker thread, the event loop is never blocked
+#
+# Settings (all optional):
+# SSLCOMMERZ_CONNECT_TIMEOUT, SSLCOMMERZ_READ_TIMEOUT, SSLCOMMERZ_TOTAL_TIMEOUT, SSLCOMMERZ_MAX_RETRIES,
+# SSLCOMMERZ_POOL_SIZE, SSLCOMMERZ_BREAKER_THRESHOLD, SSLCOMMERZ_BREAKER_RESET
+
+
+RETRY_STATUS = {502, 503, 504}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+
+
+class GatewayError(Exception):
+    pass
+
+
+class CircuitOpen(GatewayError):
+    pass
+
+
+
+
+class CircuitBreaker:
+
+    def __init__(self, threshold=5, reset_after=30):
+        self.threshold = threshold                                                  # failures in a row before opening
+        self.reset_after = reset_after                                              # seconds to stay open before 1 trial call
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False                                                          # the 1 half-open call is running
+        self.lock = threading.Lock()
+
+
+    @property
+    def state(self):
+        with self.lock:
+            if self.opened_at is None:
+                return 'closed'
+            if time.monotonic() - self.opened_at >= self.reset_after:
+                return 'half-open'
+            return 'open'
+
+
+    # half-open --> only 1 caller gets through as the trial, the others keep failing fast until it is done
+    def before_call(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if self.trial or time.monotonic() - self.opened_at < self.reset_after:
+                raise CircuitOpen('Payment gateway is unavailable, try again shortly')
+            self.trial = True
+
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial = False
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()                                   # (re)open; a failed half-open trial opens it again
+
+
+
+
+class SSLCommerzClient:
+
+    def __init__(self, payment_url, validation_url, store_id, store_passwd,
+                 connect_timeout=3.05, read_timeout=10, total_timeout=15, max_retries=2, backoff=0.25, pool_size=10, breaker=None):
+
+        self.payment_url = payment_url
+        self.validation_url = validation_url
+        self.store_id = store_id
+        self.store_passwd = store_passwd
+
+        self.timeout = (connect_timeout, read_timeout)
+        self.total_timeout = total_timeout                                          # all attempts + backoff together
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.pool_size = pool_size
+        self._async_sessions = {}                                                   # event loop --> (httpx.AsyncClient, closer)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)          # our own retry loop below
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+
+
+    # seconds left before the deadline, or None if the next attempt (after 'delay') would not fit
+    @staticmethod
+    def remaining(deadline, delay=0):
+        left = deadline - time.monotonic() - delay
+        return left if left > 0 else None
+
+
+
+    def request(self, method, url, **kwargs):
+        self.breaker.before_call()
+
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        deadline = time.monotonic() + self.total_timeout
+        error = None
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                delay = random.uniform(0, self.backoff * 2 ** (attempt - 1))              # full jitter --> retries from many workers don't line up
+                if self.remaining(deadline, delay) is None:
+                    break
+                time.sleep(delay)
+
+            left = self.remaining(deadline) or 0.01
+            timeout = (min(self.timeout[0], left), min(self.timeout[1], left))
+
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+
+                if response.status_code in RETRY_STATUS:
+                    error = GatewayError(f'Gateway returned {response.status_code}')
+                    if idempotent:
+                        continue
+                    break                                                                   # the POST may have been handled --> not sent again
+
+                response.raise_for_status()
+                data = response.json()
+
+            except requests.HTTPError as e:
+                if e.response is not None and 400 <= e.response.status_code < 500:         # the gateway is up, the request was wrong
+                    self.breaker.record_success()
+                    raise GatewayError(f'Payment gateway rejected the request: {e}') from e
+                error = e
+                break
+
+            except (requests.ConnectionError, requests.Timeout) as e:                   # gateway down or slow --> try again
+                error = e
+                if idempotent or connect_failed(e):
+                    continue
+                break
+
+            except (requests.RequestException, ValueError) as e:                        # not JSON --> retrying won't help
+                error = e
+                break
+
+            self.breaker.record_success()
+            return data
+
+
+        self.breaker.record_failure()
+        raise GatewayError(f'Payment gateway request failed: {error}') from error
+
+
+
+
+    # start a payment --> {'status': 'SUCCESS', 'GatewayPageURL': ...}
+    def create_session(self, post_data):
+        data = {'store_id' : self.store_id, 'store_passwd' : self.store_passwd, **post_data}
+        return self.request('POST', self.payment_url, data=data)
+
+
+    # check a payment with SSLCommerz --> {'status': 'VALID', 'tran_id': ..., 'amount': ...}
+    def validate(self, val_id):
+        params = {'val_id' : val_id, 'store_id' : self.store_id, 'store_passwd' : self.store_passwd, 'format' : 'json'}
+        return self.request('GET', self.validation_url, params=params)
+
+
+
+    # async versions for ASGI views
+    # 1 pool per event loop; it is closed on that loop when the loop ends (see close_with_loop)
+    async def async_session(self):
+        loop = asyncio.get_running_loop()
+        entry = self._async_sessions.get(loop)
+
+        if entry is None:
+            limits = httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+            session = httpx.AsyncClient(timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0]), limits=limits)
+            closer = self.close_with_loop(loop, session)
+            entry = self._async_sessions[loop] = (session, closer)
+            await closer.__anext__()
+        return entry[0]
+
+
+    # an async generator is closed by loop.shutdown_asyncgens() (asyncio.run, uvicorn, async_to_sync),
+    # so the pool's connections are closed on their own loop when it ends
+    async def close_with_loop(self, loop, session):
+        try:
+            yield
+        finally:
+            self._async_sessions.pop(loop, None)
+            await session.aclose()
+
+
+    async def aclose(self):
+        entry = self._async_sessions.get(asyncio.get_running_loop())
+        if entry is not None:
+            await entry[1].aclose()
+
+
+
+    async def arequest(self, method, url, **kwargs):
+        if httpx is None:
+            return await sync_to_async(self.request, thread_sensitive=False)(method, url, **kwargs)
+
+        self.breaker.before_call()
+
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        deadline = time.monotonic() + self.total_timeout
+        session = await self.async_session()
+        error = None
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                delay = random.uniform(0, self.backoff * 2 ** (attempt - 1))
+                if self.remaining(deadline, delay) is None:
+                    break
+                await asyncio.sleep(delay)
+
+            left = self.remaining(deadline) or 0.01
+            timeout = httpx.Timeout(min(self.timeout[1], left), connect=min(self.timeout[0], left))
+
+            try:
+                response = await session.request(method, url, timeout=timeout, **kwargs)
+
+                if response.status_code in RETRY_STATUS:
+                    error = GatewayError(f'Gateway returned {response.status_code}')
+                    if idempotent:
+                        continue
+                    break
+
+                response.raise_for_status()
+                data = response.json()
+
+            except httpx.HTTPStatusError as e:
+                if 400 <= e.response.status_code < 500:
+                    self.breaker.record_success()
+                    raise GatewayError(f'Payment gateway rejected the request: {e}') from e
+                error = e
+                break
+
+            except httpx.TransportError as e:                                           # gateway down or slow --> try again
+                error = e
+                if idempotent or isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout)):
+                    continue
+                break
+
+            except (httpx.HTTPError, ValueError) as e:                                  # not JSON --> retrying won't help
+                error = e
+                break
+
+            self.breaker.record_success()
+            return data
+
+
+        self.breaker.record_failure()
+        raise GatewayError(f'Payment gateway request failed: {error}') from error
+
+
+    async def acreate_session(self, post_data):
+        data = {'store_id' : self.store_id, 'store_passwd' : self.store_passwd, **post_data}
+        return await self.arequest('POST', self.payment_url, data=data)
+
+    async def avalidate(self, val_id):
+        params = {'val_id' : val_id, 'store_id' : self.store_id, 'store_passwd' : self.store_passwd, 'format' : 'json'}
+        return await self.arequest('GET', self.validation_url, params=params)
+
+
+
+
+
+# the request never reached the gateway (refused, DNS, connect timeout) --> safe to send a POST again
+def connect_failed(error):
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+
+
+# 1 client per process (it owns the connection pool)
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = SSLCommerzClient(
+                    payment_url=settings.SSLCOMMERZ_PAYMENT_URL,
+                    validation_url=settings.SSLCOMMERZ_VALIDATION_URL,
+                    store_id=settings.SSLCOMMERZ_STORE_ID,
+                    store_passwd=settings.SSLCOMMERZ_STORE_PASSWORD,
+                    connect_timeout=getattr(settings, 'SSLCOMMERZ_CONNECT_TIMEOUT', 3.05),
+                    read_timeout=getattr(settings, 'SSLCOMMERZ_READ_TIMEOUT', 10),
+                    total_timeout=getattr(settings, 'SSLCOMMERZ_TOTAL_TIMEOUT', 15),
+                    max_retries=getattr(settings, 'SSLCOMMERZ_MAX_RETRIES', 2),
+                    pool_size=getattr(settings, 'SSLCOMMERZ_POOL_SIZE', 10),
+                    breaker=CircuitBreaker(
+                        threshold=getattr(settings, 'SSLCOMMERZ_BREAKER_THRESHOLD', 5),
+                        reset_after=getattr(settings, 'SSLCOMMERZ_BREAKER_RESET', 30),
+                    ),
+                )
+
+    return _client
+
+
+def reset_client():                                                                  # tests / settings changes
+    global _client
+    _client = None
@@ -0,0 +1,129 @@
+import hashlib
+from io import BytesIO
+
+from PIL import Image, ImageOps, features
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from . import models, jobs
+
+
+
+# Responsive product images
+# The original upload can be a multi-MB JPG; cards & thumbnails only need a small WebP/AVIF.
+#
+# For every product image, smaller copies are made at fixed widths:
+#   media/derivatives/<hash[:2]>/<hash>/<width>.<format>
+# <hash> = sha256 of the original file --> the same picture uploaded twice is only processed once,
+# and a changed picture never reuses old files.
+#
+# The work runs in the background worker (job 'product_image_derivatives', see jobs.py)
+# and the template tag {% product_image %} (templatetags/shop_images.py) turns the result into srcset.
+
+
+WIDTHS = (320, 640, 1024)
+
+FORMATS = [fmt for fmt in ('avif', 'webp') if features.check(fmt)]                # best format first; only what this Pillow build supports
+
+QUALITY = {'avif' : 55, 'webp' : 75}
+
+ROOT = 'derivatives'
+
+
+
+def derivative_path(content_hash, width, fmt):
+    return f'{ROOT}/{content_hash[:2]}/{content_hash}/{width}.{fmt}'
+
+
+
+def file_hash(field_file):
+    digest = hashlib.sha256()
+
+    with field_file.open('rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+
+
+# make (or reuse) the derivatives of 1 product image; force --> make them again even if the files exist
+# returns the 'image_variants' stored on the product: {'source': name, 'hash': .., 'widths': [..], 'formats': [..]}
+def build_derivatives(product, force=False):
+    content_hash = file_hash(product.image)
+
+    with product.image.open('rb') as f:
+        original = ImageOps.exif_transpose(Image.open(f))                          # phone photos --> upright
+        original.load()
+
+    if original.mode not in ('RGB', 'RGBA'):
+        original = original.convert('RGBA' if 'transparency' in original.info else 'RGB')
+
+    widths = [width for width in WIDTHS if width < original.width] or [original.width]            # never upscale
+
+
+    for width in widths:
+        resized = None
+
+        for fmt in FORMATS:
+            path = derivative_path(content_hash, width, fmt)
+            if default_storage.exists(path):                                      # already made for this picture
+                if not force:
+                    continue
+                default_storage.delete(path)                                      # else save() would pick another name
+
+            if resized is None:
+                height = round(original.height * width / original.width)
+                resized = original.resize((width, height), Image.LANCZOS)
+
+            buffer = BytesIO()
+            resized.save(buffer, fmt.upper(), quality=QUALITY[fmt])
+            default_storage.save(path, ContentFile(buffer.getvalue()))
+
+
+    return {'source' : product.image.name, 'hash' : content_hash, 'widths' : widths, 'formats' : list(FORMATS)}
+
+
+
+
+# saved with update() --> no post_save signal, so no endless loop of jobs
+def process_product_image(product_id, force=False):
+    product = models.Product.objects.filter(id=product_id).first()
+
+    if product is None or not product.image:
+        return None
+
+    variants = build_derivatives(product, force)
+    models.Product.objects.filter(id=product_id, image=variants['source']).update(image_variants=variants)          # skip if the image changed meanwhile
+    return variants
+
+
+
+def needs_derivatives(product):
+    return bool(product.image) and product.image_variants.get('source') != product.image.name
+
+
+
+# 1 pending job per product is enough: it reads the product's current image when it runs,
+# so saving the product again (admin edits, stock changes) before the worker gets to it queues nothing new
+def queue_derivatives(product_id, force=False):
+    pending = models.Job.objects.filter(kind='product_image_derivatives', status='pending', payload__product_id=product_id)
+    if force:
+        pending = pending.filter(payload__force=True)                               # a normal job would reuse the old files
+
+    if not pending.exists():
+        jobs.enqueue('product_image_derivatives', product_id=product_id, **({'force' : True} if force else {}))
+
+
+
+
+# srcset for 1 format: "/media/derivatives/ab/abcd/320.webp 320w, ..."
+def srcset(product, fmt):
+    variants = product.image_variants
+
+    return ', '.join(
+        f"{default_storage.url(derivative_path(variants['hash'], width, fmt))} {width}w"
+        for width in variants['widths']
+    )
@@ -0,0 +1,202 @@
+import logging
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.backends.django import DjangoTemplates, Template
+
+from . import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+
+# Per-request instrumentation
+# For every request: number of SQL queries, SQL time, template render time, duplicate queries.
+#   - numbers go to shop.metrics (Prometheus text on /metrics/prometheus/)
+#   - optional 'Server-Timing' header (settings.SERVER_TIMING) --> visible in the browser dev tools
+#   - query budget per view (settings.QUERY_BUDGETS): over budget --> warning in the log,
+#     or QueryBudgetExceeded when settings.QUERY_BUDGET_RAISE is on (tests)
+#
+# Duplicate = the same SQL with the same parameters run again in 1 request (a missing select_related/prefetch
+# or a value that should be computed once).
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+
+class RequestStats:
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.statements = Counter()                                                 # (sql, params) --> times run
+        self.rendering = False
+
+    @property
+    def duplicates(self):
+        return sum(count - 1 for count in self.statements.values() if count > 1)
+
+    def most_repeated(self, limit=3):
+        return [(sql, count) for (sql, _), count in self.statements.most_common(limit) if count > 1]
+
+
+_current = ContextVar('shop_request_stats', default=None)
+
+
+
+
+# execute wrapper: runs around every query; counts only inside a request (stats of the request in the context)
+def record_query(execute, sql, params, many, context):
+    stats = _current.get()
+    start = time.perf_counter()
+
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        if stats is not None:
+            stats.queries += 1
+            stats.sql_time += time.perf_counter() - start
+            stats.statements[(sql, repr(params))] += 1
+
+
+# installed on every connection once: connections opened later (async views run their queries in other threads,
+# each with its own connection) get it when they are created
+def instrument(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(instrument)
+
+
+
+
+# Template backend that measures render time ('BACKEND' in settings.TEMPLATES)
+# only the outermost render is timed; templates rendered inside it (cards, includes) are part of it
+
+class TimedTemplate(Template):
+
+    def render(self, context=None, request=None):
+        stats = _current.get()
+
+        if stats is None or stats.rendering:
+            return super().render(context, request)
+
+        stats.rendering = True
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.template_time += time.perf_counter() - start
+            stats.rendering = False
+
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+
+
+def query_budget(view_name):
+    budgets = getattr(settings, 'QUERY_BUDGETS', {})
+    return budgets.get(view_name, getattr(settings, 'QUERY_BUDGET_DEFAULT', None))
+
+
+
+def check_budget(view_name, stats):
+    budget = query_budget(view_name)
+
+    if budget is None or stats.queries <= budget:
+        return
+
+    metrics.incr('query_budget.exceeded', view=view_name)
+    message = f"{view_name} ran {stats.queries} queries (budget {budget}); most repeated: {stats.most_repeated()}"
+
+    if getattr(settings, 'QUERY_BUDGET_RAISE', False):
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+
+def server_timing(stats, total):
+    return ', '.join([
+        f'db;dur={stats.sql_time * 1000:.1f};desc="{stats.queries} queries, {stats.duplicates} duplicate"',
+        f'tpl;dur={stats.template_time * 1000:.1f}',
+        f'total;dur={total * 1000:.1f}',
+    ])
+
+
+
+
+# works for sync (WSGI) and async (ASGI) views
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        for connection in connections.all():
+            instrument(connection)
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        return self.finish(request, response, stats, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        return self.finish(request, response, stats, time.perf_counter() - start)
+
+
+    def finish(self, request, response, stats, total):
+        match = request.resolver_match
+        view_name = (match.url_name or match.view_name) if match else 'unmatched'
+
+        metrics.incr('http.requests', view=view_name, method=request.method, status=response.status_code)
+        metrics.incr('db.queries', stats.queries, view=view_name)
+        metrics.incr('db.duplicate_queries', stats.duplicates, view=view_name)
+        metrics.incr('db.time_seconds', stats.sql_time, view=view_name)
+        metrics.incr('template.time_seconds', stats.template_time, view=view_name)
+        metrics.observe('request.duration', total, view=view_name)
+
+        if getattr(settings, 'SERVER_TIMING', False):
+            response['Server-Timing'] = server_timing(stats, total)
+
+        check_budget(view_name, stats)
+        return response
@@ -0,0 +1,126 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Case, When, Value, PositiveBigIntegerField
+from django.utils import timezone
+
+from . import models
+
+
+
+# Stock reservation
+#
+# checkout        --> reserve_stock()  : UPDATE product SET stock = stock - n WHERE id = .. AND stock >= n
+#                                        (the check & the decrement are 1 statement, so 2 buyers can't both take the last unit)
+# payment success --> commit_reservations()
+# payment fail    --> release_reservations() : stock given back
+# hold too old    --> release_expired()      : stock given back (python manage.py release_expired_reservations)
+
+
+def reservation_ttl():
+    return timedelta(minutes=getattr(settings, 'STOCK_RESERVATION_TTL_MINUTES', 30))
+
+
+
+class OutOfStock(Exception):
+
+    def __init__(self, product_id):
+        self.product_id = product_id
+        super().__init__(f"Not enough stock for product {product_id}")
+
+
+
+
+# lines --> [(product_id, quantity), ...]
+# All or nothing: if 1 product doesn't have enough stock, every decrement is rolled back and OutOfStock is raised
+#
+# The whole cart is 1 statement:
+#   UPDATE product SET stock = stock - CASE id WHEN 1 THEN 2 WHEN 7 THEN 1 END
+#   WHERE id IN (1, 7) AND stock >= CASE id WHEN 1 THEN 2 WHEN 7 THEN 1 END
+# if fewer rows than products were updated, some product was short
+def reserve_stock(order, lines):
+    quantities = {}
+    for product_id, quantity in lines:
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+
+    needed = Case(
+        *[When(id=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+        output_field=PositiveBigIntegerField()
+    )
+    expires_at = timezone.now() + reservation_ttl()
+
+    try:
+        with transaction.atomic():
+            updated = models.Product.objects.filter(
+                id__in=quantities, stock__gte=needed
+            ).update(stock=F('stock') - needed)
+
+            if updated != len(quantities):
+                raise OutOfStock(None)                                                       # rolls the partial update back
+
+            models.StockReservation.objects.bulk_create([
+                models.StockReservation(order=order, product_id=product_id, quantity=quantity, expires_at=expires_at)
+                for product_id, quantity in quantities.items()
+            ])
+
+    except OutOfStock:
+        stock = dict(models.Product.objects.filter(id__in=quantities).values_list('id', 'stock'))
+        short = [product_id for product_id in sorted(quantities) if stock.get(product_id, 0) < quantities[product_id]]
+        raise OutOfStock(short[0] if short else min(quantities))
+
+
+
+
+# payment done --> the held stock is sold
+# If a hold already expired (stock was given back), the stock is taken again, but only if it is still there:
+# returns the product ids that were short (nothing taken for them) --> the order needs a manual look (payments.confirm)
+def commit_reservations(order):
+    short = []
+
+    def take_again(product_id, quantity):
+        if not models.Product.objects.filter(id=product_id, stock__gte=quantity).update(stock=F('stock') - quantity):
+            short.append(product_id)
+
+    with transaction.atomic():
+        reservations = list(models.StockReservation.objects.filter(order=order).select_for_update())
+
+        if not reservations:                                                                # order placed before reservations existed
+            for item in order.order_items.all():
+                take_again(item.product_id, item.quantity)
+            return short
+
+        for reservation in reservations:
+            if reservation.status == 'released':
+                take_again(reservation.product_id, reservation.quantity)
+
+        models.StockReservation.objects.filter(order=order).exclude(status='committed').update(status='committed')
+
+    return short
+
+
+
+
+# give the stock of the still-held reservations back
+# "status='held'" in the UPDATE makes it safe to call twice (fail + expiry, double callbacks)
+def release_reservations(reservations):
+    released = 0
+
+    with transaction.atomic():
+        for reservation in reservations.filter(status='held').select_for_update():
+            if models.StockReservation.objects.filter(id=reservation.id, status='held').update(status='released'):
+                models.Product.objects.filter(id=reservation.product_id).update(stock=F('stock') + reservation.quantity)
+                released += 1
+
+    return released
+
+
+
+def release_order(order):
+    return release_reservations(models.StockReservation.objects.filter(order=order))
+
+
+
+def release_expired(now=None):
+    now = now or timezone.now()
+    return release_reservations(models.StockReservation.objects.filter(expires_at__lte=now))
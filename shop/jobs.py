@@ -0,0 +1,185 @@
+import random
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.db.models import F
+from django.utils import timezone
+
+from . import models
+
+
+
+# Background job queue (outbox table = models.Job)
+#
+# enqueue()  --> 1 INSERT, done inside the caller's transaction (the job exists only if the order change is saved)
+# run_batch() --> claim a batch of due jobs, run them, retry failures with exponential backoff
+#
+# Email jobs of a batch share 1 SMTP connection (1 handshake/login for the whole batch)
+#
+# A worker renews claimed_at of the jobs it holds before each job (heartbeat), so jobs waiting in its batch are not
+# taken by another worker. A job not renewed for stale_after(kind) is given back: its worker died.
+# Kinds that can run longer than JOB_STALE_SECONDS get their own limit in JOB_STALE_SECONDS_BY_KIND.
+
+
+def max_attempts():
+    return getattr(settings, 'JOB_MAX_ATTEMPTS', 5)
+
+
+def retry_delay(attempts):
+    base = getattr(settings, 'JOB_RETRY_BASE_SECONDS', 30)
+    return timedelta(seconds=base * 2 ** (attempts - 1) * random.uniform(0.8, 1.2))            # 30s, 60s, 120s ... (+-20% jitter)
+
+
+def stale_after(kind=None):
+    seconds = getattr(settings, 'JOB_STALE_SECONDS_BY_KIND', {}).get(kind, getattr(settings, 'JOB_STALE_SECONDS', 600))
+    return timedelta(seconds=seconds)                                                         # a 'running' job not renewed for this long --> its worker died
+
+
+
+
+def enqueue(kind, **payload):
+    return models.Job.objects.create(kind=kind, payload=payload, run_after=timezone.now())
+
+
+
+
+
+# Handlers
+# kind --> function(job, context); 'context' holds things shared by the batch (the SMTP connection)
+
+HANDLERS = {}
+
+
+def handler(kind):
+    def register(function):
+        HANDLERS[kind] = function
+        return function
+    return register
+
+
+
+@handler('order_confirmation_email')
+def order_confirmation_email(job, context):
+    from .sslcommerz import order_confirmation_message
+
+    order = models.Order.objects.prefetch_related('order_items__product').get(id=job.payload['order_id'])
+
+    if 'mail_connection' not in context:
+        context['mail_connection'] = get_connection()
+        context['mail_connection'].open()                                                # opened once, used by every email of the batch
+
+    context['mail_connection'].send_messages([order_confirmation_message(order)])
+
+
+
+
+
+@handler('product_image_derivatives')
+def product_image_derivatives(job, context):
+    from .images import process_product_image
+
+    process_product_image(job.payload['product_id'], job.payload.get('force', False))
+
+
+
+
+
+# payload: {'product_ids': [..]} for some products, {} for all of them
+@handler('compute_related_products')
+def compute_related_products(job, context):
+    from .recommendations import compute_related
+
+    compute_related(job.payload.get('product_ids'))
+
+
+
+
+
+# IPNs waiting for the SSLCommerz validation API (see payments.py)
+@handler('validate_payments')
+def validate_payments(job, context):
+    from .payments import validate_received
+
+    validate_received()
+
+
+
+
+
+# Worker
+
+# give back the jobs of dead workers (1 statement + 1 per kind with its own limit)
+def reclaim_stale(now):
+    running = models.Job.objects.filter(status='running')
+    by_kind = getattr(settings, 'JOB_STALE_SECONDS_BY_KIND', {})
+
+    running.exclude(kind__in=list(by_kind)).filter(claimed_at__lt=now - stale_after()).update(status='pending')
+    for kind in by_kind:
+        running.filter(kind=kind, claimed_at__lt=now - stale_after(kind)).update(status='pending')
+
+
+
+# the jobs we still hold are alive
+def heartbeat(worker_id):
+    models.Job.objects.filter(status='running', claimed_by=worker_id).update(claimed_at=timezone.now())
+
+
+
+# mark up to 'batch_size' due jobs as ours; 2 statements, safe with many workers
+def claim_batch(worker_id, batch_size):
+    now = timezone.now()
+
+    reclaim_stale(now)
+
+    due = models.Job.objects.filter(status='pending', run_after__lte=now).order_by('run_after', 'id').values_list('id', flat=True)[:batch_size]
+    models.Job.objects.filter(id__in=list(due), status='pending').update(
+        status='running', claimed_by=worker_id, claimed_at=now, attempts=F('attempts') + 1
+    )
+
+    return list(models.Job.objects.filter(status='running', claimed_by=worker_id).order_by('id'))
+
+
+
+def run_batch(batch_size=50, worker_id=None):
+    worker_id = worker_id or uuid.uuid4().hex
+    jobs = claim_batch(worker_id, batch_size)
+    context = {}
+    stats = {'done' : 0, 'retry' : 0, 'failed' : 0}
+
+    try:
+        for i, job in enumerate(jobs):
+            if i:
+                heartbeat(worker_id)                                                         # the ones still waiting in this batch
+
+            try:
+                HANDLERS[job.kind](job, context)
+
+            except Exception as e:
+                job.last_error = f'{type(e).__name__}: {e}'
+
+                if job.attempts >= max_attempts():
+                    job.status = 'failed'
+                    stats['failed'] += 1
+                else:
+                    job.status = 'pending'
+                    job.run_after = timezone.now() + retry_delay(job.attempts)
+                    stats['retry'] += 1
+
+                if 'mail_connection' in context:                                          # an SMTP error may leave the connection broken
+                    context.pop('mail_connection').close()
+
+            else:
+                job.status = 'done'
+                job.last_error = ''
+                stats['done'] += 1
+
+            job.claimed_by = ''
+            job.save(update_fields=['status', 'run_after', 'last_error', 'claimed_by', 'updated_at'])
+
+    finally:
+        if 'mail_connection' in context:
+            context['mail_connection'].close()
+
+    return stats
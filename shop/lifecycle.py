@@ -0,0 +1,127 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import models
+from . import metrics
+from .inventory import release_expired, release_reservations, release_order
+
+
+
+# Order lifecycle (python manage.py run_order_lifecycle, from cron or with --loop)
+#
+# 1. expire  : pending & unpaid for ORDER_PENDING_TTL_MINUTES --> canceled, held stock given back
+# 2. release : expired stock holds of any order (same as release_expired_reservations)
+# 3. archive : canceled & unpaid for ORDER_ARCHIVE_AFTER_DAYS --> 1 ArchivedOrder row, Order & OrderItems deleted
+#
+# Everything goes in batches of ORDER_LIFECYCLE_BATCH orders (1 short transaction each), so a big backlog
+# never locks the order table for long. A payment that arrives for an expired order still marks it paid, with status
+# 'review' (refund or manual decision, see payments.confirm); its stock is not taken again.
+
+
+PENDING = ['pending', '']                                                            # '' --> orders placed before the status had a default
+
+
+
+def pending_ttl():
+    return timedelta(minutes=getattr(settings, 'ORDER_PENDING_TTL_MINUTES', 60))
+
+
+def archive_after():
+    return timedelta(days=getattr(settings, 'ORDER_ARCHIVE_AFTER_DAYS', 30))
+
+
+def batch_size():
+    return getattr(settings, 'ORDER_LIFECYCLE_BATCH', 500)
+
+
+
+
+# payment failed / canceled (browser callback): only an order still waiting for its payment is canceled,
+# a late or replayed callback must not cancel an order that was paid meanwhile
+def cancel_unpaid(order):
+    with transaction.atomic():
+        canceled = models.Order.objects.filter(id=order.id, status__in=PENDING, paid=False).update(
+            status='canceled', updated_at=timezone.now()
+        )
+        if canceled:
+            release_order(order)                                                     # give the held stock back
+
+    return bool(canceled)
+
+
+
+
+# returns (orders canceled, reservations released)
+def expire_batch(now, size):
+    stale = models.Order.objects.filter(status__in=PENDING, paid=False, updated_at__lt=now - pending_ttl())
+    ids = list(stale.order_by('updated_at', 'id').values_list('id', flat=True)[:size])
+    if not ids:
+        return 0, 0
+
+    with transaction.atomic():
+        expired = models.Order.objects.filter(id__in=ids, status__in=PENDING, paid=False).update(     # a payment may have landed meanwhile
+            status='canceled', updated_at=now
+        )
+        released = release_reservations(
+            models.StockReservation.objects.filter(order_id__in=ids, order__status='canceled', order__paid=False)
+        )
+
+    return expired, released
+
+
+
+def archive_batch(now, size):
+    old = models.Order.objects.filter(status='canceled', paid=False, updated_at__lt=now - archive_after())
+
+    with transaction.atomic():
+        orders = list(old.order_by('updated_at', 'id').select_for_update().prefetch_related('order_items')[:size])
+        if not orders:
+            return 0
+
+        ids = [order.id for order in orders]
+        release_reservations(models.StockReservation.objects.filter(order_id__in=ids))            # normally done already (fail/cancel/expire)
+
+        models.ArchivedOrder.objects.bulk_create([
+            models.ArchivedOrder(
+                order_id=order.id, user_id=order.user_id, email=order.email, total_amount=order.total_amount,
+                items=[[item.product_id, item.quantity, str(item.price)] for item in order.order_items.all()],
+                created_at=order.created_at, canceled_at=order.updated_at,
+            )
+            for order in orders
+        ], ignore_conflicts=True)
+
+        models.Order.objects.filter(id__in=ids).delete()                                          # order items, holds & payments go with it
+
+    return len(orders)
+
+
+
+
+# 1 run: every step until its backlog is empty --> {'expired': .., 'released': .., 'archived': ..}
+def run(now=None, size=None):
+    now = now or timezone.now()
+    size = size or batch_size()
+    stats = {'expired' : 0, 'released' : 0, 'archived' : 0}
+
+    while True:
+        expired, released = expire_batch(now, size)
+        stats['expired'] += expired
+        stats['released'] += released
+        if expired < size:
+            break
+
+    stats['released'] += release_expired(now)
+
+    while True:
+        archived = archive_batch(now, size)
+        stats['archived'] += archived
+        if archived < size:
+            break
+
+    for name, count in stats.items():
+        metrics.incr(f'lifecycle.{name}', count)
+
+    return stats
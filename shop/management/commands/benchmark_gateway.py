@@ -0,0 +1,69 @@
+import statistics
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from shop.fake_gateway import make_server, base_url, PAYMENT_PATH, VALIDATION_PATH
+from shop.gateway import SSLCommerzClient, CircuitBreaker, CircuitOpen, GatewayError
+
+
+
+# Benchmark the gateway client against the local fake gateway
+# Shows latency percentiles, failures and how often the circuit breaker short-circuits
+# Usage: python manage.py benchmark_gateway --requests 200 --concurrency 10 --latency 0.1 --fail-rate 0.2
+
+class Command(BaseCommand):
+    help = 'Benchmark the SSLCommerz client against the fake gateway'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--latency', type=float, default=0.05)
+        parser.add_argument('--fail-rate', type=float, default=0.0)
+        parser.add_argument('--read-timeout', type=float, default=2.0)
+        parser.add_argument('--retries', type=int, default=2)
+
+    def handle(self, *args, **options):
+        server = make_server(latency=options['latency'], fail_rate=options['fail_rate'])
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        client = SSLCommerzClient(
+            payment_url=base_url(server) + PAYMENT_PATH,
+            validation_url=base_url(server) + VALIDATION_PATH,
+            store_id='bench', store_passwd='bench',
+            read_timeout=options['read_timeout'], max_retries=options['retries'],
+            pool_size=options['concurrency'], breaker=CircuitBreaker(threshold=20, reset_after=1),
+        )
+
+
+        def call(i):
+            start = time.perf_counter()
+            try:
+                client.create_session({'tran_id' : str(i), 'total_amount' : 100})
+                outcome = 'ok'
+            except CircuitOpen:
+                outcome = 'open'
+            except GatewayError:
+                outcome = 'failed'
+            return outcome, time.perf_counter() - start
+
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            results = list(pool.map(call, range(options['requests'])))
+        elapsed = time.perf_counter() - start
+
+        server.shutdown()
+        server.server_close()
+
+
+        latencies = sorted(latency * 1000 for _, latency in results)
+        quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+        outcomes = [outcome for outcome, _ in results]
+
+        self.stdout.write(f"requests     {len(results)} in {elapsed:.2f}s ({len(results) / elapsed:.1f} req/s)")
+        self.stdout.write(f"latency ms   p50 {quantiles[49]:.1f}  p95 {quantiles[94]:.1f}  p99 {quantiles[98]:.1f}")
+        self.stdout.write(f"ok {outcomes.count('ok')}  failed {outcomes.count('failed')}  short-circuited {outcomes.count('open')}")
@@ -0,0 +1,59 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from shop import benchmark
+from shop.management.commands.generate_catalog import PREFIX, PASSWORD
+
+
+
+# Same concurrent load (browsing + cart + checkout with a slow payment gateway) against
+# the WSGI deployment (gunicorn, threads, sync views) and the ASGI one (uvicorn, async views)
+# Needs generated data (generate_catalog) and gunicorn / uvicorn installed; the servers use this database.
+# Usage: python manage.py benchmark_servers --concurrency 64 --requests 500 --gateway-latency 0.3 --output bench/servers.json
+
+class Command(BaseCommand):
+    help = 'Compare throughput and latency of the WSGI and ASGI deployments under mixed browse & checkout load'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--server', action='append', choices=list(benchmark.SERVERS), help='Run only these (repeatable)')
+        parser.add_argument('--scenario', action='append', choices=benchmark.SCENARIOS + benchmark.GATEWAY_SCENARIOS,
+                            help='Default: mixed')
+        parser.add_argument('--requests', type=int, default=200, help='Actions per scenario')
+        parser.add_argument('--concurrency', type=int, default=32, help='Client threads')
+        parser.add_argument('--workers', type=int, default=2, help='Server processes')
+        parser.add_argument('--threads', type=int, default=8, help='Threads per WSGI worker')
+        parser.add_argument('--gateway-latency', type=float, default=0.3, help='Average fake gateway delay in seconds')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', help='Write the results to this JSON file')
+
+    def handle(self, *args, **options):
+        users = [(username, PASSWORD) for username in
+                 User.objects.filter(username__startswith=PREFIX).order_by('id').values_list('username', flat=True)[:options['concurrency']]]
+
+        try:
+            results = benchmark.compare_servers(
+                servers=options['server'] or list(benchmark.SERVERS), scenarios=options['scenario'] or ['mixed'],
+                requests_per_scenario=options['requests'], concurrency=options['concurrency'], workers=options['workers'],
+                threads=options['threads'], gateway_latency=options['gateway_latency'], users=users, seed=options['seed'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+
+        self.stdout.write(f"{'server':<8}{'scenario':<16}{'requests':>9}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>9}")
+        for server, result in results.items():
+            for name, row in result['scenarios'].items():
+                self.stdout.write(
+                    f"{server:<8}{name:<16}{row['requests']:>9}{row['errors']:>8}{row['p50_ms']:>9}{row['p95_ms']:>9}"
+                    f"{row['p99_ms']:>9}{row['throughput_rps']:>9}"
+                )
+
+        if {'wsgi', 'asgi'} <= set(results):
+            for name, row in results['asgi']['scenarios'].items():
+                before = results['wsgi']['scenarios'][name]['throughput_rps']
+                if before:
+                    self.stdout.write(f"{name}: ASGI throughput x{row['throughput_rps'] / before:.2f} of WSGI")
+
+        if options['output']:
+            benchmark.save(results, options['output'])
+            self.stdout.write(self.style.SUCCESS(f"Results saved to {options['output']}"))
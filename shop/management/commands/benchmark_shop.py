@@ -0,0 +1,71 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from shop import benchmark
+from shop.management.commands.generate_catalog import PREFIX, PASSWORD
+
+
+
+# Benchmark the shop flows (home, product list, filters, search, category, product detail, cart, checkout)
+# --driver client : Django test Client in this process (exact queries per request, changes rolled back)
+# --driver http   : a running server, --concurrency threads (queries from the Server-Timing header)
+# Results are saved as JSON; --compare fails when a scenario got slower (p95) or runs more queries than the baseline
+# Usage: python manage.py benchmark_shop --requests 200 --output bench/main.json
+#        python manage.py benchmark_shop --driver http --url http://127.0.0.1:8000 --concurrency 16 --compare bench/main.json
+
+class Command(BaseCommand):
+    help = 'Benchmark the shop views and report latency percentiles, throughput and queries per request'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--driver', choices=['client', 'http'], default='client')
+        parser.add_argument('--url', help='Base URL of the server (http driver)')
+        parser.add_argument('--concurrency', type=int, default=8, help='Threads (http driver)')
+        parser.add_argument('--requests', type=int, default=100, help='Actions per scenario')
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--scenario', action='append', choices=benchmark.SCENARIOS + benchmark.GATEWAY_SCENARIOS, help='Run only these (repeatable)')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument('--compare', help='Baseline JSON file to compare with')
+        parser.add_argument('--threshold', type=float, default=20.0, help='Allowed p95 slowdown in percent')
+
+    def handle(self, *args, **options):
+        if options['driver'] == 'http' and not options['url']:
+            raise CommandError('--url is needed for the http driver')
+
+        users = [(username, PASSWORD) for username in
+                 User.objects.filter(username__startswith=PREFIX).order_by('id').values_list('username', flat=True)[:options['concurrency']]]
+
+        try:
+            result = benchmark.run(
+                scenarios=options['scenario'] or benchmark.SCENARIOS, requests_per_scenario=options['requests'],
+                warmup=options['warmup'], concurrency=options['concurrency'], driver=options['driver'],
+                base_url=options['url'], users=users, seed=options['seed'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+
+        self.stdout.write(f"{'scenario':<16}{'requests':>9}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>9}{'queries':>9}")
+        for name, row in result['scenarios'].items():
+            queries = row['queries_per_request'] if row['queries_per_request'] is not None else '-'
+            self.stdout.write(
+                f"{name:<16}{row['requests']:>9}{row['errors']:>8}{row['p50_ms']:>9}{row['p95_ms']:>9}"
+                f"{row['p99_ms']:>9}{row['throughput_rps']:>9}{queries:>9}"
+            )
+
+        if options['output']:
+            benchmark.save(result, options['output'])
+            self.stdout.write(self.style.SUCCESS(f"Results saved to {options['output']}"))
+
+
+        if options['compare']:
+            baseline = benchmark.load(options['compare'])
+            rows, regressions = benchmark.compare(baseline, result, options['threshold'])
+
+            self.stdout.write(f"\nvs {options['compare']} (commit {baseline.get('commit')})")
+            for name, before, now, change, queries_before, queries_now in rows:
+                self.stdout.write(f"{name:<16} p95 {before:>8} --> {now:>8} ms ({change:+.0f}%)   queries {queries_before} --> {queries_now}")
+
+            if regressions:
+                raise CommandError('Regressions:\n  ' + '\n  '.join(regressions))
+            self.stdout.write(self.style.SUCCESS('No regressions'))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from shop import jobs, recommendations
+
+
+
+# Precompute the related products of every product (co-purchases + category, see shop/recommendations.py)
+# Run it nightly (cron), or with --queue let a worker (run_workers) do it
+# Usage: python manage.py compute_related_products --top 8
+
+class Command(BaseCommand):
+    help = 'Precompute the top-K related products of every product'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=recommendations.TOP_K)
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--queue', action='store_true', help='Queue a background job instead of running now')
+
+    def handle(self, *args, **options):
+        if options['queue']:
+            jobs.enqueue('compute_related_products')
+            self.stdout.write(self.style.SUCCESS('Queued compute_related_products'))
+            return
+
+        written = recommendations.compute_related(k=options['top'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Stored {written} related products"))
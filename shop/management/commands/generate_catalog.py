@@ -0,0 +1,194 @@
+import random
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from shop import models, search, facets, cards, pagecache
+
+
+
+# Synthetic catalog for benchmarks & load tests
+# Categories, products, users, ratings and orders at any scale; the same --seed always gives the same data.
+# Everything is written with bulk_create (no per-row signals), so the derived data is filled in here:
+# rating stats on the products, order totals, the search index and the caches.
+#
+# Generated rows are recognisable by their 'gen-' slugs / usernames; --clear removes them first.
+# Users can log in with the password 'bench-password' (used by benchmark_shop).
+# Usage: python manage.py generate_catalog --products 100000 --users 1000 --ratings 200000 --orders 20000 --seed 42
+
+
+PREFIX = 'gen-'
+PASSWORD = 'bench-password'
+
+ADJECTIVES = ['Classic', 'Slim', 'Cotton', 'Linen', 'Denim', 'Summer', 'Winter', 'Casual', 'Formal', 'Printed',
+              'Striped', 'Vintage', 'Premium', 'Sport', 'Urban', 'Organic', 'Silk', 'Woolen', 'Light', 'Heavy']
+COLORS = ['Blue', 'Black', 'White', 'Red', 'Green', 'Grey', 'Navy', 'Olive', 'Maroon', 'Beige']
+NOUNS = ['Shirt', 'T-Shirt', 'Panjabi', 'Jeans', 'Trouser', 'Jacket', 'Hoodie', 'Saree', 'Kurti', 'Sneaker',
+         'Sandal', 'Watch', 'Wallet', 'Belt', 'Cap', 'Backpack', 'Scarf', 'Polo', 'Shorts', 'Blazer']
+
+
+
+class Command(BaseCommand):
+    help = 'Generate a synthetic catalog (categories, products, users, ratings, orders) for benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--ratings', type=int, default=20000)
+        parser.add_argument('--orders', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--clear', action='store_true', help='Delete previously generated data first')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+
+        self.check_counts(options)
+
+        with transaction.atomic():
+            if options['clear']:
+                self.clear()
+            elif models.Category.objects.filter(slug__startswith=PREFIX).exists():
+                raise CommandError('Generated data already exists; use --clear to replace it')
+
+            categories = self.create_categories(options['categories'])
+            users = self.create_users(options['users'], batch_size)
+            products = self.create_products(rng, categories, users, options['products'], options['ratings'], batch_size)
+            self.create_orders(rng, users, products, options['orders'], batch_size)
+            self.index(products, batch_size)
+
+
+        facets.invalidate()                                                           # caches hold the old catalog
+        cards.invalidate()
+        pagecache.invalidate()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {len(categories)} categories, {len(products)} products, {len(users)} users, "
+            f"{options['ratings']} ratings, {options['orders']} orders (seed {options['seed']})"
+        ))
+
+
+
+    # every count is drawn from the ones before it (rng.choice), so an empty pool has to be caught here
+    def check_counts(self, options):
+        for name in ('categories', 'products', 'users', 'ratings', 'orders'):
+            if options[name] < 0:
+                raise CommandError(f'--{name} can not be negative')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        if options['products'] and not options['categories']:
+            raise CommandError('--products needs at least 1 category (--categories)')
+        if options['orders'] and not (options['users'] and options['products']):
+            raise CommandError('--orders needs at least 1 user (--users) and 1 product (--products)')
+        if options['ratings'] > options['products'] * options['users']:
+            raise CommandError('--ratings can not be more than products x users (1 rating per user per product)')
+
+
+
+    def clear(self):
+        models.Order.objects.filter(user__username__startswith=PREFIX).delete()
+        models.Category.objects.filter(slug__startswith=PREFIX).delete()             # products, ratings, order items cascade
+        User.objects.filter(username__startswith=PREFIX).delete()
+
+
+
+    def create_categories(self, count):
+        return models.Category.objects.bulk_create([
+            models.Category(name=f'Category {i}', slug=f'{PREFIX}category-{i}', description=f'Generated category {i}')
+            for i in range(count)
+        ])
+
+
+
+    def create_users(self, count, batch_size):
+        password = make_password(PASSWORD)                                            # hashing is slow --> once for everybody
+
+        return User.objects.bulk_create([
+            User(username=f'{PREFIX}user-{i}', email=f'user{i}@example.com', password=password)
+            for i in range(count)
+        ], batch_size=batch_size)
+
+
+
+    # ratings are drawn first, so every product is created with its rating stats already filled in
+    def create_products(self, rng, categories, users, count, rating_count, batch_size):
+        pairs = set()
+        while len(pairs) < rating_count:
+            pairs.add((rng.randrange(count), rng.randrange(len(users))))
+
+        ratings = [(product, user, rng.choices([1, 2, 3, 4, 5], weights=[1, 2, 4, 6, 5])[0]) for product, user in sorted(pairs)]
+
+        stats = {}
+        for product, _, value in ratings:
+            total, n = stats.get(product, (0, 0))
+            stats[product] = (total + value, n + 1)
+
+
+        products = []
+        for i in range(count):
+            name = f'{rng.choice(ADJECTIVES)} {rng.choice(COLORS)} {rng.choice(NOUNS)}'
+            rating_sum, rating_n = stats.get(i, (0, 0))
+
+            products.append(models.Product(
+                name=name, slug=f'{PREFIX}product-{i}', category=rng.choice(categories),
+                description=f'{name} made for everyday wear. Item {i} of the generated catalog.',
+                price=Decimal(rng.randrange(10000, 5000000)) / 100, stock=rng.randrange(0, 200),
+                available=rng.random() > 0.05, image='products/sample.jpg',
+                rating_count=rating_n, rating_sum=rating_sum,
+                rating_avg=Decimal(rating_sum / rating_n).quantize(Decimal('0.01')) if rating_n else 0,
+            ))
+
+        products = models.Product.objects.bulk_create(products, batch_size=batch_size)
+
+
+        models.Rating.objects.bulk_create([
+            models.Rating(product=products[product], user=users[user], rating=value, comment='Generated rating')
+            for product, user, value in ratings
+        ], batch_size=batch_size)
+
+        return products
+
+
+
+    def create_orders(self, rng, users, products, count, batch_size):
+        orders, lines = [], []
+
+        for i in range(count):
+            items = [(rng.choice(products), rng.randint(1, 3)) for _ in range(rng.randint(1, 4))]
+            paid = rng.random() < 0.7
+
+            orders.append(models.Order(
+                user=rng.choice(users), first_name='Gen', last_name=f'User {i}', email=f'order{i}@example.com',
+                address='Generated address', postal_code='1200', phone='01700000000', city='Dhaka', note='',
+                paid=paid, transaction_id=f'{PREFIX}{i}',
+                status=rng.choice(['processing', 'shipped', 'delivered']) if paid else rng.choice(['pending', 'canceled']),
+                total_amount=sum(product.price * quantity for product, quantity in items),
+            ))
+            lines.append(items)
+
+        orders = models.Order.objects.bulk_create(orders, batch_size=batch_size)
+
+        models.OrderItem.objects.bulk_create([
+            models.OrderItem(order=order, product=product, price=product.price, quantity=quantity)
+            for order, items in zip(orders, lines)
+            for product, quantity in items
+        ], batch_size=batch_size)
+
+
+
+    def index(self, products, batch_size):
+        if not search.backend():
+            return
+
+        categories = {category.id : category for category in models.Category.objects.filter(slug__startswith=PREFIX)}
+        for product in products:
+            product.category = categories[product.category_id]
+
+        for start in range(0, len(products), batch_size):
+            search.index_products(products[start:start + batch_size])
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from shop import models
+from shop.images import needs_derivatives, process_product_image, queue_derivatives
+
+
+
+# Make the resized WebP/AVIF copies for products that don't have them yet (e.g. products added before this existed)
+# By default the work is queued for the workers (run_workers); --sync does it right here
+# Usage: python manage.py generate_image_derivatives --sync --force
+
+class Command(BaseCommand):
+    help = 'Generate (or queue) responsive image derivatives for product images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Also redo products that already have derivatives, rewriting their files')
+        parser.add_argument('--sync', action='store_true', help='Generate now instead of queueing jobs')
+
+    def handle(self, *args, **options):
+        total = 0
+
+        for product in models.Product.objects.exclude(image='').order_by('id').iterator(chunk_size=500):
+            if not options['force'] and not needs_derivatives(product):
+                continue
+
+            if options['sync']:
+                try:
+                    process_product_image(product.id, options['force'])
+                except (OSError, ValueError) as e:                                   # missing / broken image file --> keep going
+                    self.stdout.write(self.style.WARNING(f"{product.name}: {e}"))
+                    continue
+            else:
+                queue_derivatives(product.id, options['force'])
+
+            total += 1
+
+
+        action = 'Generated' if options['sync'] else 'Queued'
+        self.stdout.write(self.style.SUCCESS(f"{action} image derivatives for {total} products"))
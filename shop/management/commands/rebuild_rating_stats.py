@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from shop import models
+
+
+
+# Rebuild the stored rating summary (rating_count, rating_sum, rating_avg) of every product
+# Useful after importing ratings or editing them from the admin panel
+# Usage: python manage.py rebuild_rating_stats
+
+class Command(BaseCommand):
+    help = 'Recalculate rating_count, rating_sum and rating_avg for every product'
+
+    def handle(self, *args, **options):
+
+        # 1 grouped query for all the products that have ratings
+        stats = (
+            models.Rating.objects.values('product_id')
+            .annotate(count=Count('id'), total=Sum('rating'))
+        )
+        stats = {row['product_id'] : row for row in stats}
+
+
+        products = list(models.Product.objects.only('id', 'rating_count', 'rating_sum', 'rating_avg'))
+
+        for product in products:
+            row = stats.get(product.id)
+
+            product.rating_count = row['count'] if row else 0
+            product.rating_sum = row['total'] if row else 0
+            product.rating_avg = round(product.rating_sum / product.rating_count, 2) if product.rating_count else 0
+
+
+        with transaction.atomic():
+            models.Product.objects.bulk_update(products, ['rating_count', 'rating_sum', 'rating_avg'], batch_size=500)
+
+
+        self.stdout.write(self.style.SUCCESS(f"Rating stats rebuilt for {len(products)} products"))
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from shop import models, search, pagecache
+
+
+
+# Rebuild the product full-text search index from scratch
+# Products are read & indexed in batches (keyset on id) so memory stays flat for a big catalog
+# Each batch is committed on its own, so no lock is held on the index for the whole run
+# Usage: python manage.py rebuild_search_index --batch-size 1000
+
+class Command(BaseCommand):
+    help = 'Rebuild the product full-text search index in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        if not search.backend():
+            self.stdout.write(self.style.WARNING('This database has no full-text backend; search uses icontains'))
+            return
+
+        batch_size = options['batch_size']
+        last_id = 0
+        total = 0
+
+        while True:
+            batch = list(
+                models.Product.objects.select_related('category')
+                .filter(id__gt=last_id).order_by('id')[:batch_size]
+            )
+            if not batch:
+                break
+
+            with transaction.atomic():                                                 # 1 short transaction per batch
+                search.index_products(batch)                                           # replaces the rows in place, search keeps working meanwhile
+            last_id = batch[-1].id
+            total += len(batch)
+
+            self.stdout.write(f"Indexed {total} products")
+
+        with transaction.atomic():
+            search.remove_missing()
+
+
+        pagecache.invalidate()                                                         # cached search result pages are old now
+
+        self.stdout.write(self.style.SUCCESS(f"Search index rebuilt for {total} products"))
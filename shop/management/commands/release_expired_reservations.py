@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from shop import inventory
+
+
+
+# Give back the stock of reservations whose payment was never finished
+# Run it from cron, e.g. every 5 minutes
+# Usage: python manage.py release_expired_reservations
+
+class Command(BaseCommand):
+    help = 'Release expired stock reservations and return their stock'
+
+    def handle(self, *args, **options):
+        released = inventory.release_expired()
+
+        self.stdout.write(self.style.SUCCESS(f"Released {released} expired reservations"))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from shop.fake_redis import make_server, redis_url
+
+
+
+# Run the local Redis stand-in (see fake_redis.py)
+# Usage: python manage.py run_fake_redis --port 6380
+
+class Command(BaseCommand):
+    help = 'Run a local in-memory Redis stand-in for the shared cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=6380)
+
+    def handle(self, *args, **options):
+        server = make_server(options['host'], options['port'])
+
+        self.stdout.write(f"CACHE_URL={redis_url(server)}")
+        self.stdout.write(self.style.SUCCESS('Fake Redis running, CTRL-C to stop'))
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
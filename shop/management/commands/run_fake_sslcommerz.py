@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from shop.fake_gateway import make_server, base_url, PAYMENT_PATH, VALIDATION_PATH
+
+
+
+# Run the local SSLCommerz stand-in (see fake_gateway.py)
+# Usage: python manage.py run_fake_sslcommerz --port 8001 --latency 0.2 --fail-rate 0.1
+
+class Command(BaseCommand):
+    help = 'Run a local fake SSLCommerz gateway for offline testing and benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8001)
+        parser.add_argument('--latency', type=float, default=0.0, help='average response delay in seconds')
+        parser.add_argument('--fail-rate', type=float, default=0.0, help='share of requests answered with 503 (0-1)')
+
+    def handle(self, *args, **options):
+        server = make_server(options['host'], options['port'], options['latency'], options['fail_rate'])
+
+        self.stdout.write(f"SSLCOMMERZ_PAYMENT_URL={base_url(server)}{PAYMENT_PATH}")
+        self.stdout.write(f"SSLCOMMERZ_VALIDATION_URL={base_url(server)}{VALIDATION_PATH}")
+        self.stdout.write(self.style.SUCCESS('Fake SSLCommerz running, CTRL-C to stop'))
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop import lifecycle
+
+
+
+# Expire abandoned orders, give their stock back & archive old canceled orders (see shop/lifecycle.py)
+# Usage: python manage.py run_order_lifecycle                  --> 1 run then exit (cron, e.g. every 5 minutes)
+#        python manage.py run_order_lifecycle --loop           --> runs forever, 1 run every --sleep seconds
+
+class Command(BaseCommand):
+    help = 'Expire stale pending orders, release their stock and archive old canceled orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help='orders per transaction (default: ORDER_LIFECYCLE_BATCH)')
+        parser.add_argument('--loop', action='store_true')
+        parser.add_argument('--sleep', type=float, default=300.0, help='seconds between runs with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            stats = lifecycle.run(size=options['batch_size'])
+
+            self.stdout.write(self.style.SUCCESS(
+                f"Expired {stats['expired']} orders, released {stats['released']} reservations, archived {stats['archived']} orders"
+            ))
+
+            if not options['loop']:
+                break
+            time.sleep(options['sleep'])
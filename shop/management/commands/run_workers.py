@@ -0,0 +1,34 @@
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+
+from shop import jobs
+
+
+
+# Background worker for the job queue (order confirmation emails, ...)
+# Usage: python manage.py run_workers            --> runs forever
+#        python manage.py run_workers --once     --> 1 batch then exit (cron)
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--sleep', type=float, default=2.0, help='seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true')
+
+    def handle(self, *args, **options):
+        worker_id = uuid.uuid4().hex
+
+        while True:
+            stats = jobs.run_batch(options['batch_size'], worker_id)
+
+            if any(stats.values()):
+                self.stdout.write(f"done {stats['done']}  retry {stats['retry']}  failed {stats['failed']}")
+
+            if options['once']:
+                break
+            if not any(stats.values()):
+                time.sleep(options['sleep'])
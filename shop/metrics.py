@@ -0,0 +1,126 @@
+import threading
+from collections import Counter
+
+
+
+# In-process metrics (cache hits/misses, per-view query counts & timings, ...)
+# Each worker process keeps its own numbers; the /metrics/ endpoints show the numbers of the process that answers
+#
+#   incr('cache.page.hits')                          counter
+#   incr('db.queries', 5, view='home')               counter with labels
+#   observe('request.duration', 0.12, view='home')   histogram (seconds)
+
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_lock = threading.Lock()
+_counters = Counter()                                                               # (name, labels) --> value
+_histograms = {}                                                                    # (name, labels) --> {'buckets': [..], 'sum': s, 'count': n}
+
+
+
+def _labels(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _series(name, labels):
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+
+def incr(name, amount=1, **labels):
+    with _lock:
+        _counters[(name, _labels(labels))] += amount
+
+
+
+def observe(name, value, **labels):
+    key = (name, _labels(labels))
+
+    with _lock:
+        histogram = _histograms.setdefault(key, {'buckets' : [0] * len(DURATION_BUCKETS), 'sum' : 0.0, 'count' : 0})
+
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if value <= bound:
+                histogram['buckets'][i] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+
+
+# {'cache.page.hits': 3, 'db.queries{view="home"}': 12, ...}
+def snapshot():
+    with _lock:
+        return {_series(name, labels) : value for (name, labels), value in _counters.items()}
+
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+
+# hit ratio per cache: {'product_card': {'hits': 10, 'misses': 2, 'hit_ratio': 0.83}}
+def cache_stats():
+    with _lock:
+        counters = {name : value for (name, labels), value in _counters.items() if not labels}
+
+    stats = {}
+
+    for name, value in counters.items():
+        if not name.startswith('cache.'):
+            continue
+
+        _, cache_name, outcome = name.split('.', 2)
+        stats.setdefault(cache_name, {'hits' : 0, 'misses' : 0})[outcome] = value
+
+    for entry in stats.values():
+        total = entry['hits'] + entry['misses']
+        entry['hit_ratio'] = round(entry['hits'] / total, 4) if total else None
+
+    return stats
+
+
+
+
+# Prometheus text format
+# 'db.queries' counter   --> shop_db_queries_total{view="home"} 12
+# 'request.duration'     --> shop_request_duration_seconds_bucket{le="0.1",view="home"} 3 ... _sum / _count
+
+def prometheus_name(name):
+    return 'shop_' + name.replace('.', '_').replace('-', '_')
+
+
+
+def prometheus():
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((key, {**value, 'buckets' : list(value['buckets'])}) for key, value in _histograms.items())
+
+    lines = []
+    declared = set()
+
+    for (name, labels), value in counters:
+        metric = prometheus_name(name) + '_total'
+        if metric not in declared:
+            lines.append(f'# TYPE {metric} counter')
+            declared.add(metric)
+        lines.append(f'{_series(metric, labels)} {value}')
+
+    for (name, labels), histogram in histograms:
+        metric = prometheus_name(name) + '_seconds'
+        if metric not in declared:
+            lines.append(f'# TYPE {metric} histogram')
+            declared.add(metric)
+
+        for bound, count in zip(DURATION_BUCKETS, histogram['buckets']):
+            lines.append(f"{_series(metric + '_bucket', _labels({**dict(labels), 'le' : bound}))} {count}")
+        lines.append(f"{_series(metric + '_bucket', _labels({**dict(labels), 'le' : '+Inf'}))} {histogram['count']}")
+        lines.append(f"{_series(metric + '_sum', labels)} {histogram['sum']:.6f}")
+        lines.append(f"{_series(metric + '_count', labels)} {histogram['count']}")
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,43 @@
+# Generated by Django 6.0 on 2026-10-18 17:58
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def fill_rating_stats(apps, schema_editor):
+    Product = apps.get_model('shop', 'Product')
+    Rating = apps.get_model('shop', 'Rating')
+
+    stats = Rating.objects.values('product_id').annotate(count=Count('id'), total=Sum('rating'))
+    for row in stats:
+        Product.objects.filter(id=row['product_id']).update(
+            rating_count=row['count'],
+            rating_sum=row['total'],
+            rating_avg=round(row['total'] / row['count'], 2),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_avg',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0, max_digits=3),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_rating_stats, migrations.RunPython.noop),
+    ]
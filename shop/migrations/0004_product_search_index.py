@@ -0,0 +1,61 @@
+# Generated by Django 6.0 on 2026-10-18 18:20
+
+from django.db import migrations
+
+
+# The SQL is written out here (not imported from shop.search) so this migration
+# keeps creating the same schema whatever shop/search.py looks like later
+
+FTS_TABLE = 'shop_product_fts'
+PG_TABLE = 'shop_product_search'
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            "name, description, category, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        schema_editor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, name, description, category) "
+            "SELECT p.id, p.name, p.description, c.name FROM shop_product p JOIN shop_category c ON c.id = p.category_id"
+        )
+
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            f"CREATE TABLE IF NOT EXISTS {PG_TABLE} ("
+            "product_id bigint PRIMARY KEY REFERENCES shop_product(id) ON DELETE CASCADE, "
+            "document tsvector NOT NULL)"
+        )
+        schema_editor.execute(f"CREATE INDEX IF NOT EXISTS {PG_TABLE}_gin ON {PG_TABLE} USING GIN (document)")
+        schema_editor.execute(
+            f"INSERT INTO {PG_TABLE} (product_id, document) "
+            "SELECT p.id, "
+            "setweight(to_tsvector('simple', p.name), 'A') || "
+            "setweight(to_tsvector('simple', p.description), 'B') || "
+            "setweight(to_tsvector('simple', c.name), 'C') "
+            "FROM shop_product p JOIN shop_category c ON c.id = p.category_id "
+            "ON CONFLICT (product_id) DO NOTHING"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+
+    if vendor == 'sqlite':
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    elif vendor == 'postgresql':
+        schema_editor.execute(f"DROP TABLE IF EXISTS {PG_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0003_product_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 6.0 on 2026-10-18 18:14
+
+from django.db import migrations, models
+from django.db.models import F, Sum
+
+
+def fill_total_amount(apps, schema_editor):
+    Order = apps.get_model('shop', 'Order')
+    OrderItem = apps.get_model('shop', 'OrderItem')
+
+    totals = OrderItem.objects.values('order_id').annotate(
+        total=Sum(F('quantity') * F('price'), output_field=models.DecimalField(max_digits=12, decimal_places=2))
+    )
+    for row in totals:
+        Order.objects.filter(id=row['order_id']).update(total_amount=row['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0006_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='total_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(fill_total_amount, migrations.RunPython.noop),
+    ]
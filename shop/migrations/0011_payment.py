@@ -0,0 +1,33 @@
+# Generated by Django 6.0 on 2026-10-18 19:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0010_relatedproduct'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Payment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tran_id', models.CharField(max_length=100, unique=True)),
+                ('val_id', models.CharField(max_length=100)),
+                ('amount', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True)),
+                ('status', models.CharField(choices=[('received', 'Received'), ('paid', 'Paid'), ('invalid', 'Invalid')], default='received', max_length=10)),
+                ('source', models.CharField(choices=[('browser', 'Browser'), ('ipn', 'IPN')], max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payments', to='shop.order')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_at'], name='payment_status_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 6.0 on 2026-10-18 19:06
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def mark_blank_orders_pending(apps, schema_editor):
+    Order = apps.get_model('shop', 'Order')
+    Order.objects.filter(status='').update(status='pending')                 # checkout used to leave the status blank
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0011_payment'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_id', models.PositiveBigIntegerField(unique=True)),
+                ('email', models.EmailField(max_length=254)),
+                ('total_amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('items', models.JSONField(default=list)),
+                ('created_at', models.DateTimeField()),
+                ('canceled_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('shipped', 'Shipped'), ('delivered', 'Delivered'), ('canceled', 'Canceled')], default='pending', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'updated_at'], name='order_status_updated_idx'),
+        ),
+        migrations.RunPython(mark_blank_orders_pending, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='archivedorder',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_orders', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -1,4 +1,8 @@
-from django.db import models
+from django.db import models, transaction
+
+from django.db.models import Count, Sum, Avg, Value, OuterRef, Subquery
+
+from django.db.models.functions import Coalesce, Round
 
 from django.contrib.auth.models import User                                         # rating model
 
@@ -16,6 +20,7 @@ class Category(models.Model):
     name = models.CharField(max_length=100)
     slug = models.SlugField(max_length=100, unique=True)                        # slug used for URL; unique = true--> 1 name for 1 product
     description = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)                           # catalog API ETag (api.py)
 
 
     class Meta:
@@ -44,6 +49,27 @@ class Product(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
     image = models.ImageField(upload_to='products/%Y/%m/%d')                                 # images will be uploaded to the product folder based on date
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)              # resized WebP/AVIF copies of the image (see images.py)
+
+
+    # Rating summary (denormalized)
+    # Stored on the product so that product cards don't need to query the Rating table
+    # Kept in sync by 'update_rating_stats()' whenever a rating is saved or deleted (signals.py)
+    rating_count = models.PositiveIntegerField(default=0)                                    # how many ratings the product has
+    rating_sum = models.PositiveIntegerField(default=0)                                      # sum of all the rating values
+    rating_avg = models.DecimalField(max_digits=3, decimal_places=2, default=0)              # rating_sum / rating_count
+
+
+    # Composite indexes for the cursor pagination of the product list (sort field + id)
+    # The same indexes also serve the price & rating filters
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='product_created_id_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_id_idx'),
+            models.Index(fields=['rating_avg', 'id'], name='product_rating_id_idx'),
+            models.Index(fields=['available', 'created_at'], name='product_available_created_idx'),         # home: newest available products
+            models.Index(fields=['category', 'created_at', 'id'], name='product_category_created_idx'),     # category page, newest first
+        ]
 
 
 
@@ -54,12 +80,37 @@ class Product(models.Model):
     # Rating for each product
     # 1 product has been purchased by 10 people
     # 5 people gave rating --> 4.5, 5, 3, 4, 2.5
-    # We will show the Mean score of the rating for each product using a Function
+    # We will show the Mean score of the rating for each product using the stored 'rating_avg'
     def average_rating(self):
-        ratings = self.rating.all()                                                            # 'self.rating.all()'--> here 'rating' is the "related_name='ratings'" of Rating model
+        return self.rating_avg
 
-        if ratings.count > 0:
-            return sum([i.rating for i in ratings])/ratings.count()
+
+    # Recalculate the rating summary from the Rating table
+    # The product row is locked first, then 1 UPDATE computes count, sum & average as subqueries:
+    # a 2nd rating saved at the same time waits for the lock and its UPDATE (a new statement) sees the 1st rating,
+    # so the summary can't miss one of them (no read in Python, then write)
+    @staticmethod
+    def refresh_rating_stats(product_id):
+        ratings = Rating.objects.filter(product=OuterRef('pk')).order_by().values('product')
+
+        def stat(aggregate, field):
+            return Coalesce(Subquery(ratings.annotate(value=aggregate).values('value')), Value(0), output_field=field)
+
+        with transaction.atomic():
+            list(Product.objects.select_for_update().filter(id=product_id).values_list('id'))
+
+            Product.objects.filter(id=product_id).update(                                   # "update()" --> only touches the rating columns; 'updated_at' & stock stay as they are
+                rating_count=stat(Count('id'), models.PositiveIntegerField()),
+                rating_sum=stat(Sum('rating'), models.PositiveIntegerField()),
+                rating_avg=stat(Round(Avg('rating'), 2), models.DecimalField(max_digits=3, decimal_places=2)),
+            )
+
+
+    def update_rating_stats(self):
+        Product.refresh_rating_stats(self.id)
+        self.rating_count, self.rating_sum, self.rating_avg = (
+            Product.objects.filter(id=self.id).values_list('rating_count', 'rating_sum', 'rating_avg').get()
+        )
 
 
 
@@ -78,6 +129,14 @@ class Rating(models.Model):
     
     comment = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)                                                                        # a rating can be edited (catalog API ETag)
+
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'user'], name='rating_product_user_idx'),                       # "has this user rated this product?"
+            models.Index(fields=['product', 'created_at', 'id'], name='rating_product_created_idx'),        # catalog API: a product's ratings, newest first
+        ]
 
 
     def __str__(self):
@@ -154,6 +213,7 @@ class Order(models.Model):
         ('shipped', 'Shipped'),
         ('delivered', 'Delivered'),
         ('canceled', 'Canceled'),
+        ('review', 'Needs review'),                             # paid after it was canceled / its stock ran out (payments.confirm)
     ]
 
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='orders')
@@ -171,15 +231,30 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
-    status = models.CharField(max_length=10, choices=STATUS)
+    status = models.CharField(max_length=10, choices=STATUS, default='pending')
+
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)          # saved at checkout (sum of the order items' quantity * price)
+
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id'], name='order_user_created_idx'),              # profile: the user's orders, newest first
+            models.Index(fields=['status', 'updated_at'], name='order_status_updated_idx'),             # lifecycle.py: stale pending & old canceled orders
+        ]
 
 
     def __str__(self):
         return f"Order #{self.id}"                       # Order #2
 
 
+    # stored when the order is placed --> no query, and it never changes if a product price changes later
     def get_total_cost(self):
-        return sum(item.get_cost() for item in self.order_items.all())                  # 'get_cost()' from CartItem model
+        return self.total_amount
+
+
+    # calculate the total from the order items (used when the order is placed)
+    def calculate_total_cost(self):
+        return sum(item.get_cost() for item in self.order_items.all())                  # 'get_cost()' from OrderItem model
                                                                                         # "self.order_items.all()"-----> 'order_items' from OrderItem Model
 
 
@@ -196,9 +271,177 @@ class OrderItem(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveBigIntegerField(default=1)
     price = models.DecimalField(max_digits=10, decimal_places=2)
-    
+
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'order'], name='orderitem_product_order_idx'),                 # rate_product: "did this user buy this product?"
+        ]
+
     def get_cost(self):
-        return self.quantity*self.product.price  # 20
+        return self.quantity*self.price  # 20  ('price' = product price when the order was placed)
         
 
-    
\ No newline at end of file
+    
+
+
+
+
+
+
+# Stock Reservation
+# At checkout the ordered quantity is taken from the product stock right away and "held" for the order
+# held --> committed (payment success) | released (payment fail/cancel or the hold expired --> stock given back)
+class StockReservation(models.Model):
+
+    STATUS = [
+        ('held', 'Held'),
+        ('committed', 'Committed'),
+        ('released', 'Released'),
+    ]
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='reservations')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveBigIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS, default='held')
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'expires_at'], name='reservation_expiry_idx'),            # finding expired holds
+        ]
+
+
+    def __str__(self):
+        return f"{self.quantity} X {self.product_id} for Order #{self.order_id} ({self.status})"
+
+
+
+
+
+# Payment callback (browser success redirect or SSLCommerz IPN), checked with the validation API
+# 1 row per tran_id (idempotency key): repeated callbacks find it with 1 indexed lookup
+# received --> paid (validated, order marked paid) | invalid (validation said no)
+class Payment(models.Model):
+
+    STATUS = [
+        ('received', 'Received'),
+        ('paid', 'Paid'),
+        ('invalid', 'Invalid'),
+    ]
+
+    SOURCE = [
+        ('browser', 'Browser'),
+        ('ipn', 'IPN'),
+    ]
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='payments')
+    tran_id = models.CharField(max_length=100, unique=True)
+    val_id = models.CharField(max_length=100)
+    amount = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)           # as validated by the gateway
+    status = models.CharField(max_length=10, choices=STATUS, default='received')
+    source = models.CharField(max_length=10, choices=SOURCE)
+    attempts = models.PositiveIntegerField(default=0)                                               # validation calls made
+    last_error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='payment_status_idx'),                 # IPNs waiting for validation
+        ]
+
+
+    def __str__(self):
+        return f"Payment {self.tran_id} for Order #{self.order_id} ({self.status})"
+
+
+
+
+
+
+
+# Background Job (outbox)
+# Slow work (emails, ...) is saved here in the same transaction as the change that needs it,
+# and done later by "python manage.py run_workers" --> the customer never waits for it
+# pending --> running --> done | back to pending with a delay (retry) | failed (too many attempts)
+class Job(models.Model):
+
+    STATUS = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=50)                                             # which handler runs it, e.g. 'order_confirmation_email'
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS, default='pending')
+
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField()                                                  # not before this time (retry backoff)
+    claimed_by = models.CharField(max_length=64, blank=True)                            # worker that is running it
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_queue_idx'),                     # picking the next jobs
+        ]
+
+
+    def __str__(self):
+        return f"{self.kind} #{self.id} ({self.status})"
+
+
+
+
+
+
+# Related Product (precomputed recommendations)
+# Top-K related products of every product, ranked 1..K; filled offline by recommendations.py
+# score = orders that bought both products (co-purchase) + a bonus when both are in the same category
+class RelatedProduct(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='related_entries')
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='related_to')
+    rank = models.PositiveSmallIntegerField()                                                # 1 = best
+    score = models.FloatField()
+
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'rank'], name='related_product_rank_uniq'),          # also the index of the detail page lookup
+        ]
+
+
+    def __str__(self):
+        return f"{self.product_id} --> {self.related_id} (#{self.rank})"
+
+
+
+
+# Canceled order that was never paid, moved out of Order/OrderItem by lifecycle.py
+# 1 row per order, the lines kept as JSON: [[product_id, quantity, price], ...]
+class ArchivedOrder(models.Model):
+    order_id = models.PositiveBigIntegerField(unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_orders')
+    email = models.EmailField()
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2)
+    items = models.JSONField(default=list)
+
+    created_at = models.DateTimeField()                                                             # when the order was placed
+    canceled_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+
+    def __str__(self):
+        return f"Archived Order #{self.order_id}"
@@ -0,0 +1,233 @@
+import asyncio
+import re
+import time
+from functools import wraps
+from urllib.parse import parse_qsl, urlencode
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+
+from . import metrics
+
+
+
+# Full-page cache for anonymous visitors (home & product list)
+# Every anonymous visitor gets the same HTML, so it is rendered once and reused.
+#
+#   key    : page:<path>?<normalized query string>
+#   entry  : {'version', 'expires', 'content', 'content_type'}
+#   fresh  : entry.version == current version and not expired
+#   stale  : everything else that is still in the cache (kept for PAGE_CACHE_STALE_SECONDS)
+#
+# Catalog writes bump the version (signals.py), which makes every page stale at once.
+# Stampede protection (single flight): only the request that gets the lock renders the page again,
+# the others are answered with the stale copy (or wait a moment for the new one).
+#
+# Logged-in users are never served from here (navbar, cart count, ...).
+# The csrf token in the page is swapped for the visitor's own token on the way out.
+# Works for sync and async (ASGI) views.
+
+
+PAGE_CACHE_SECONDS = getattr(settings, 'PAGE_CACHE_SECONDS', 60)                  # stock changes are not signalled --> keep this short
+PAGE_CACHE_STALE_SECONDS = getattr(settings, 'PAGE_CACHE_STALE_SECONDS', 60 * 10)
+
+LOCK_SECONDS = 10                                                                   # renderer died --> lock frees itself
+LOCK_WAIT_SECONDS = 2                                                               # nothing stale to serve --> wait this long for the renderer
+LOCK_POLL_SECONDS = 0.05
+
+VERSION_KEY = 'pages:version'
+
+CSRF_INPUT = re.compile(r'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+CSRF_PLACEHOLDER = 'csrf-token-placeholder-7e2a'
+
+
+
+def get_version():
+    return cache.get_or_set(VERSION_KEY, 1, None)
+
+
+async def aget_version():
+    return await cache.aget_or_set(VERSION_KEY, 1, None)
+
+
+def invalidate():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:                                                                # key missing (cache restarted)
+        cache.set(VERSION_KEY, 1, None)
+
+
+# inside a transaction --> once more after the commit, otherwise a request running meanwhile
+# could cache the old data under the new version
+def invalidate_on_commit():
+    invalidate()
+
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(invalidate)
+
+
+
+
+# ?b=2&a=1&a=&utm_source=x  -->  a=1&b=2  (order & empty values & tracking params don't make a new page)
+def normalize_query(query_dict):
+    params = [
+        (key, value) for key, value in parse_qsl(query_dict.urlencode())
+        if value.strip() and not key.startswith('utm_')
+    ]
+    return urlencode(sorted(params))
+
+
+
+def page_key(request):
+    return f'page:{request.path}?{normalize_query(request.GET)}'
+
+
+
+# user --> already loaded (async views: await request.auser())
+def is_cacheable_request(request, user=None):
+    user = request.user if user is None else user
+
+    return (
+        request.method in ('GET', 'HEAD')
+        and not user.is_authenticated
+        and 'messages' not in request.COOKIES                                       # a flash message is waiting --> personal page
+    )
+
+
+
+
+# outcome: 'hit' | 'stale'
+def serve(request, entry, outcome):
+    metrics.incr('cache.page.hits' if outcome == 'hit' else 'cache.page.stale')
+
+    content = entry['content'].replace(CSRF_PLACEHOLDER, get_token(request))        # also sets the visitor's csrf cookie
+    response = HttpResponse(content, content_type=entry['content_type'])
+    response['X-Page-Cache'] = outcome
+    return response
+
+
+
+# None --> response is not cacheable (error, streaming, sets cookies)
+def cache_entry(response, version):
+    if response.status_code != 200 or response.streaming or response.cookies:
+        return None
+
+    return {
+        'version' : version,
+        'expires' : time.time() + PAGE_CACHE_SECONDS,
+        'content' : CSRF_INPUT.sub(rf'\g<1>{CSRF_PLACEHOLDER}\g<2>', response.content.decode(response.charset)),
+        'content_type' : response['Content-Type'],
+    }
+
+
+
+def render_and_store(view, request, key, version, *args, **kwargs):
+    response = view(request, *args, **kwargs)
+    entry = cache_entry(response, version)
+
+    if entry is not None:
+        cache.set(key, entry, PAGE_CACHE_SECONDS + PAGE_CACHE_STALE_SECONDS)
+        response['X-Page-Cache'] = 'miss'
+    return response
+
+
+async def arender_and_store(view, request, key, version, *args, **kwargs):
+    response = await view(request, *args, **kwargs)
+    entry = cache_entry(response, version)
+
+    if entry is not None:
+        await cache.aset(key, entry, PAGE_CACHE_SECONDS + PAGE_CACHE_STALE_SECONDS)
+        response['X-Page-Cache'] = 'miss'
+    return response
+
+
+
+
+def anonymous_page_cache(view):
+    if iscoroutinefunction(view):
+        return async_page_cache(view)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not is_cacheable_request(request):
+            return view(request, *args, **kwargs)
+
+        key = page_key(request)
+        lock_key = f'lock:{key}'
+        version = get_version()
+        entry = cache.get(key)
+
+        if entry and entry['version'] == version and entry['expires'] > time.time():
+            return serve(request, entry, 'hit')
+
+
+        # stale or missing --> 1 request renders, the rest use the stale copy
+        if cache.add(lock_key, 1, LOCK_SECONDS):
+            metrics.incr('cache.page.misses')
+            try:
+                return render_and_store(view, request, key, version, *args, **kwargs)
+            finally:
+                cache.delete(lock_key)
+
+        if entry:
+            return serve(request, entry, 'stale')
+
+
+        # first render ever is still running somewhere else --> wait a little instead of rendering too
+        deadline = time.time() + LOCK_WAIT_SECONDS
+        while time.time() < deadline:
+            time.sleep(LOCK_POLL_SECONDS)
+            entry = cache.get(key)
+            if entry:
+                return serve(request, entry, 'hit')
+
+        metrics.incr('cache.page.misses')
+        return view(request, *args, **kwargs)
+
+    return wrapper
+
+
+
+# same steps for an async view; the lock wait sleeps without holding a thread
+def async_page_cache(view):
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if not is_cacheable_request(request, await request.auser()):
+            return await view(request, *args, **kwargs)
+
+        key = page_key(request)
+        lock_key = f'lock:{key}'
+        version = await aget_version()
+        entry = await cache.aget(key)
+
+        if entry and entry['version'] == version and entry['expires'] > time.time():
+            return serve(request, entry, 'hit')
+
+
+        if await cache.aadd(lock_key, 1, LOCK_SECONDS):
+            metrics.incr('cache.page.misses')
+            try:
+                return await arender_and_store(view, request, key, version, *args, **kwargs)
+            finally:
+                await cache.adelete(lock_key)
+
+        if entry:
+            return serve(request, entry, 'stale')
+
+
+        deadline = time.time() + LOCK_WAIT_SECONDS
+        while time.time() < deadline:
+            await asyncio.sleep(LOCK_POLL_SECONDS)
+            entry = await cache.aget(key)
+            if entry:
+                return serve(request, entry, 'hit')
+
+        metrics.incr('cache.page.misses')
+        return await view(request, *args, **kwargs)
+
+    return wrapper
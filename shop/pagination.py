@@ -0,0 +1,152 @@
+import base64
+import json
+import math
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+
+# Keyset (cursor) pagination for the product list
+# OFFSET pagination makes the DB scan every skipped row, so page 100 is much slower than page 1
+# Here every page starts right after the last product of the previous page:
+#   WHERE (sort_value, id) is after (last_sort_value, last_id) ORDER BY sort_value, id LIMIT page_size
+# so a deep page costs the same as the first page (served by the composite indexes on Product)
+
+
+PAGE_SIZE = 12
+
+
+# sort key --> (sort field, descending or not)
+# 'id' is always used as the tie breaker, so the order is stable even when 2 products have the same price
+SORTS = {
+    'newest' : ('created_at', True),
+    'price_low' : ('price', False),
+    'price_high' : ('price', True),
+    'rating' : ('rating_avg', True),
+    'relevance' : ('search_rank', False),                                         # only with a search; 'search_rank' is annotated by search.py
+}
+
+DEFAULT_SORT = 'newest'
+
+
+
+def parse_decimal(value):
+    number = Decimal(value)
+    if not number.is_finite():
+        raise ValueError(value)
+    return number
+
+
+def parse_float(value):
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(value)
+    return number
+
+
+def parse_timestamp(value):
+    moment = parse_datetime(value)
+    if moment is None:
+        raise ValueError(value)
+    return moment
+
+
+# sort field --> the cursor value as the ORM needs it (a bad value must not reach the query)
+VALUE_PARSERS = {
+    'created_at' : parse_timestamp,
+    'price' : parse_decimal,
+    'rating_avg' : parse_decimal,
+    'search_rank' : parse_float,
+}
+
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+
+def get_sort(request):
+    searching = bool(request.GET.get('search'))
+    sort = request.GET.get('sort') or ('relevance' if searching else DEFAULT_SORT)           # a search is sorted by relevance unless the user picks a sort
+
+    if sort not in SORTS or (sort == 'relevance' and not searching):
+        return DEFAULT_SORT                                                                    # unknown sort value --> default sort
+    return sort
+
+
+
+
+# cursor = last product's (sort value, id) --> JSON --> url-safe base64
+def encode_cursor(sort, product):
+    field, _ = SORTS[sort]
+    return cursor_for(sort, getattr(product, field), product.id)
+
+
+def cursor_for(sort, value, last_id):
+    data = [sort, value.isoformat() if hasattr(value, 'isoformat') else str(value), last_id]
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip('=')
+
+
+
+def decode_cursor(sort, cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_sort, value, last_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise InvalidCursor('Malformed cursor')
+
+    if cursor_sort != sort or not isinstance(last_id, int) or isinstance(last_id, bool):      # a cursor is only valid for the sort it was made with
+        raise InvalidCursor('Cursor does not match the sort order')
+
+    field, _ = SORTS[sort]
+    try:
+        if not isinstance(value, str):
+            raise TypeError(value)
+        value = VALUE_PARSERS[field](value)
+    except (ValueError, TypeError, InvalidOperation):
+        raise InvalidCursor('Malformed cursor value')
+
+    return value, last_id
+
+
+
+
+# sorted products that come after the cursor (not limited to a page yet)
+def after_cursor(products, sort, cursor=None):
+    field, descending = SORTS[sort]
+
+    if descending:
+        products = products.order_by(f'-{field}', '-id')
+    else:
+        products = products.order_by(field, 'id')
+
+
+    if cursor:
+        value, last_id = decode_cursor(sort, cursor)
+        after = 'lt' if descending else 'gt'
+
+        products = products.filter(
+            Q(**{f'{field}__{after}' : value}) |
+            Q(**{field : value, f'id__{after}' : last_id})
+        )
+
+    return products
+
+
+
+
+# returns (products of this page, cursor for the next page or None)
+def paginate_products(products, sort, cursor=None, page_size=PAGE_SIZE):
+    products = after_cursor(products, sort, cursor)
+
+    page = list(products[:page_size + 1])                                          # 1 extra row tells us if there is a next page
+
+    next_cursor = None
+    if len(page) > page_size:
+        page = page[:page_size]
+        next_cursor = encode_cursor(sort, page[-1])
+
+    return page, next_cursor
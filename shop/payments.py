@@ -0,0 +1,212 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import models
+from . import jobs
+from . import metrics
+from .gateway import get_client, GatewayError
+from .inventory import commit_reservations
+
+
+logger = logging.getLogger(__name__)
+
+
+
+# Payment confirmation
+#
+# The success redirect (browser) and the IPN (SSLCommerz --> us, server to server) both only *say* a payment was made.
+# Nothing is marked paid until the SSLCommerz validation API agrees: status VALID, same tran_id, same amount.
+#
+# record()  --> 1 Payment row per tran_id (idempotency key); a repeated callback finds the same row
+# confirm() --> UPDATE order SET paid = true WHERE id = .. AND paid = false
+#               only the call that flips the row commits the stock & queues the email, so 2 callbacks racing
+#               each other (browser + IPN, a retried IPN) can't sell the stock twice or send 2 emails
+#             --> paid, but the order was already canceled (lifecycle expiry) or its stock is gone meanwhile:
+#               status 'review' + a warning, for a refund or a manual decision; nothing is oversold
+# validate_received() --> IPNs are validated in batches by the worker ('validate_payments' job),
+#                         the validation calls run in parallel over the pooled gateway client
+
+
+VALID_STATUSES = {'VALID', 'VALIDATED'}
+
+
+
+class InvalidPayment(Exception):
+    pass
+
+
+
+
+# tran_id is the order id (see sslcommerz.payment_post_data)
+def order_for(tran_id):
+    try:
+        return models.Order.objects.get(id=int(tran_id))
+    except (TypeError, ValueError, models.Order.DoesNotExist):
+        raise InvalidPayment(f'Unknown transaction {tran_id!r}')
+
+
+
+def record(order, tran_id, val_id, source):
+    if not val_id:
+        raise InvalidPayment('Missing val_id')
+
+    payment, created = models.Payment.objects.get_or_create(
+        tran_id=tran_id, defaults={'order' : order, 'val_id' : val_id, 'source' : source}
+    )
+
+    # another val_id (new attempt, or the real one after a forged callback was rejected) --> validate that one
+    # otherwise anyone could lock an order out of being paid by posting a fake val_id first
+    if not created and payment.status != 'paid' and payment.val_id != val_id:
+        payment.val_id, payment.status, payment.last_error = val_id, 'received', ''
+        payment.save(update_fields=['val_id', 'status', 'last_error', 'updated_at'])
+
+    return payment
+
+
+
+
+# gateway answer --> the validated amount, or InvalidPayment
+def check(payment, data):
+    if data.get('status') not in VALID_STATUSES:
+        raise InvalidPayment(f"Gateway status {data.get('status')!r}")
+
+    if str(data.get('tran_id')) != payment.tran_id:
+        raise InvalidPayment(f"Validated tran_id {data.get('tran_id')!r} is not {payment.tran_id!r}")
+
+    try:
+        amount = Decimal(str(data.get('amount')))
+    except InvalidOperation:
+        raise InvalidPayment(f"Bad amount {data.get('amount')!r}")
+
+    if amount != payment.order.total_amount:
+        raise InvalidPayment(f'Paid {amount}, order total is {payment.order.total_amount}')
+
+    return amount
+
+
+
+# returns True if this call marked the order paid
+def confirm(payment, amount):
+    unpaid = models.Order.objects.filter(id=payment.order_id, paid=False)
+    paid = {'paid' : True, 'transaction_id' : payment.tran_id, 'updated_at' : timezone.now()}
+
+    with transaction.atomic():
+        flipped = unpaid.exclude(status='canceled').update(status='processing', **paid)
+        late = not flipped and unpaid.filter(status='canceled').update(status='review', **paid)           # its stock was given back already
+
+        short = commit_reservations(payment.order) if flipped else []                       # the held stock is sold
+
+        if short:
+            models.Order.objects.filter(id=payment.order_id).update(status='review')
+
+        if late or short:
+            metrics.incr('payments.review')
+            logger.warning(
+                'Order %s paid (%s) but %s: needs a refund or manual review', payment.order_id, payment.tran_id,
+                'it was already canceled' if late else f'products {short} are out of stock'
+            )
+        elif flipped:
+            jobs.enqueue('order_confirmation_email', order_id=payment.order_id)
+
+        models.Payment.objects.filter(id=payment.id).update(
+            status='paid', amount=amount, last_error='', updated_at=timezone.now()
+        )
+
+    payment.status, payment.amount = 'paid', amount
+    return bool(flipped or late)
+
+
+
+def reject(payment, error):
+    logger.warning('Payment %s rejected: %s', payment.tran_id, error)
+    models.Payment.objects.filter(id=payment.id).update(status='invalid', last_error=str(error), updated_at=timezone.now())
+    payment.status = 'invalid'
+
+
+
+# gateway answer (or GatewayError) --> paid / invalid; a gateway error leaves it 'received' for a later try
+def settle(payment, data):
+    models.Payment.objects.filter(id=payment.id).update(attempts=payment.attempts + 1)
+    payment.attempts += 1
+
+    if isinstance(data, GatewayError):
+        models.Payment.objects.filter(id=payment.id).update(last_error=str(data))
+        raise data
+
+    try:
+        amount = check(payment, data)
+    except InvalidPayment as e:
+        reject(payment, e)
+        raise
+
+    return confirm(payment, amount)
+
+
+
+
+# browser success redirect: validate right away, the customer is waiting for the answer
+# raises InvalidPayment, or GatewayError (the payment stays 'received' and is validated by the worker)
+def process(order, tran_id, val_id, source='browser'):
+    payment = record(order, tran_id, val_id, source)
+    payment.order = order
+
+    if payment.status == 'paid':
+        return payment
+    if payment.status == 'invalid':
+        raise InvalidPayment(payment.last_error)
+
+    try:
+        data = get_client().validate(payment.val_id)
+    except GatewayError as e:
+        data = e
+        queue_validation()
+
+    settle(payment, data)
+    return payment
+
+
+
+
+# 1 pending 'validate_payments' job is enough: it takes every received payment
+def queue_validation():
+    if not models.Job.objects.filter(kind='validate_payments', status='pending').exists():
+        jobs.enqueue('validate_payments')
+
+
+
+def validate_received(limit=100):
+    payments = list(
+        models.Payment.objects.filter(status='received').select_related('order').order_by('created_at')[:limit]
+    )
+    stats = {'paid' : 0, 'invalid' : 0, 'error' : 0}
+    if not payments:
+        return stats
+
+    client = get_client()
+
+    def call(payment):
+        try:
+            return client.validate(payment.val_id)
+        except GatewayError as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=min(client.pool_size, len(payments))) as pool:       # 1 pooled connection per thread
+        answers = list(pool.map(call, payments))
+
+    for payment, data in zip(payments, answers):                                              # database work stays in this thread
+        try:
+            settle(payment, data)
+            stats['paid'] += 1
+        except InvalidPayment:
+            stats['invalid'] += 1
+        except GatewayError:
+            stats['error'] += 1
+
+    if stats['error']:
+        raise GatewayError(f"{stats['error']} of {len(payments)} payments could not be validated")     # the job is retried with backoff
+
+    return stats
@@ -0,0 +1,61 @@
+import re
+
+from django.db import connection
+
+
+
+# Query plans
+# Used by the query-plan regression tests: every query a view runs is EXPLAINed and
+# a full table scan (no index used) on a big table fails the test.
+#
+#   SQLite   : EXPLAIN QUERY PLAN  --> "SCAN shop_product"               (full scan)
+#                                      "SEARCH shop_product USING INDEX ..." / "SCAN ... USING INDEX ..." (ok)
+#   Postgres : EXPLAIN             --> "Seq Scan on shop_product"         (full scan)
+
+
+EXPLAINABLE = ('SELECT', 'UPDATE', 'DELETE')
+
+SQLITE_FULL_SCAN = re.compile(r'^SCAN (\w+)(?: AS \w+)?$')
+POSTGRES_FULL_SCAN = re.compile(r'Seq Scan on (\w+)')
+
+
+
+def explain(sql):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(f'EXPLAIN {sql}')
+            return [row[0] for row in cursor.fetchall()]
+
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        return [row[-1] for row in cursor.fetchall()]
+
+
+
+def scanned_tables(plan):
+    pattern = POSTGRES_FULL_SCAN if connection.vendor == 'postgresql' else SQLITE_FULL_SCAN
+
+    tables = []
+    for line in plan:
+        match = pattern.search(line.strip())
+        if match:
+            tables.append(match.group(1))
+    return tables
+
+
+
+# queries = CaptureQueriesContext(connection).captured_queries
+# returns [(sql, plan, [tables scanned in full])] for the queries with a full scan
+def full_scans(queries, allowed_tables=()):
+    found = []
+
+    for query in queries:
+        sql = query['sql']
+        if not sql.lstrip().upper().startswith(EXPLAINABLE):
+            continue
+
+        plan = explain(sql)
+        tables = [table for table in scanned_tables(plan) if table not in allowed_tables]
+        if tables:
+            found.append((sql, plan, tables))
+
+    return found
@@ -0,0 +1,137 @@
+from collections import Counter, defaultdict
+
+from django.db import transaction
+
+from . import models
+
+
+
+# Related products
+# Computed offline (python manage.py compute_related_products, or the 'compute_related_products' job) and stored
+# as K rows per product in RelatedProduct, so the detail page reads them with 1 query.
+#
+# Score of a candidate for a product:
+#   co-purchase : number of paid orders that contain both products
+#   category    : + CATEGORY_BONUS when both are in the same category
+# Products without enough co-purchases are topped up with the best rated products of their own category.
+
+
+TOP_K = 8
+
+CATEGORY_BONUS = 0.5
+MAX_ITEMS_PER_ORDER = 50                                                            # huge (wholesale) orders say little about "bought together"
+
+
+
+# {product_id: Counter({other_product_id: orders with both})}
+def co_purchase_counts():
+    counts = defaultdict(Counter)
+
+    items = (
+        models.OrderItem.objects.filter(order__paid=True)
+        .order_by('order_id').values_list('order_id', 'product_id').distinct()
+        .iterator(chunk_size=5000)
+    )
+
+    def add(products):
+        if 1 < len(products) <= MAX_ITEMS_PER_ORDER:
+            for product in products:
+                for other in products:
+                    if other != product:
+                        counts[product][other] += 1
+
+    current_order, products = None, []
+    for order_id, product_id in items:
+        if order_id != current_order:
+            add(products)
+            current_order, products = order_id, []
+        products.append(product_id)
+    add(products)
+
+    return counts
+
+
+
+# {category_id: [best rated product ids]} --> filler candidates
+def category_top(limit):
+    top = defaultdict(list)
+
+    products = (
+        models.Product.objects.filter(available=True)
+        .order_by('category_id', '-rating_avg', '-rating_count', '-created_at')
+        .values_list('id', 'category_id').iterator(chunk_size=5000)
+    )
+    for product_id, category_id in products:
+        if len(top[category_id]) < limit:
+            top[category_id].append(product_id)
+
+    return top
+
+
+
+
+def rank_related(product_id, category_id, co_purchased, categories, top, k=TOP_K):
+    scores = {}
+
+    for other, count in co_purchased.items():
+        if other in categories:                                                       # unavailable products are not in 'categories'
+            scores[other] = count + (CATEGORY_BONUS if categories[other] == category_id else 0)
+
+    ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
+
+    if len(ranked) < k:
+        chosen = {other for other, _ in ranked} | {product_id}
+        filler = [other for other in top.get(category_id, []) if other not in chosen]
+        ranked += [(other, CATEGORY_BONUS) for other in filler[:k - len(ranked)]]
+
+    return ranked
+
+
+
+# recompute everything (or only 'product_ids'); returns how many rows were written
+def compute_related(product_ids=None, k=TOP_K, batch_size=2000):
+    counts = co_purchase_counts()
+    categories = dict(models.Product.objects.filter(available=True).values_list('id', 'category_id'))
+    top = category_top(k + 1)
+
+    if product_ids is None:
+        targets = list(categories)
+        models.RelatedProduct.objects.exclude(product__available=True).delete()        # products that went unavailable
+    else:
+        targets = list(product_ids)
+
+    written = 0
+
+    for start in range(0, len(targets), batch_size):
+        batch = [product_id for product_id in targets[start:start + batch_size] if product_id in categories]
+
+        rows = [
+            models.RelatedProduct(product_id=product_id, related_id=other, rank=rank, score=score)
+            for product_id in batch
+            for rank, (other, score) in enumerate(rank_related(product_id, categories[product_id], counts.get(product_id, {}), categories, top, k), 1)
+        ]
+
+        with transaction.atomic():
+            models.RelatedProduct.objects.filter(product_id__in=targets[start:start + batch_size]).delete()
+            models.RelatedProduct.objects.bulk_create(rows, batch_size=batch_size)
+        written += len(rows)
+
+    return written
+
+
+
+
+# Detail page: the precomputed list in 1 query; nothing computed yet --> newest products of the same category
+def related_products(product, k=TOP_K):
+    related = list(
+        models.Product.objects.filter(related_to__product=product, available=True)
+        .order_by('related_to__rank')[:k]
+    )
+
+    if related:
+        return related
+
+    return list(
+        models.Product.objects.filter(category_id=product.category_id, available=True)
+        .exclude(id=product.id).order_by('-created_at', '-id')[:k]
+    )
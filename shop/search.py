@@ -0,0 +1,210 @@
+import re
+
+from django.db import connection
+from django.db.models import Q, Value, FloatField
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+
+
+# Full-text search for products
+# SQLite   --> FTS5 virtual table 'shop_product_fts' (rowid = product id)
+# Postgres --> 'shop_product_search' table with a weighted tsvector + GIN index
+# Any other database falls back to the old icontains search
+#
+# The tables are created by migration 0004_product_search_index
+# The index is kept in sync by the Product/Category signals (see signals.py)
+# and can be rebuilt with: python manage.py rebuild_search_index
+
+
+SNIPPET_START = '\x02'                                                          # markers used by snippet()/ts_headline()
+SNIPPET_END = '\x03'                                                            # replaced by <mark> after the text is escaped
+
+
+FTS_TABLE = 'shop_product_fts'
+PG_TABLE = 'shop_product_search'
+
+SQLITE_RANK = f'bm25({FTS_TABLE}, 10.0, 1.0, 5.0)'                              # a match in the name counts more than in the description
+
+
+
+def backend():
+    if connection.vendor in ('sqlite', 'postgresql'):
+        return connection.vendor
+    return None
+
+
+
+# "blue sh" --> ['blue', 'sh'] ; every word is used as a prefix
+def tokenize(query):
+    return re.findall(r'\w+', query.lower())
+
+
+
+def build_query(tokens):
+    if backend() == 'sqlite':
+        return ' '.join(f'"{token}"*' for token in tokens)                        # "blue"* "sh"*  (AND of prefixes)
+    return ' & '.join(f'{token}:*' for token in tokens)                           # blue:* & sh:*
+
+
+
+
+# Keeping the index in sync
+
+# products --> Product objects (category should be loaded with select_related)
+def index_products(products):
+    rows = [(product.id, product.name, product.description, product.category.name) for product in products]
+
+    if not rows or not backend():
+        return
+
+    with connection.cursor() as cursor:
+        if backend() == 'sqlite':
+            cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(row[0],) for row in rows])                    # FTS5 has no upsert
+            cursor.executemany(f"INSERT INTO {FTS_TABLE} (rowid, name, description, category) VALUES (%s, %s, %s, %s)", rows)
+
+        else:
+            cursor.executemany(
+                f"INSERT INTO {PG_TABLE} (product_id, document) VALUES (%s, "
+                "setweight(to_tsvector('simple', %s), 'A') || "
+                "setweight(to_tsvector('simple', %s), 'B') || "
+                "setweight(to_tsvector('simple', %s), 'C')) "
+                "ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document",
+                rows
+            )
+
+
+
+def remove_products(product_ids):
+    if not product_ids or not backend():
+        return
+
+    with connection.cursor() as cursor:
+        if backend() == 'sqlite':
+            cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(pk,) for pk in product_ids])
+        else:
+            cursor.executemany(f"DELETE FROM {PG_TABLE} WHERE product_id = %s", [(pk,) for pk in product_ids])
+
+
+
+# index rows of products that are gone (Postgres: the foreign key already removes them)
+def remove_missing():
+    if backend() != 'sqlite':
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid NOT IN (SELECT id FROM shop_product)")
+
+
+
+def clear_index():
+    if not backend():
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE if backend() == 'sqlite' else PG_TABLE}")
+
+
+
+
+# Searching
+
+# matching product ids, most relevant first (None --> no full-text backend)
+def matching_ids(query, limit=None):
+    tokens = tokenize(query)
+
+    if not backend():
+        return None
+    if not tokens:
+        return []
+
+    with connection.cursor() as cursor:
+        if backend() == 'sqlite':
+            cursor.execute(
+                f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+                f"ORDER BY {SQLITE_RANK}, rowid LIMIT %s",
+                [build_query(tokens), -1 if limit is None else limit]
+            )
+        else:
+            cursor.execute(
+                f"SELECT product_id FROM {PG_TABLE}, to_tsquery('simple', %s) query "
+                "WHERE document @@ query ORDER BY ts_rank(document, query) DESC, product_id LIMIT %s",
+                [build_query(tokens), limit]                                                      # LIMIT NULL --> no limit
+            )
+
+        return [row[0] for row in cursor.fetchall()]
+
+
+
+# filter the products queryset by the search text (every match, no cap)
+# adds a 'search_rank' annotation (lower = better match) used by the 'relevance' sort
+# the match & the rank are subqueries on the index, so no list of ids goes through Python
+def search_products(products, query):
+    tokens = tokenize(query)
+
+    if not backend():                                                           # no full-text backend --> old icontains search
+        return products.filter(
+            Q(name__icontains = query) |
+            Q(description__icontains = query) |
+            Q(category__name__icontains = query)
+        ).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+    if not tokens:
+        return products.none().annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+    product_id = f'{connection.ops.quote_name(products.model._meta.db_table)}.{connection.ops.quote_name("id")}'
+    params = [build_query(tokens)]
+
+    if backend() == 'sqlite':
+        matches = RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", params)
+        rank = RawSQL(
+            f"SELECT {SQLITE_RANK} FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s AND rowid = {product_id}", params,
+            output_field=FloatField()
+        )
+    else:
+        matches = RawSQL(f"SELECT product_id FROM {PG_TABLE} WHERE document @@ to_tsquery('simple', %s)", params)
+        rank = RawSQL(
+            f"SELECT -ts_rank(document, to_tsquery('simple', %s)) FROM {PG_TABLE} WHERE product_id = {product_id}", params,
+            output_field=FloatField()
+        )
+
+    return products.filter(id__in=matches).annotate(search_rank=rank)
+
+
+
+# sets 'search_snippet' (description part with the matched words in <mark>) on every product of the page
+def highlight(products, query):
+    tokens = tokenize(query)
+    ids = [product.id for product in products]
+
+    if not backend() or not tokens or not ids:
+        return products
+
+    placeholders = ', '.join(['%s'] * len(ids))
+
+    with connection.cursor() as cursor:
+        if backend() == 'sqlite':
+            cursor.execute(
+                f"SELECT rowid, snippet({FTS_TABLE}, 1, %s, %s, '…', 16) FROM {FTS_TABLE} "
+                f"WHERE {FTS_TABLE} MATCH %s AND rowid IN ({placeholders})",
+                [SNIPPET_START, SNIPPET_END, build_query(tokens), *ids]
+            )
+        else:
+            cursor.execute(
+                "SELECT id, ts_headline('simple', description, to_tsquery('simple', %s), %s) "
+                f"FROM shop_product WHERE id IN ({placeholders})",
+                [build_query(tokens), f'StartSel={SNIPPET_START}, StopSel={SNIPPET_END}, MaxWords=20, MinWords=8', *ids]
+            )
+
+        snippets = dict(cursor.fetchall())
+
+
+    for product in products:
+        snippet = snippets.get(product.id)
+        if snippet:
+            product.search_snippet = mark_safe(
+                escape(snippet).replace(SNIPPET_START, '<mark>').replace(SNIPPET_END, '</mark>')              # escape the product text first, then add our own tags
+            )
+
+    return products
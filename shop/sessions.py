@@ -0,0 +1,198 @@
+import atexit
+import logging
+import os
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.sessions.backends.base import CreateError
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+from django.contrib.sessions.models import Session
+from django.db import DatabaseError, close_old_connections
+from django.utils import timezone
+
+from . import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+
+# Session engine (settings.SESSION_ENGINE = 'shop.sessions'): cache first, database behind it
+# Reads come from the cache (settings.SESSION_CACHE_ALIAS); the database is only read when the cache lost the session.
+# Writes go to the cache at once and to the database later (write-behind): changed sessions are collected in this
+# process and written together in 1 query, when the oldest waited SESSION_WRITE_BEHIND_SECONDS (a background
+# thread checks every second) or SESSION_WRITE_BEHIND_BATCH sessions are waiting (and when the process exits).
+#
+# Write-behind needs a cache every worker shares (the Redis L2 of cachetier.py, CACHE_URL). Without one the
+# session would only live in this worker's memory, so it is written to the database at once instead.
+#
+# Deleting a session (logout) goes to the database at once.
+# A crash can lose the database copy of the last few seconds of changes; the shared cache copy is still there.
+
+
+WRITE_BEHIND_SECONDS = getattr(settings, 'SESSION_WRITE_BEHIND_SECONDS', 10)
+WRITE_BEHIND_BATCH = getattr(settings, 'SESSION_WRITE_BEHIND_BATCH', 100)
+
+_lock = threading.RLock()
+_pending = {}                                                                       # session key --> (session_data, expire_date)
+_oldest = None                                                                      # when the oldest waiting change was made
+_timer_pid = None                                                                   # process that runs the flush thread (not inherited by a fork)
+
+
+
+# the sessions' cache is shared by every worker (TieredCache with a Redis L2)
+def write_behind(cache):
+    return getattr(cache, 'l2', None) is not None
+
+
+
+def write(batch):
+    Session.objects.bulk_create(
+        [Session(session_key=key, session_data=data, expire_date=expire) for key, (data, expire) in batch],
+        update_conflicts=True, unique_fields=['session_key'], update_fields=['session_data', 'expire_date'],
+    )
+
+
+
+def queue_write(session_key, session_data, expire_date):
+    global _oldest
+
+    start_timer()
+
+    with _lock:
+        _pending[session_key] = (session_data, expire_date)
+        if _oldest is None:
+            _oldest = time.monotonic()
+        due = len(_pending) >= WRITE_BEHIND_BATCH or time.monotonic() - _oldest >= WRITE_BEHIND_SECONDS
+
+    if due:
+        flush_pending()
+
+
+
+# the oldest waiting change is SESSION_WRITE_BEHIND_SECONDS old --> write them all
+def flush_due():
+    with _lock:
+        due = _oldest is not None and time.monotonic() - _oldest >= WRITE_BEHIND_SECONDS
+
+    if due:
+        return flush_pending()
+    return 0
+
+
+
+def flush_loop():
+    while True:
+        time.sleep(min(1, WRITE_BEHIND_SECONDS))
+        try:
+            if flush_due():
+                close_old_connections()                                             # this thread has no request cycle to do it
+        except Exception:
+            logger.exception('Session write-behind flush failed')
+
+
+
+def start_timer():
+    global _timer_pid
+
+    if _timer_pid == os.getpid():
+        return
+
+    with _lock:
+        if _timer_pid != os.getpid():
+            _timer_pid = os.getpid()
+            threading.Thread(target=flush_loop, name='session-write-behind', daemon=True).start()
+
+
+
+def flush_pending():
+    global _oldest
+
+    with _lock:
+        batch = list(_pending.items())
+        if not batch:
+            return 0
+
+        try:
+            write(batch)
+        except DatabaseError:                                                       # keep them for the next try
+            logger.exception('Writing %s sessions to the database failed', len(batch))
+            return 0
+
+        _pending.clear()
+        _oldest = None
+
+    metrics.incr('sessions.flushed', len(batch))
+    return len(batch)
+
+
+atexit.register(flush_pending)
+
+
+
+
+class SessionStore(CachedDBStore):
+
+    def _get_session_from_db(self):
+        with _lock:
+            waiting = _pending.get(self.session_key)
+
+        if waiting is not None:                                                     # not written to the database yet
+            data, expire_date = waiting
+            if expire_date > timezone.now():
+                return Session(session_key=self.session_key, session_data=data, expire_date=expire_date)
+            return None
+
+        return super()._get_session_from_db()
+
+    def exists(self, session_key):
+        with _lock:
+            if session_key in _pending:
+                return True
+        return super().exists(session_key)
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+
+        data = self._get_session(no_load=must_create)
+
+        if must_create:
+            if not self._cache.add(self.cache_key, data, self.get_expiry_age()):     # the key is taken
+                raise CreateError
+        else:
+            self._cache.set(self.cache_key, data, self.get_expiry_age())
+
+        if write_behind(self._cache):
+            queue_write(self.session_key, self.encode(data), self.get_expiry_date())
+        else:                                                                       # only this worker has the cache copy
+            write([(self.session_key, (self.encode(data), self.get_expiry_date()))])
+
+    def delete(self, session_key=None):
+        session_key = session_key or self.session_key
+        if session_key is None:
+            return
+
+        with _lock:                                                                 # a flush must not write it back
+            _pending.pop(session_key, None)
+            super().delete(session_key)
+
+    # async views (ASGI) --> the same write-behind path
+    async def _aget_session_from_db(self):
+        return await sync_to_async(self._get_session_from_db)()
+
+    async def aexists(self, session_key):
+        return await sync_to_async(self.exists)(session_key)
+
+    async def asave(self, must_create=False):
+        return await sync_to_async(self.save)(must_create)
+
+    async def adelete(self, session_key=None):
+        return await sync_to_async(self.delete)(session_key)
+
+    @classmethod
+    def clear_expired(cls):
+        flush_pending()
+        super().clear_expired()
@@ -0,0 +1,96 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import models, search, facets, cards, pagecache
+from .images import needs_derivatives, queue_derivatives
+
+
+
+# Search index sync
+# Product saved   --> (re)index that product
+# Product deleted --> remove it from the index
+# Category saved  --> its name is part of every product row, so reindex all its products
+
+@receiver(post_save, sender=models.Product)
+def index_product(sender, instance, raw=False, **kwargs):
+    if not raw:                                                                     # skip while loading fixtures
+        search.index_products([instance])
+
+
+@receiver(post_delete, sender=models.Product)
+def unindex_product(sender, instance, **kwargs):
+    search.remove_products([instance.id])
+
+
+@receiver(post_save, sender=models.Category)
+def reindex_category(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_products(instance.products.select_related('category'))
+
+
+
+
+# Facet cache (price range, category & rating counts) is stale after any catalog write
+
+@receiver(post_save, sender=models.Product)
+@receiver(post_delete, sender=models.Product)
+@receiver(post_save, sender=models.Category)
+@receiver(post_delete, sender=models.Category)
+def invalidate_facets(sender, raw=False, **kwargs):
+    if not raw:
+        facets.invalidate()
+
+
+
+# Rating saved or deleted (rate_product, the admin, a product/user delete cascading) --> the product's rating summary
+
+@receiver(post_save, sender=models.Rating)
+@receiver(post_delete, sender=models.Rating)
+def update_rating_stats(sender, instance, raw=False, **kwargs):
+    if not raw:
+        models.Product.refresh_rating_stats(instance.product_id)
+
+
+
+# Rating counts per bucket come from rating_avg, which refresh_rating_stats() writes with update() (no Product signal)
+
+@receiver(post_save, sender=models.Rating)
+@receiver(post_delete, sender=models.Rating)
+def invalidate_rating_facets(sender, raw=False, **kwargs):
+    if not raw:
+        facets.invalidate_on_commit()
+
+
+
+# Product card fragments: product & rating changes are part of the card key (cards.py), category changes are not
+
+@receiver(post_save, sender=models.Category)
+@receiver(post_delete, sender=models.Category)
+def invalidate_cards(sender, raw=False, **kwargs):
+    if not raw:
+        cards.invalidate()
+
+
+
+
+# New/changed product image --> make the resized copies in the background worker
+
+@receiver(post_save, sender=models.Product)
+def queue_image_derivatives(sender, instance, raw=False, **kwargs):
+    if not raw and needs_derivatives(instance):
+        queue_derivatives(instance.id)
+
+
+
+
+# Anonymous page cache (home & product list) is stale after any catalog write
+
+@receiver(post_save, sender=models.Product)
+@receiver(post_delete, sender=models.Product)
+@receiver(post_save, sender=models.Category)
+@receiver(post_delete, sender=models.Category)
+@receiver(post_save, sender=models.Rating)
+@receiver(post_delete, sender=models.Rating)
+def invalidate_pages(sender, raw=False, **kwargs):
+    if not raw:
+        pagecache.invalidate_on_commit()
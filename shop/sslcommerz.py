@@ -1,23 +1,21 @@
-import requests
-import json
-from django.conf import settings
 from django.core.mail import EmailMultiAlternatives
 
 from django.template.loader import render_to_string
 
+from .gateway import get_client
 
 
-# method for payment
-def generate_sslcommerz_payment(request,order):
-    post_data = {
-        'store_id': settings.SSLCOMMERZ_STORE_ID,
-        'store_passwd': settings.SSLCOMMERZ_STORE_PASSWORD,
+
+# payment form data for SSLCommerz (store id & password are added by the gateway client)
+def payment_post_data(request, order):
+    return {
         'total_amount': float(order.get_total_cost()),
         'currency': 'BDT',
         'tran_id': str(order.id),
         'success_url': request.build_absolute_uri(f'/payment/success/{order.id}/'),
         'fail_url': request.build_absolute_uri(f'/payment/fail/{order.id}/'),
         'cancel_url': request.build_absolute_uri(f'/payment/cancel/{order.id}/'),
+        'ipn_url': request.build_absolute_uri('/payment/ipn/'),                                   # server-to-server confirmation (views.payment_ipn)
         'cus_name': f"{order.first_name} {order.last_name}",
         'cus_email': order.email,
         'cus_phone': order.phone,
@@ -30,10 +28,19 @@ def generate_sslcommerz_payment(request,order):
         'product_category': 'General',
         'product_profile': 'general',
     }
-    
-    response = requests.post(settings.SSLCOMMERZ_PAYMENT_URL, data=post_data)                       # getting a response in JSON format
 
-    return json.loads(response.text)                                                                # Converting the JSON response text ---> into Python Object
+
+
+# method for payment
+# pooled connection + timeouts + retries (see gateway.py); raises GatewayError if SSLCommerz can't be reached
+def generate_sslcommerz_payment(request,order):
+    return get_client().create_session(payment_post_data(request, order))                           # getting a response in JSON format ---> as Python Object
+
+
+
+# same for async (ASGI) views
+async def agenerate_sslcommerz_payment(request, order):
+    return await get_client().acreate_session(payment_post_data(request, order))                    # the total is stored on the order --> no query
 
 
 
@@ -42,7 +49,8 @@ def generate_sslcommerz_payment(request,order):
 
 
 # confirmation email
-def send_order_confirmation_email(order):
+# builds the email; sent by the background worker (jobs.py) over a shared SMTP connection
+def order_confirmation_message(order):
     subject = f'ShopNest Order Confirmation - Order #{order.id}'
     message = render_to_string('shop/email/order_confirmation.html', {'order': order})                                               # "render_to_string" used to convert HTML into string
                                                                                                          # the emails will be designed in HTML template
@@ -54,7 +62,13 @@ def send_order_confirmation_email(order):
 
 
     send_email.attach_alternative(message, 'text/html')                                                     # passing the HTML message into "attach_alternative" method and saying the message will be HTML or Text
-    send_email.send()
+    return send_email
+
+
+
+# send it right now (blocking)
+def send_order_confirmation_email(order):
+    order_confirmation_message(order).send()
     
 
 
@@ -0,0 +1,15 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from shop.cards import render_cards
+
+
+register = template.Library()
+
+
+
+# {% product_cards products "list" %} --> all cards of the page, mostly from the fragment cache (see shop/cards.py)
+
+@register.simple_tag(takes_context=True)
+def product_cards(context, products, style):
+    return mark_safe(render_cards(products, style, context.get('csrf_token', '')))
@@ -0,0 +1,31 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+from shop.images import srcset
+
+
+register = template.Library()
+
+
+
+# Product image with responsive WebP/AVIF sources
+# {% product_image product "w-full h-48 object-cover" sizes="(min-width: 1024px) 33vw, 100vw" %}
+# Falls back to the original image while the resized copies are not made yet (or for old browsers)
+
+@register.simple_tag
+def product_image(product, css_class='', sizes='100vw', alt=None):
+    alt = product.name if alt is None else alt
+    variants = product.image_variants
+
+    if not variants or variants.get('source') != product.image.name:
+        return format_html('<img src="{}" class="{}" alt="{}" loading="lazy">', product.image.url, css_class, alt)
+
+    sources = format_html_join(
+        '', '<source type="image/{}" srcset="{}" sizes="{}">',
+        ((fmt, srcset(product, fmt), sizes) for fmt in variants['formats'])
+    )
+
+    return format_html(
+        '<picture>{}<img src="{}" class="{}" alt="{}" loading="lazy"></picture>',
+        sources, product.image.url, css_class, alt
+    )
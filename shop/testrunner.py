@@ -0,0 +1,18 @@
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+
+# manage.py test runner (settings.TEST_RUNNER)
+# A view over its query budget (settings.QUERY_BUDGETS) fails its test, whatever QUERY_BUDGET_RAISE is set to
+
+class TestRunner(DiscoverRunner):
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.query_budgets = override_settings(QUERY_BUDGET_RAISE=True)
+        self.query_budgets.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.query_budgets.disable()
+        super().teardown_test_environment(**kwargs)
@@ -1,3 +1,2241 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse, resolve, clear_url_caches
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.management import call_command, CommandError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.http import Http404, HttpResponse
+from django.utils.safestring import mark_safe
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.template import Context, Template
+
+from django.core.cache import cache, caches
+from django.core import mail
+from django.db import connection, transaction, OperationalError
+from django.db.models import Count, Sum, F
+from django.utils import timezone
+
+from io import StringIO, BytesIO
+from datetime import timedelta
+from unittest import mock
+import base64
+import json
+import gzip
+import importlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import requests
+
+from PIL import Image
+
+from . import models, search, inventory, jobs, images, assets, cards, metrics, pagecache, queryplan, instrumentation, benchmark, recommendations, db_router, cachetier, fake_redis, sessions, payments, lifecycle
+from .facets import get_facets
+from .cart import get_cart_summary
+from .gateway import SSLCommerzClient, CircuitBreaker, CircuitOpen, GatewayError, reset_client
+from .fake_gateway import make_server, base_url, PAYMENT_PATH, VALIDATION_PATH
+from . import urls as shop_urls
+from ShopNest import urls as project_urls
+from asgiref.sync import iscoroutinefunction, sync_to_async
 
 # Create your tests here.
+
+
+
+# helpers
+def make_category(name='Shirts'):
+    return models.Category.objects.create(name=name, slug=name.lower(), description=name)
+
+
+def make_product(category, name='Blue Shirt', price=100, stock=10, **kwargs):
+    return models.Product.objects.create(
+        name=name, slug=name.lower().replace(' ', '-'), category=category, description=name,
+        price=price, stock=stock, image='products/test.jpg', **kwargs
+    )
+
+
+def make_paid_order(user, product, quantity=1):
+    order = models.Order.objects.create(
+        user=user, first_name='A', last_name='B', email='a@b.com', address='x', postal_code='1',
+        phone='0', city='Dhaka', note='', paid=True, status='processing'
+    )
+    models.OrderItem.objects.create(order=order, product=product, price=product.price, quantity=quantity)
+    return order
+
+
+# SSLCommerz validation API answer for an order
+def validation_answer(order, **kwargs):
+    return {'status': 'VALID', 'tran_id': str(order.id), 'amount': str(order.total_amount), **kwargs}
+
+
+# payments.py talks to this mock instead of the gateway; validate=.. configures client.validate
+def patch_gateway(**validate):
+    client = mock.Mock(pool_size=4)
+    client.validate.configure_mock(**validate)
+    return mock.patch('shop.payments.get_client', return_value=client)
+
+
+CHECKOUT_DATA = {
+    'first_name': 'A', 'last_name': 'B', 'email': 'a@b.com', 'address': 'Road 1',
+    'phone': '01700000000', 'postal_code': '1200', 'city': 'Dhaka', 'note': 'none'
+}
+
+
+
+
+
+
+# Rating summary stored on the Product
+class RatingStatsTests(TestCase):
+
+    def setUp(self):
+        self.category = make_category()
+        self.product = make_product(self.category)
+        self.user = User.objects.create_user('buyer', password='pass12345')
+        make_paid_order(self.user, self.product)
+        self.client.login(username='buyer', password='pass12345')
+
+
+    def test_rate_product_updates_stats(self):
+        self.client.post(reverse('rate_product', args=[self.product.id]), {'rating': 4, 'comment': 'good'})
+        self.product.refresh_from_db()
+
+        self.assertEqual(self.product.rating_count, 1)
+        self.assertEqual(self.product.rating_sum, 4)
+        self.assertEqual(float(self.product.rating_avg), 4.0)
+
+
+    def test_editing_rating_does_not_double_count(self):
+        self.client.post(reverse('rate_product', args=[self.product.id]), {'rating': 4, 'comment': 'good'})
+        self.client.post(reverse('rate_product', args=[self.product.id]), {'rating': 2, 'comment': 'meh'})
+        self.product.refresh_from_db()
+
+        self.assertEqual(self.product.rating_count, 1)
+        self.assertEqual(self.product.rating_sum, 2)
+
+
+    def test_deletes_outside_the_views_update_stats(self):
+        other = User.objects.create_user('other')
+        models.Rating.objects.create(product=self.product, user=self.user, rating=5, comment='')
+        rating = models.Rating.objects.create(product=self.product, user=other, rating=2, comment='')
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.rating_count, float(self.product.rating_avg)), (2, 3.5))
+
+        rating.delete()                                                                 # as in the admin
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.rating_count, self.product.rating_sum), (1, 5))
+
+        self.user.delete()                                                              # cascades to the user's ratings
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.rating_count, self.product.rating_sum, float(self.product.rating_avg)), (0, 0, 0.0))
+
+
+    def test_rebuild_command(self):
+        other = User.objects.create_user('other')
+        models.Rating.objects.create(product=self.product, user=self.user, rating=5, comment='')
+        models.Rating.objects.create(product=self.product, user=other, rating=2, comment='')
+
+        call_command('rebuild_rating_stats', stdout=StringIO())
+        self.product.refresh_from_db()
+
+        self.assertEqual(self.product.rating_count, 2)
+        self.assertEqual(float(self.product.rating_avg), 3.5)
+
+
+    def test_rating_filter_uses_stored_average(self):
+        low = make_product(self.category, name='Red Shirt')
+        models.Product.objects.filter(id=self.product.id).update(rating_avg=4.5)
+
+        response = self.client.get(reverse('product_list'), {'rating': 4})
+
+        self.assertContains(response, self.product.name)
+        self.assertNotContains(response, low.name)
+
+
+
+
+
+
+# Cursor pagination of the product list
+class ProductPaginationTests(TestCase):
+
+    def setUp(self):
+        self.category = make_category()
+        for i in range(30):
+            make_product(self.category, name=f'Shirt {i}', price=100 + (i % 5))                # repeated prices --> ties broken by id
+
+
+    def collect(self, sort):
+        seen, cursor = [], None
+        while True:
+            params = {'sort': sort}
+            if cursor:
+                params['cursor'] = cursor
+            data = self.client.get(reverse('product_list_json'), params).json()
+            seen += [row['id'] for row in data['results']]
+            cursor = data['next_cursor']
+            if not cursor:
+                return seen
+
+
+    def test_pages_cover_every_product_once(self):
+        for sort in ['newest', 'price_low', 'price_high', 'rating']:
+            ids = self.collect(sort)
+            self.assertEqual(len(ids), 30)
+            self.assertEqual(len(set(ids)), 30)
+
+
+    def test_price_sort_is_ordered(self):
+        ids = self.collect('price_low')
+        prices = [models.Product.objects.get(id=i).price for i in ids]
+        self.assertEqual(prices, sorted(prices))
+
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('product_list_json'), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get(reverse('product_list'), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 200)
+
+
+    def test_cursor_with_bad_value(self):
+        def cursor(*data):
+            return base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+
+        for sort, value in [('newest', 'yesterday'), ('price_low', 'abc'), ('price_low', 'NaN'), ('rating', 5), ('newest', None)]:
+            params = {'sort': sort, 'cursor': cursor(sort, value, 1)}
+            self.assertEqual(self.client.get(reverse('product_list_json'), params).status_code, 400)
+            self.assertEqual(self.client.get(reverse('product_list'), params).status_code, 200)
+
+
+    def test_html_page_has_next_link(self):
+        response = self.client.get(reverse('product_list'))
+        self.assertEqual(len(response.context['products']), 12)
+        self.assertIn('cursor=', response.context['next_url'])
+
+
+
+
+
+
+# Full-text search
+class SearchTests(TestCase):
+
+    def setUp(self):
+        self.shirts = make_category('Shirts')
+        self.shoes = make_category('Shoes')
+        self.blue = make_product(self.shirts, name='Blue Shirt')
+        self.runner = make_product(self.shoes, name='Trail Runner')
+
+
+    def search(self, text, **params):
+        return self.client.get(reverse('product_list'), {'search': text, **params})
+
+
+    def test_prefix_match(self):
+        response = self.search('blu')
+        self.assertEqual([p.id for p in response.context['products']], [self.blue.id])
+
+
+    def test_category_name_is_searchable(self):
+        response = self.search('shoes')
+        self.assertEqual([p.id for p in response.context['products']], [self.runner.id])
+
+
+    def test_index_follows_saves_and_deletes(self):
+        self.blue.name = self.blue.description = 'Green Shirt'
+        self.blue.save()
+        self.assertFalse(self.search('blue').context['products'])
+        self.assertTrue(self.search('green').context['products'])
+
+        self.blue.delete()
+        self.assertFalse(self.search('green').context['products'])
+
+
+    def test_category_rename_reindexes_products(self):
+        self.shoes.name = 'Sneakers'
+        self.shoes.save()
+        self.assertEqual([p.id for p in self.search('sneak').context['products']], [self.runner.id])
+
+
+    def test_snippet_is_escaped_and_highlighted(self):
+        self.runner.description = 'Light running shoe with <b>grip</b>'
+        self.runner.save()
+        snippet = self.search('grip').context['products'][0].search_snippet
+
+        self.assertIn('<mark>grip</mark>', snippet)
+        self.assertIn('&lt;b&gt;', snippet)
+
+
+    def test_rebuild_command(self):
+        search.clear_index()
+        self.assertFalse(self.search('blue').context['products'])
+
+        call_command('rebuild_search_index', batch_size=1, stdout=StringIO())
+        self.assertTrue(self.search('blue').context['products'])
+
+
+    def test_rebuild_drops_rows_of_deleted_products(self):
+        models.Product.objects.filter(id=self.blue.id).delete()                 # queryset delete --> no signal, the index row stays
+        call_command('rebuild_search_index', batch_size=1, stdout=StringIO())
+        self.assertEqual(search.matching_ids('blue'), [])
+
+
+    def test_every_match_is_returned(self):
+        models.Product.objects.bulk_create([
+            models.Product(name=f'Blue Sock {i}', slug=f'blue-sock-{i}', category=self.shirts, description='sock', price=10, stock=1)
+            for i in range(600)
+        ])
+        search.index_products(models.Product.objects.select_related('category'))
+
+        products = search.search_products(models.Product.objects.all(), 'blue')
+        self.assertEqual(products.count(), 601)
+        self.assertEqual(products.order_by('search_rank', 'id')[0].id, self.blue.id)        # matches in the name & the description rank first
+
+
+
+
+
+
+# Sidebar facets of the product list
+class FacetTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.shirts = make_category('Shirts')
+        self.shoes = make_category('Shoes')
+        make_product(self.shirts, name='Blue Shirt', price=300)
+        make_product(self.shirts, name='Red Shirt', price=700, rating_avg=4.5)
+        make_product(self.shoes, name='Runner', price=3000)
+
+
+    def test_counts_and_price_bounds(self):
+        facets = get_facets('shirts')
+
+        self.assertEqual(facets['min_price'], 300)
+        self.assertEqual(facets['max_price'], 700)
+        self.assertEqual({c['slug']: c['count'] for c in facets['categories']}, {'shirts': 2, 'shoes': 1})
+        self.assertEqual(facets['rating_counts'][4], 1)
+        self.assertEqual([bar['count'] for bar in facets['price_histogram']][:4], [1, 1, 0, 0])
+
+
+    def test_rating_filter_narrows_category_counts(self):
+        facets = get_facets(rating='4')
+        self.assertEqual({c['slug']: c['count'] for c in facets['categories']}, {'shirts': 1, 'shoes': 0})
+
+
+    def test_fractional_rating_matches_the_product_list(self):
+        make_product(self.shoes, name='Trail Shoe', price=1500, rating_avg=4.2)
+
+        facets = get_facets(rating='4.3')
+        response = self.client.get(reverse('product_list'), {'rating': '4.3'})
+        self.assertEqual(facets['total'], len(response.context['products']))
+        self.assertEqual(facets['total'], 1)                                            # Red Shirt 4.5 only, not Trail Shoe 4.2
+        self.assertEqual({c['slug']: c['count'] for c in facets['categories']}, {'shirts': 1, 'shoes': 0})
+
+        with self.assertNumQueries(0):
+            get_facets(rating='4.30')                                                   # same filter --> same cache entry
+        self.assertEqual(get_facets(rating='abc')['total'], 4)                           # ignored, as on the page
+
+
+    def test_one_query_then_cached(self):
+        with self.assertNumQueries(2):                                                  # grouped facet query + category names
+            get_facets()
+        with self.assertNumQueries(0):
+            get_facets()
+
+
+    def test_product_write_invalidates(self):
+        get_facets()
+        make_product(self.shoes, name='Sandal', price=90)
+        self.assertEqual(get_facets()['min_price'], 90)
+
+
+    def test_rating_write_invalidates(self):
+        self.assertEqual(get_facets()['rating_counts'][4], 1)
+        product = models.Product.objects.get(name='Runner')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():                                                  # as in rate_product
+                models.Rating.objects.create(product=product, user=User.objects.create_user('buyer'), rating=5, comment='')
+                get_facets()                                                            # a request running meanwhile
+
+        self.assertEqual(get_facets()['rating_counts'][4], 2)
+
+
+    def test_rating_counts_render(self):
+        response = self.client.get(reverse('product_list'))
+        self.assertContains(response, '(4+ stars) · 1')
+
+
+
+
+
+
+# Stock reservation at checkout
+class StockReservationTests(TestCase):
+
+    def setUp(self):
+        self.product = make_product(make_category(), stock=3)
+        self.user = User.objects.create_user('buyer', password='pass12345')
+        self.client.login(username='buyer', password='pass12345')
+
+
+    def checkout(self, quantity):
+        cart, _ = models.Cart.objects.get_or_create(user=self.user)
+        models.CartItem.objects.create(cart=cart, product=self.product, quantity=quantity)
+        return self.client.post(reverse('checkout'), CHECKOUT_DATA)
+
+
+    def test_checkout_holds_stock(self):
+        self.checkout(2)
+        self.product.refresh_from_db()
+
+        self.assertEqual(self.product.stock, 1)
+        self.assertEqual(models.StockReservation.objects.get().status, 'held')
+
+
+    def test_checkout_query_count_does_not_grow_with_cart(self):
+        def checkout_queries(lines):
+            models.Order.objects.all().delete()
+            cart, _ = models.Cart.objects.get_or_create(user=self.user)
+            for i in range(lines):
+                product = make_product(self.product.category, name=f'Item {lines}-{i}')
+                models.CartItem.objects.create(cart=cart, product=product, quantity=1)
+
+            with CaptureQueriesContext(connection) as queries:
+                self.client.post(reverse('checkout'), CHECKOUT_DATA)
+            self.assertEqual(models.OrderItem.objects.count(), lines)
+            return len(queries)
+
+        self.assertEqual(checkout_queries(1), checkout_queries(30))
+
+        models.CartItem.objects.create(cart=self.user.cart, product=self.product, quantity=1)
+        with self.assertNumQueries(13):                                                     # user (the session comes from the cache), cart + items, 1 INSERT for the lines, 1 UPDATE for the stock, 1 DELETE, savepoints, session write (no shared cache)
+            self.client.post(reverse('checkout'), CHECKOUT_DATA)
+
+
+    def test_checkout_refuses_oversell(self):
+        response = self.checkout(4)
+        self.product.refresh_from_db()
+
+        self.assertRedirects(response, reverse('cart_detail'))
+        self.assertEqual(self.product.stock, 3)
+        self.assertFalse(models.Order.objects.exists())                                   # whole checkout rolled back
+        self.assertEqual(models.CartItem.objects.count(), 1)
+
+
+    def test_payment_success_does_not_decrement_twice(self):
+        self.checkout(2)
+        order = models.Order.objects.get()
+
+        with patch_gateway(return_value=validation_answer(order)):
+            for _ in range(2):
+                self.client.post(reverse('payment_success', args=[order.id]), {'tran_id': str(order.id), 'val_id': 'V1'})
+        self.product.refresh_from_db()
+
+        self.assertEqual(self.product.stock, 1)
+        self.assertEqual(models.StockReservation.objects.get().status, 'committed')
+
+
+    def test_cancel_releases_stock(self):
+        self.checkout(2)
+        order = models.Order.objects.get()
+        self.client.get(reverse('payment_cancel', args=[order.id]))
+        self.client.get(reverse('payment_cancel', args=[order.id]))                      # second callback changes nothing
+        self.product.refresh_from_db()
+
+        self.assertEqual(self.product.stock, 3)
+
+
+    def test_late_fail_callback_leaves_paid_order_alone(self):
+        self.checkout(2)
+        order = models.Order.objects.get()
+        with patch_gateway(return_value=validation_answer(order)):
+            self.client.post(reverse('payment_success', args=[order.id]), {'tran_id': str(order.id), 'val_id': 'V1'})
+
+        self.client.post(reverse('payment_fail', args=[order.id]))
+        self.client.get(reverse('payment_cancel', args=[order.id]))
+        order.refresh_from_db()
+        self.product.refresh_from_db()
+
+        self.assertEqual((order.paid, order.status), (True, 'processing'))
+        self.assertEqual(self.product.stock, 1)
+        self.assertEqual(models.StockReservation.objects.get().status, 'committed')
+
+
+    def test_expired_holds_are_released(self):
+        self.checkout(2)
+        inventory.release_expired(now=timezone.now() + timedelta(days=1))
+        self.product.refresh_from_db()
+
+        self.assertEqual(self.product.stock, 3)
+        self.assertEqual(models.StockReservation.objects.get().status, 'released')
+
+
+
+
+
+
+# Many buyers for the last units of 1 product at the same time
+class StockReservationConcurrencyTests(TransactionTestCase):
+
+    def test_parallel_reservations_never_oversell(self):
+        product = make_product(make_category(), stock=5)
+        user = User.objects.create_user('buyer')
+        orders = [make_paid_order(user, product) for _ in range(20)]
+        results = []
+
+
+        def buy(order):
+            try:
+                for attempt in range(20):
+                    try:
+                        inventory.reserve_stock(order, [(product.id, 1)])
+                        results.append(True)
+                        return
+                    except OperationalError:                                            # SQLite "database is locked" --> try again
+                        time.sleep(0.01)
+            except inventory.OutOfStock:
+                results.append(False)
+            finally:
+                connection.close()
+
+
+        threads = [threading.Thread(target=buy, args=(order,)) for order in orders]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        product.refresh_from_db()
+
+        self.assertEqual(results.count(True), 5)
+        self.assertEqual(product.stock, 0)
+        self.assertEqual(models.StockReservation.objects.count(), 5)
+
+
+
+
+
+
+# SSLCommerz client against the local fake gateway
+class GatewayClientTests(TestCase):
+
+    def setUp(self):
+        self.server = make_server()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+
+    def client_for(self, **kwargs):
+        return SSLCommerzClient(
+            base_url(self.server) + PAYMENT_PATH, base_url(self.server) + VALIDATION_PATH, 'store', 'pass',
+            backoff=0.001, **kwargs
+        )
+
+
+    def test_create_session_and_validate(self):
+        client = self.client_for()
+        data = client.create_session({'tran_id': '7', 'total_amount': 150, 'success_url': 'http://shop/s/'})
+        self.assertEqual(data['status'], 'SUCCESS')
+
+        page = client.session.get(data['GatewayPageURL']).text
+        val_id = page.split('name="val_id" value="')[1].split('"')[0]
+        self.assertEqual(client.validate(val_id)['tran_id'], '7')
+
+
+    def test_retries_server_errors(self):
+        self.server.fail_rate = 1.0
+        client = self.client_for(max_retries=2)
+
+        with self.assertRaises(GatewayError):
+            client.create_session({'tran_id': '1'})
+
+
+    def test_read_timeout(self):
+        self.server.latency = 0.5
+        client = self.client_for(read_timeout=0.05, max_retries=0)
+
+        with mock.patch('shop.fake_gateway.random.uniform', return_value=0.5):              # no jitter below the timeout
+            with self.assertRaises(GatewayError):
+                client.create_session({'tran_id': '1'})
+
+
+    def test_circuit_breaker_fails_fast(self):
+        self.server.fail_rate = 1.0
+        client = self.client_for(max_retries=0, breaker=CircuitBreaker(threshold=2, reset_after=60))
+
+        for _ in range(2):
+            with self.assertRaises(GatewayError):
+                client.create_session({'tran_id': '1'})
+
+        self.server.fail_rate = 0.0
+        with self.assertRaises(CircuitOpen):
+            client.create_session({'tran_id': '1'})
+
+
+    def test_half_open_recovers(self):
+        breaker = CircuitBreaker(threshold=1, reset_after=0)
+        breaker.record_failure()
+        client = self.client_for(breaker=breaker)
+
+        self.assertEqual(client.create_session({'tran_id': '1'})['status'], 'SUCCESS')
+        self.assertEqual(breaker.state, 'closed')
+
+
+    def test_half_open_lets_one_trial_through(self):
+        breaker = CircuitBreaker(threshold=1, reset_after=0)
+        breaker.record_failure()
+
+        breaker.before_call()                                                               # the trial
+        with self.assertRaises(CircuitOpen):
+            breaker.before_call()
+
+        breaker.record_failure()                                                            # trial failed --> open again
+        breaker.before_call()
+
+
+    def test_post_is_not_resent_after_read_timeout(self):
+        client = self.client_for(max_retries=2)
+
+        with mock.patch.object(client.session, 'request', side_effect=requests.ReadTimeout) as send:
+            with self.assertRaises(GatewayError):
+                client.create_session({'tran_id': '1'})
+            self.assertEqual(send.call_count, 1)
+
+            with self.assertRaises(GatewayError):
+                client.validate('V1')                                                       # GET --> retried
+            self.assertEqual(send.call_count, 4)
+
+
+    def test_post_is_resent_when_connect_failed(self):
+        client = SSLCommerzClient('http://127.0.0.1:1/pay', 'http://127.0.0.1:1/val', 'store', 'pass', backoff=0.001, max_retries=2)
+
+        with mock.patch.object(client.session, 'request', wraps=client.session.request) as send:
+            with self.assertRaises(GatewayError):
+                client.create_session({'tran_id': '1'})
+        self.assertEqual(send.call_count, 3)
+
+
+    def test_client_errors_do_not_open_the_breaker(self):
+        breaker = CircuitBreaker(threshold=1, reset_after=60)
+        client = self.client_for(breaker=breaker)
+
+        with self.assertRaises(GatewayError):
+            client.request('GET', base_url(self.server) + '/missing/')                      # 404
+        self.assertEqual(breaker.state, 'closed')
+
+
+    def test_total_time_is_capped(self):
+        client = self.client_for(max_retries=50, total_timeout=0.2)
+        client.backoff = 0.05
+
+        started = time.monotonic()
+        with mock.patch.object(client.session, 'request', side_effect=requests.ConnectTimeout) as send:
+            with self.assertRaises(GatewayError):
+                client.validate('V1')
+
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertLess(send.call_count, 51)
+
+
+
+
+
+
+# Background jobs (order confirmation email)
+class JobQueueTests(TestCase):
+
+    def setUp(self):
+        self.product = make_product(make_category())
+        self.user = User.objects.create_user('buyer')
+        self.order = make_paid_order(self.user, self.product)
+        models.Job.objects.all().delete()                                            # image derivative job from make_product
+
+
+    def test_payment_success_queues_email_instead_of_sending(self):
+        self.order.paid = False
+        self.order.save()
+        with patch_gateway(return_value=validation_answer(self.order)):
+            self.client.post(reverse('payment_success', args=[self.order.id]), {'tran_id': str(self.order.id), 'val_id': 'V1'})
+
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(models.Job.objects.get().payload, {'order_id': self.order.id})
+
+
+    def test_worker_sends_batch(self):
+        for _ in range(3):
+            jobs.enqueue('order_confirmation_email', order_id=self.order.id)
+
+        call_command('run_workers', once=True, stdout=StringIO())
+
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(models.Job.objects.filter(status='done').count(), 3)
+
+
+    def test_failure_is_retried_later_then_failed(self):
+        job = jobs.enqueue('order_confirmation_email', order_id=0)                       # no such order
+
+        stats = jobs.run_batch()
+        job.refresh_from_db()
+        self.assertEqual(stats['retry'], 1)
+        self.assertEqual(job.status, 'pending')
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertIn('DoesNotExist', job.last_error)
+
+        self.assertEqual(jobs.run_batch()['retry'], 0)                                   # not due yet
+
+        with self.settings(JOB_MAX_ATTEMPTS=2):
+            models.Job.objects.update(run_after=timezone.now())
+            jobs.run_batch()
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+
+
+    def test_stale_running_job_is_picked_up_again(self):
+        job = jobs.enqueue('order_confirmation_email', order_id=self.order.id)
+        models.Job.objects.update(status='running', claimed_by='dead', claimed_at=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual(jobs.run_batch()['done'], 1)
+
+
+    def test_heartbeat_keeps_waiting_jobs_claimed(self):
+        for _ in range(2):
+            jobs.enqueue('order_confirmation_email', order_id=self.order.id)
+        jobs.claim_batch('busy', 10)
+        models.Job.objects.update(claimed_at=timezone.now() - timedelta(hours=1))                # still on the first job of its batch
+
+        jobs.heartbeat('busy')
+        jobs.reclaim_stale(timezone.now())
+        self.assertEqual(models.Job.objects.filter(status='running', claimed_by='busy').count(), 2)
+
+
+    @override_settings(JOB_STALE_SECONDS=600, JOB_STALE_SECONDS_BY_KIND={'compute_related_products': 3600})
+    def test_long_job_kind_has_its_own_stale_limit(self):
+        job = jobs.enqueue('compute_related_products')
+        models.Job.objects.update(status='running', claimed_by='busy', claimed_at=timezone.now() - timedelta(minutes=20))
+
+        jobs.reclaim_stale(timezone.now())
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'running')
+
+        jobs.reclaim_stale(timezone.now() + timedelta(hours=1))
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'pending')
+
+
+
+
+
+
+# Payment callbacks: validation, idempotency & the IPN
+class PaymentConfirmationTests(TestCase):
+
+    def setUp(self):
+        self.product = make_product(make_category(), stock=3)
+        self.user = User.objects.create_user('buyer', password='pass12345')
+        self.client.login(username='buyer', password='pass12345')
+        models.CartItem.objects.create(cart=models.Cart.objects.create(user=self.user), product=self.product, quantity=2)
+        self.client.post(reverse('checkout'), CHECKOUT_DATA)
+        self.order = models.Order.objects.get()
+        models.Job.objects.all().delete()
+
+
+    def success(self, **data):
+        return self.client.post(reverse('payment_success', args=[self.order.id]), {'tran_id': str(self.order.id), 'val_id': 'V1', **data})
+
+
+    def ipn(self, **data):
+        return Client().post(reverse('payment_ipn'), {'tran_id': str(self.order.id), 'val_id': 'V1', 'status': 'VALID', **data})
+
+
+    def assertSoldOnce(self):
+        self.order.refresh_from_db()
+        self.product.refresh_from_db()
+        self.assertTrue(self.order.paid)
+        self.assertEqual(self.product.stock, 1)
+        self.assertEqual(models.Job.objects.filter(kind='order_confirmation_email').count(), 1)
+
+
+    def test_forged_callback_is_refused(self):
+        with patch_gateway(return_value={'status': 'INVALID_TRANSACTION'}), self.assertLogs('shop.payments', 'WARNING'):
+            response = self.success()
+        self.order.refresh_from_db()
+
+        self.assertRedirects(response, reverse('checkout'), fetch_redirect_response=False)
+        self.assertFalse(self.order.paid)
+        self.assertEqual(models.Payment.objects.get().status, 'invalid')
+        self.assertFalse(models.Job.objects.exists())
+
+
+    def test_forged_callback_does_not_lock_out_the_real_one(self):
+        with patch_gateway(return_value={'status': 'INVALID_TRANSACTION'}), self.assertLogs('shop.payments', 'WARNING'):
+            Client().post(reverse('payment_success', args=[self.order.id]), {'tran_id': str(self.order.id), 'val_id': 'FAKE'})
+        self.assertEqual(models.Payment.objects.get().status, 'invalid')
+
+        with patch_gateway(side_effect={'V1': validation_answer(self.order)}.get):
+            self.ipn()
+            jobs.run_batch()
+
+        self.assertSoldOnce()
+        self.assertEqual(models.Payment.objects.get().val_id, 'V1')
+
+
+    def test_wrong_amount_or_transaction_is_refused(self):
+        with patch_gateway(return_value=validation_answer(self.order, amount='1.00')), self.assertLogs('shop.payments', 'WARNING') as logs:
+            self.success()
+        self.assertIn('order total is', logs.output[0])
+        with patch_gateway(return_value=validation_answer(self.order)) as get_client:
+            self.success(tran_id='999')                                                     # not this order's transaction
+        self.order.refresh_from_db()
+
+        self.assertFalse(self.order.paid)
+        get_client.return_value.validate.assert_not_called()
+
+
+    def test_get_is_refused(self):
+        self.client.get(reverse('payment_success', args=[self.order.id]))
+        self.order.refresh_from_db()
+        self.assertFalse(self.order.paid)
+
+
+    def test_browser_and_ipn_sell_once(self):
+        with patch_gateway(return_value=validation_answer(self.order)):
+            self.success()
+            self.ipn()
+            self.success()
+            jobs.run_batch()
+
+        self.assertSoldOnce()
+        self.assertEqual(models.Payment.objects.get().status, 'paid')
+
+
+    def test_repeated_ipn_costs_one_lookup(self):
+        with patch_gateway(return_value=validation_answer(self.order)):
+            self.success()
+
+        with self.assertNumQueries(1):
+            response = self.ipn()
+        self.assertEqual(response.content, b'OK')
+        self.assertSoldOnce()
+
+
+    def test_confirm_flips_paid_once(self):
+        payment = payments.record(self.order, str(self.order.id), 'V1', 'ipn')
+        payment.order = self.order
+
+        self.assertTrue(payments.confirm(payment, self.order.total_amount))
+        self.assertFalse(payments.confirm(payment, self.order.total_amount))
+        self.assertSoldOnce()
+
+
+    def test_ipns_are_validated_in_one_batch(self):
+        other = make_paid_order(self.user, self.product)
+        models.Order.objects.filter(id=other.id).update(paid=False)
+        other.refresh_from_db()
+
+        self.ipn()
+        Client().post(reverse('payment_ipn'), {'tran_id': str(other.id), 'val_id': 'V2', 'status': 'VALID'})
+        self.ipn()                                                                          # retried IPN, not validated yet
+        self.assertEqual(models.Job.objects.filter(kind='validate_payments').count(), 1)
+        self.assertEqual(models.Payment.objects.count(), 2)
+
+        answers = {'V1': validation_answer(self.order), 'V2': validation_answer(other)}
+        with patch_gateway(side_effect=answers.get) as get_client:
+            self.assertEqual(jobs.run_batch()['done'], 1)
+
+        self.assertEqual(get_client.return_value.validate.call_count, 2)
+        self.assertEqual(models.Order.objects.filter(paid=True).count(), 2)
+        self.assertEqual(models.Job.objects.filter(kind='order_confirmation_email').count(), 2)
+
+
+    def test_gateway_down_leaves_it_to_the_worker(self):
+        with patch_gateway(side_effect=GatewayError('down')):
+            response = self.success()
+            self.assertEqual(jobs.run_batch()['retry'], 1)
+
+        self.assertRedirects(response, reverse('profile'), fetch_redirect_response=False)
+        payment = models.Payment.objects.get()
+        self.assertEqual((payment.status, payment.attempts), ('received', 2))
+
+        models.Job.objects.update(run_after=timezone.now())
+        with patch_gateway(return_value=validation_answer(self.order)):
+            jobs.run_batch()
+        self.assertSoldOnce()
+
+
+    def test_ipn_for_unknown_order(self):
+        self.assertEqual(self.ipn(tran_id='999999').status_code, 400)
+        self.assertEqual(self.ipn(status='FAILED').content, b'IGNORED')
+        self.assertFalse(models.Payment.objects.exists())
+
+
+    def test_validates_against_fake_gateway(self):
+        server = make_server()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        server.validations['V1'] = {'tran_id': str(self.order.id), 'amount': str(float(self.order.total_amount))}
+
+        with self.settings(SSLCOMMERZ_VALIDATION_URL=base_url(server) + VALIDATION_PATH):
+            reset_client()
+            self.addCleanup(reset_client)
+            self.ipn()
+            jobs.run_batch()
+
+        self.assertSoldOnce()
+
+
+
+
+
+
+# Abandoned orders: expire, release stock, archive
+class OrderLifecycleTests(TestCase):
+
+    def setUp(self):
+        self.product = make_product(make_category(), stock=10)
+        self.user = User.objects.create_user('buyer', password='pass12345')
+        self.client.login(username='buyer', password='pass12345')
+        self.cart = models.Cart.objects.create(user=self.user)
+
+
+    def checkout(self, quantity=1, age=timedelta(hours=2)):
+        models.CartItem.objects.create(cart=self.cart, product=self.product, quantity=quantity)
+        self.client.post(reverse('checkout'), CHECKOUT_DATA)
+        order = models.Order.objects.latest('id')
+        models.Order.objects.filter(id=order.id).update(updated_at=timezone.now() - age)
+        return order
+
+
+    def stock(self):
+        self.product.refresh_from_db()
+        return self.product.stock
+
+
+    def test_checkout_order_is_pending(self):
+        self.assertEqual(self.checkout().status, 'pending')
+
+
+    def test_stale_pending_order_is_canceled_and_stock_released(self):
+        stale = self.checkout(3)
+        fresh = self.checkout(2, age=timedelta(minutes=5))
+        paid = self.checkout(1)
+        models.Order.objects.filter(id=paid.id).update(paid=True, status='processing')
+        self.assertEqual(self.stock(), 4)
+
+        stats = lifecycle.run()
+
+        self.assertEqual((stats['expired'], stats['released']), (1, 1))
+        self.assertEqual(self.stock(), 7)
+        self.assertEqual(models.Order.objects.get(id=stale.id).status, 'canceled')
+        self.assertEqual(models.Order.objects.get(id=fresh.id).status, 'pending')
+        self.assertEqual(models.Order.objects.get(id=paid.id).status, 'processing')
+        self.assertEqual(lifecycle.run()['expired'], 0)                                       # nothing left to do
+
+
+    def test_old_canceled_orders_are_archived(self):
+        old = self.checkout(2)
+        recent = self.checkout(1)
+        self.client.get(reverse('payment_cancel', args=[old.id]))
+        self.client.get(reverse('payment_cancel', args=[recent.id]))
+        models.Order.objects.filter(id=old.id).update(updated_at=timezone.now() - timedelta(days=40))
+
+        stats = lifecycle.run()
+
+        self.assertEqual(stats['archived'], 1)
+        self.assertFalse(models.Order.objects.filter(id=old.id).exists())
+        self.assertFalse(models.OrderItem.objects.filter(order_id=old.id).exists())
+        self.assertTrue(models.Order.objects.filter(id=recent.id).exists())
+
+        archived = models.ArchivedOrder.objects.get()
+        self.assertEqual((archived.order_id, archived.user, archived.total_amount), (old.id, self.user, old.total_amount))
+        self.assertEqual(archived.items, [[self.product.id, 2, '100.00']])
+        self.assertEqual(self.stock(), 10)
+
+
+    def test_works_in_batches(self):
+        orders = [self.checkout() for _ in range(5)]
+
+        self.assertEqual(lifecycle.run(size=2)['expired'], 5)
+        self.assertEqual(self.stock(), 10)
+
+        models.Order.objects.update(updated_at=timezone.now() - timedelta(days=40))
+        self.assertEqual(lifecycle.run(size=2)['archived'], 5)
+        self.assertEqual(models.ArchivedOrder.objects.count(), len(orders))
+        self.assertFalse(models.Order.objects.exists())
+
+
+    def pay(self, order):
+        with patch_gateway(return_value=validation_answer(order)), self.assertLogs('shop.payments', 'WARNING') as logs:
+            self.client.post(reverse('payment_success', args=[order.id]), {'tran_id': str(order.id), 'val_id': 'V1'})
+        order.refresh_from_db()
+        return logs.output[0]
+
+
+    def test_payment_after_expiry_is_flagged_for_review(self):
+        order = self.checkout(2)
+        lifecycle.run()
+        self.assertEqual(self.stock(), 10)
+
+        self.assertIn('already canceled', self.pay(order))
+        self.assertEqual((order.paid, order.status), (True, 'review'))
+        self.assertEqual(self.stock(), 10)                                                    # its stock was given back, not taken again
+        self.assertFalse(models.Job.objects.filter(kind='order_confirmation_email').exists())
+        self.assertEqual(lifecycle.run()['archived'], 0)
+
+
+    def test_payment_after_hold_expired_and_stock_sold_is_flagged(self):
+        order = self.checkout(2, age=timedelta(minutes=5))
+        models.StockReservation.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        lifecycle.run()                                                                       # hold released, order still pending
+        models.Product.objects.filter(id=self.product.id).update(stock=1)                    # sold to someone else meanwhile
+
+        self.assertIn('out of stock', self.pay(order))
+        self.assertEqual((order.paid, order.status), (True, 'review'))
+        self.assertEqual(self.stock(), 1)                                                     # not clamped to 0, not oversold
+
+
+    def test_command_reports_counts(self):
+        self.checkout()
+        out = StringIO()
+        call_command('run_order_lifecycle', stdout=out)
+        self.assertIn('Expired 1 orders, released 1 reservations, archived 0 orders', out.getvalue())
+
+
+
+
+
+
+# Navbar cart count
+class CartCountTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.product = make_product(make_category(), stock=10)
+        self.user = User.objects.create_user('buyer', password='pass12345')
+        self.client.login(username='buyer', password='pass12345')
+
+
+    def test_count_follows_cart_changes(self):
+        self.client.post(reverse('cart_add', args=[self.product.id]))
+        self.client.post(reverse('cart_add', args=[self.product.id]))
+        self.assertEqual(self.client.get(reverse('home')).context['cart_items_count'], 2)
+
+        self.client.post(reverse('cart_update', args=[self.product.id]), {'quantity': 5})
+        self.assertEqual(self.client.get(reverse('home')).context['cart_items_count'], 5)
+
+        self.client.post(reverse('cart_remove', args=[self.product.id]))
+        self.assertEqual(self.client.get(reverse('home')).context['cart_items_count'], 0)
+
+
+    def test_cached_count_needs_no_cart_query(self):
+        self.client.post(reverse('cart_add', args=[self.product.id]))
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('home'))
+
+        self.assertFalse([q for q in queries if 'shop_cart' in q['sql']])
+
+
+
+
+
+
+# Cart page & checkout page built from 1 cart summary
+class CartSummaryTests(TestCase):
+
+    def setUp(self):
+        self.category = make_category()
+        self.user = User.objects.create_user('buyer', password='pass12345')
+        self.client.login(username='buyer', password='pass12345')
+        self.cart = models.Cart.objects.create(user=self.user)
+
+
+    def add_items(self, count):
+        for i in range(count):
+            product = make_product(self.category, name=f'Item {self.cart.items.count()}', price=10)
+            models.CartItem.objects.create(cart=self.cart, product=product, quantity=2)
+
+
+    def queries_for(self, url_name):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(url_name))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+
+    def test_totals(self):
+        self.add_items(3)
+        summary = get_cart_summary(self.user)
+
+        self.assertEqual(summary.total_items, 6)
+        self.assertEqual(summary.total_price, 60)
+        self.assertEqual([line.cost for line in summary.lines], [20, 20, 20])
+
+
+    def test_cart_and_checkout_query_count_is_constant(self):
+        self.add_items(1)
+        cart_small, checkout_small = self.queries_for('cart_detail'), self.queries_for('checkout')
+
+        self.add_items(20)
+        self.assertEqual(self.queries_for('cart_detail'), cart_small)
+        self.assertEqual(self.queries_for('checkout'), checkout_small)
+
+
+
+
+
+
+# Stored order totals & the profile page
+class ProfileTests(TestCase):
+
+    def setUp(self):
+        self.product = make_product(make_category(), price=100, stock=100)
+        self.user = User.objects.create_user('buyer', password='pass12345')
+        self.client.login(username='buyer', password='pass12345')
+
+
+    def add_orders(self, count):
+        for _ in range(count):
+            order = make_paid_order(self.user, self.product, quantity=2)
+            order.total_amount = order.calculate_total_cost()
+            order.save()
+
+
+    def test_checkout_stores_total(self):
+        cart = models.Cart.objects.create(user=self.user)
+        models.CartItem.objects.create(cart=cart, product=self.product, quantity=3)
+        self.client.post(reverse('checkout'), CHECKOUT_DATA)
+
+        self.assertEqual(models.Order.objects.get().total_amount, 300)
+
+
+    def test_total_uses_price_at_order_time(self):
+        self.add_orders(1)
+        models.Product.objects.update(price=999)
+
+        self.assertEqual(models.Order.objects.get().order_items.get().get_cost(), 200)
+
+
+    def test_stats(self):
+        self.add_orders(3)
+        models.Order.objects.filter(id=models.Order.objects.first().id).update(status='delivered')
+        models.Order.objects.create(user=self.user, total_amount=50, paid=False)
+
+        context = self.client.get(reverse('profile')).context
+        self.assertEqual(context['order_count'], 4)
+        self.assertEqual(context['completed_count'], 1)
+        self.assertEqual(context['total_spent'], 600)
+
+
+    def test_query_count_is_constant_and_history_is_paged(self):
+        self.add_orders(2)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(reverse('profile'), {'tab': 'orders'})
+
+        self.add_orders(30)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(reverse('profile'), {'tab': 'orders'})
+
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(len(response.context['orders']), 10)
+
+
+
+
+
+
+# Responsive image derivatives
+class ImageDerivativeTests(TestCase):
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.category = make_category()
+
+    def upload(self, width=1200, height=800, name='shirt.png'):
+        buffer = BytesIO()
+        Image.new('RGB', (width, height), 'navy').save(buffer, 'PNG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+    def test_upload_queues_job_and_worker_builds_derivatives(self):
+        product = make_product(self.category)
+        product.image = self.upload()
+        product.save()
+
+        self.assertTrue(models.Job.objects.filter(kind='product_image_derivatives', payload={'product_id': product.id}).exists())
+
+        product.stock = 5
+        product.save()                                                              # same image, job still pending --> no 2nd job
+        self.assertEqual(models.Job.objects.filter(kind='product_image_derivatives').count(), 1)
+
+        jobs.run_batch()
+        product.refresh_from_db()
+
+        variants = product.image_variants
+        self.assertEqual(variants['source'], product.image.name)
+        self.assertEqual(variants['widths'], list(images.WIDTHS))
+
+        for fmt in variants['formats']:
+            path = images.derivative_path(variants['hash'], 320, fmt)
+            self.assertTrue(default_storage.exists(path))
+            with default_storage.open(path) as f:
+                self.assertEqual(Image.open(f).width, 320)
+
+    def test_same_picture_is_not_processed_twice(self):
+        first = make_product(self.category, name='First')
+        first.image = self.upload()
+        first.save()
+        images.process_product_image(first.id)
+
+        second = make_product(self.category, name='Second')
+        second.image = self.upload()
+        second.save()
+
+        with mock.patch.object(Image.Image, 'save') as save:
+            images.process_product_image(second.id)
+
+        save.assert_not_called()
+        second.refresh_from_db()
+        self.assertEqual(second.image_variants['hash'], models.Product.objects.get(id=first.id).image_variants['hash'])
+
+    def test_small_image_is_not_upscaled(self):
+        product = make_product(self.category)
+        product.image = self.upload(width=200, height=100)
+        product.save()
+
+        variants = images.process_product_image(product.id)
+        self.assertEqual(variants['widths'], [200])
+
+    def test_template_tag_emits_srcset(self):
+        product = make_product(self.category)
+        template = Template('{% load shop_images %}{% product_image product "card" sizes="50vw" %}')
+
+        html = template.render(Context({'product': product}))
+        self.assertNotIn('<picture>', html)                                          # no derivatives yet --> plain img
+
+        product.image = self.upload()
+        product.save()
+        images.process_product_image(product.id)
+        product.refresh_from_db()
+
+        html = template.render(Context({'product': product}))
+        self.assertIn('<picture>', html)
+        self.assertIn('320w', html)
+        self.assertIn('sizes="50vw"', html)
+        self.assertIn(f'src="{product.image.url}"', html)
+
+    def test_backfill_command(self):
+        product = make_product(self.category)
+        models.Product.objects.filter(id=product.id).update(image=self.upload_to_storage())
+        models.Job.objects.all().delete()
+
+        call_command('generate_image_derivatives', stdout=StringIO())
+        self.assertEqual(models.Job.objects.filter(kind='product_image_derivatives').count(), 1)
+
+        call_command('generate_image_derivatives', '--sync', stdout=StringIO())
+        product.refresh_from_db()
+        self.assertTrue(product.image_variants['widths'])
+
+    def test_force_rewrites_existing_files(self):
+        product = make_product(self.category)
+        models.Product.objects.filter(id=product.id).update(image=self.upload_to_storage())
+        variants = images.process_product_image(product.id)
+
+        path = images.derivative_path(variants['hash'], variants['widths'][0], variants['formats'][0])
+        default_storage.delete(path)
+        default_storage.save(path, ContentFile(b'stale'))
+
+        call_command('generate_image_derivatives', '--sync', stdout=StringIO())
+        with default_storage.open(path) as f:
+            self.assertEqual(f.read(), b'stale')                                       # already made --> left alone
+
+        call_command('generate_image_derivatives', '--sync', '--force', stdout=StringIO())
+        with default_storage.open(path) as f:
+            self.assertNotEqual(f.read(), b'stale')
+        _, files = default_storage.listdir(os.path.dirname(path))
+        self.assertEqual(len(files), len(variants['widths']) * len(variants['formats']))        # rewritten in place, no '_abc123' copies
+
+    def upload_to_storage(self):
+        return default_storage.save('products/backfill.png', self.upload())
+
+
+
+
+
+
+# Static & media serving (ETag, Range, precompressed copies, hashed names)
+class AssetServingTests(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+
+        self.css = 'body { color: navy; }\n' * 200
+        with open(os.path.join(self.root, 'style.0123456789ab.css'), 'w') as f:
+            f.write(self.css)
+        assets.compress_file(os.path.join(self.root, 'style.0123456789ab.css'))
+
+        self.factory = RequestFactory()
+
+    def get(self, path, **headers):
+        return assets.serve(self.factory.get('/static/' + path, headers=headers), path, self.root)
+
+    def test_hashed_name_is_immutable_and_plain_name_revalidates(self):
+        response = self.get('style.0123456789ab.css')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], assets.IMMUTABLE)
+        self.assertEqual(b''.join(response.streaming_content).decode(), self.css)
+
+        with open(os.path.join(self.root, 'robots.txt'), 'w') as f:
+            f.write('User-agent: *')
+        self.assertEqual(self.get('robots.txt')['Cache-Control'], assets.REVALIDATE)
+
+    def test_etag_gives_304(self):
+        etag = self.get('style.0123456789ab.css')['ETag']
+
+        response = self.get('style.0123456789ab.css', If_None_Match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_precompressed_copy_is_sent_when_accepted(self):
+        response = self.get('style.0123456789ab.css', Accept_Encoding='gzip, deflate')
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)).decode(), self.css)
+
+        self.assertFalse(self.get('style.0123456789ab.css', Accept_Encoding='gzip;q=0').has_header('Content-Encoding'))
+
+    def test_range_requests(self):
+        response = self.get('style.0123456789ab.css', Range='bytes=5-9')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 5-9/{len(self.css)}')
+        self.assertEqual(b''.join(response.streaming_content).decode(), self.css[5:10])
+
+        response = self.get('style.0123456789ab.css', Range='bytes=-4')
+        self.assertEqual(b''.join(response.streaming_content).decode(), self.css[-4:])
+
+        self.assertEqual(self.get('style.0123456789ab.css', Range=f'bytes={len(self.css)}-').status_code, 416)
+
+    def test_outside_root_is_404(self):
+        with self.assertRaises(Http404):
+            self.get('../etc/passwd')
+
+    def test_media_uploads_get_content_hashed_names(self):
+        storage = assets.HashedMediaStorage(location=self.root)
+
+        first = storage.save('products/shirt.jpg', ContentFile(b'picture'))
+        second = storage.save('products/shirt.jpg', ContentFile(b'picture'))
+        other = storage.save('products/shirt.jpg', ContentFile(b'another picture'))
+
+        self.assertRegex(first, r'^products/shirt\.[0-9a-f]{12}\.jpg$')
+        self.assertEqual(first, second)                                              # stored once
+        self.assertNotEqual(first, other)
+        self.assertRegex(first, assets.HASHED_NAME)
+
+    def test_collectstatic_writes_hashed_and_compressed_files(self):
+        source = os.path.join(self.root, 'src')
+        target = os.path.join(self.root, 'collected')
+        os.makedirs(source)
+        with open(os.path.join(source, 'site.css'), 'w') as f:
+            f.write(self.css)
+
+        with override_settings(STATICFILES_DIRS=[source], STATIC_ROOT=target):
+            call_command('collectstatic', interactive=False, verbosity=0)
+
+            url = staticfiles_storage.url('site.css')
+            self.assertRegex(url, r'site\.[0-9a-f]{12}\.css$')
+            self.assertTrue(os.path.isfile(os.path.join(target, url.rsplit('/', 1)[1] + '.gz')))
+
+
+
+
+
+
+# Cached product card fragments
+class ProductCardCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        self.category = make_category()
+        self.product = make_product(self.category)
+
+    def render(self):
+        return cards.render_cards(models.Product.objects.filter(id=self.product.id), 'list', csrf_token='TOKEN')
+
+    def test_second_render_is_a_hit(self):
+        first = self.render()
+        second = self.render()
+
+        self.assertEqual(first, second)
+        self.assertEqual(metrics.cache_stats()['product_card'], {'hits': 1, 'misses': 1, 'hit_ratio': 0.5})
+
+    def test_csrf_token_is_not_cached(self):
+        self.render()
+        html = cards.render_cards(models.Product.objects.filter(id=self.product.id), 'list', csrf_token='OTHER')
+
+        self.assertIn('value="OTHER"', html)
+        self.assertNotIn('TOKEN', html)
+        self.assertNotIn(cards.CSRF_PLACEHOLDER, html)
+
+    def test_product_rating_and_category_changes_miss(self):
+        self.render()
+
+        self.product.price = 250
+        self.product.save()
+        self.assertIn('250', self.render())
+
+        user = User.objects.create_user('rater')
+        models.Rating.objects.create(product=self.product, user=user, rating=4, comment='ok')
+        self.product.update_rating_stats()
+        self.assertIn('(1)', self.render())
+
+        self.category.name = 'Tops'
+        self.category.save()
+        self.render()
+
+        self.assertEqual(metrics.cache_stats()['product_card']['misses'], 4)
+
+    def test_search_snippet_cards_are_not_cached(self):
+        product = models.Product.objects.get(id=self.product.id)
+        product.search_snippet = mark_safe('a <mark>blue</mark> shirt')                  # as search.highlight() sets it
+
+        html = cards.render_cards([product], 'list')
+        self.assertIn('<mark>blue</mark>', html)
+        self.assertEqual(metrics.snapshot().get('cache.product_card.misses', 0), 0)
+
+    def test_pages_use_cards_and_metrics_endpoint(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 302)            # staff only
+
+        User.objects.create_user('staff', password='pw', is_staff=True)
+        self.client.login(username='staff', password='pw')                              # logged in --> no page cache, cards render
+        self.client.get(reverse('product_list'))
+        self.client.get(reverse('product_list'))
+
+        stats = self.client.get(reverse('metrics')).json()['caches']['product_card']
+        self.assertGreaterEqual(stats['hits'], 1)
+
+
+
+
+
+
+# Anonymous full-page cache
+class PageCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        self.category = make_category()
+        self.product = make_product(self.category)
+
+    def test_second_anonymous_request_is_a_hit_with_own_csrf_token(self):
+        first = self.client.get(reverse('product_list'))
+        self.assertEqual(first['X-Page-Cache'], 'miss')
+
+        other = Client()
+        with self.assertNumQueries(0):
+            second = other.get(reverse('product_list'))
+
+        self.assertEqual(second['X-Page-Cache'], 'hit')
+        self.assertIn('Blue Shirt', second.content.decode())
+        self.assertNotIn(pagecache.CSRF_PLACEHOLDER, second.content.decode())
+        self.assertIn('csrftoken', second.cookies)
+
+    def test_query_string_is_normalized(self):
+        self.client.get(reverse('product_list'), {'sort': 'price_low', 'min_price': '10', 'max_price': ''})
+        response = self.client.get(reverse('product_list') + '?min_price=10&utm_source=mail&sort=price_low')
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+
+        response = self.client.get(reverse('product_list'), {'sort': 'price_high'})
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+
+    def test_catalog_write_makes_page_stale(self):
+        self.client.get(reverse('home'))
+
+        self.product.name = 'Red Shirt'
+        self.product.save()
+
+        response = self.client.get(reverse('home'))
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertIn('Red Shirt', response.content.decode())
+
+    def test_stale_page_is_served_while_another_request_renders(self):
+        self.client.get(reverse('home'))
+        pagecache.invalidate()
+
+        key = pagecache.page_key(RequestFactory().get(reverse('home')))
+        cache.add(f'lock:{key}', 1)                                                      # someone else is rendering
+
+        response = self.client.get(reverse('home'))
+        self.assertEqual(response['X-Page-Cache'], 'stale')
+        self.assertEqual(metrics.cache_stats()['page']['stale'], 1)
+
+    def test_logged_in_users_are_not_cached(self):
+        User.objects.create_user('buyer', password='pw')
+        self.client.login(username='buyer', password='pw')
+
+        response = self.client.get(reverse('home'))
+        self.assertFalse(response.has_header('X-Page-Cache'))
+
+    def test_cart_count_json(self):
+        self.assertEqual(self.client.get(reverse('cart_count')).json(), {'count': 0})
+
+        user = User.objects.create_user('buyer', password='pw')
+        cart = models.Cart.objects.create(user=user)
+        models.CartItem.objects.create(cart=cart, product=self.product, quantity=3)
+        self.client.login(username='buyer', password='pw')
+
+        response = self.client.get(reverse('cart_count'))
+        self.assertEqual(response.json(), {'count': 3})
+        self.assertIn('no-cache', response['Cache-Control'])
+
+
+
+
+
+
+# Query plans of every shop view on a big catalog
+# Each query the views run is EXPLAINed; a full table scan on a big table fails the test
+class QueryPlanTests(TestCase):
+
+    PRODUCTS = 100_000
+    ALLOWED_SCANS = {'shop_category'}                                               # a handful of rows, always listed in full
+
+    @classmethod
+    def setUpTestData(cls):
+        categories = [make_category(f'Cat{i}') for i in range(20)]
+        now = timezone.now()
+
+        for start in range(0, cls.PRODUCTS, 5000):
+            models.Product.objects.bulk_create([
+                models.Product(
+                    name=f'Product {i}', slug=f'product-{i}', category=categories[i % 20], description=f'Product {i}',
+                    price=(i * 37) % 50000, stock=i % 30, available=i % 10 != 0, image='products/test.jpg',
+                    rating_avg=(i % 50) / 10, rating_count=i % 7, created_at=now - timedelta(minutes=i),
+                )
+                for i in range(start, min(start + 5000, cls.PRODUCTS))
+            ], batch_size=5000)
+
+        cls.product = models.Product.objects.get(slug='product-1')
+        cls.user = User.objects.create_user('buyer', password='pw')
+        make_paid_order(cls.user, cls.product)
+        cart = models.Cart.objects.create(user=cls.user)
+        models.CartItem.objects.create(cart=cart, product=cls.product, quantity=1)
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE shop_product')                                 # real row counts for the big table; the small
+                                                                                    # tables keep the planner's "large table" default
+
+    def setUp(self):
+        cache.clear()
+
+    def assertNoFullScans(self, url, login=False, **params):
+        if login:
+            self.client.login(username='buyer', password='pw')
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url, params).status_code, 200)
+
+        scans = queryplan.full_scans(queries.captured_queries, self.ALLOWED_SCANS)
+        report = '\n\n'.join(f"{', '.join(tables)}:\n{sql}\n" + '\n'.join(plan) for sql, plan, tables in scans)
+        self.assertFalse(scans, f'Full table scan in {url}:\n{report}')
+
+    def test_harness_catches_a_full_scan(self):
+        with CaptureQueriesContext(connection) as queries:
+            list(models.Product.objects.filter(description__contains='shirt')[:5])
+
+        self.assertEqual(queryplan.full_scans(queries.captured_queries)[0][2], ['shop_product'])
+
+    def test_home(self):
+        self.assertNoFullScans(reverse('home'))
+
+    def test_product_list(self):
+        self.assertNoFullScans(reverse('product_list'))
+
+    def test_product_list_sorts_and_price_filter(self):
+        for sort in ('price_low', 'price_high', 'rating'):
+            self.assertNoFullScans(reverse('product_list'), sort=sort)
+        self.assertNoFullScans(reverse('product_list'), min_price=100, max_price=200)
+
+    def test_category_page(self):
+        self.assertNoFullScans(reverse('product_list_by_category', args=['cat3']))
+
+    def test_search(self):
+        self.assertNoFullScans(reverse('product_list'), search='product')
+
+    def test_product_list_json(self):
+        self.assertNoFullScans(reverse('product_list_json'), sort='price_low')
+
+    def test_product_detail(self):
+        self.assertNoFullScans(reverse('product_detail', args=[self.product.slug]), login=True)
+
+    def test_product_detail_with_reviews(self):
+        product = models.Product.objects.get(slug='product-2')
+        for i in range(12):
+            reviewer = User.objects.create_user(f'reviewer{i}')
+            models.Rating.objects.create(product=product, user=reviewer, rating=i % 5 + 1, comment='Nice')
+        product.update_rating_stats()
+
+        self.assertNoFullScans(reverse('product_detail', args=[product.slug]), login=True)          # 1 query per review --> over budget
+
+    def test_rate_product(self):
+        self.assertNoFullScans(reverse('rate_product', args=[self.product.id]), login=True)
+
+    def test_cart_and_checkout(self):
+        self.assertNoFullScans(reverse('cart_detail'), login=True)
+        self.assertNoFullScans(reverse('checkout'), login=True)
+
+    def test_profile(self):
+        self.assertNoFullScans(reverse('profile'), login=True)
+
+
+
+
+
+
+# Per-request query count / timing instrumentation
+class InstrumentationTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        make_product(make_category())
+
+    def test_queries_are_counted_per_view_and_exported(self):
+        self.client.get(reverse('product_list'))
+
+        exported = self.client.get(reverse('prometheus_metrics')).content.decode()        # test client = 127.0.0.1
+        self.assertIn('shop_http_requests_total{method="GET",status="200",view="product_list"} 1', exported)
+        self.assertRegex(exported, r'shop_db_queries_total\{view="product_list"\} [1-9]')
+        self.assertIn('shop_request_duration_seconds_count{view="product_list"} 1', exported)
+
+        self.assertEqual(self.client.get(reverse('prometheus_metrics'), REMOTE_ADDR='10.1.2.3').status_code, 403)
+
+    @override_settings(SERVER_TIMING=True)
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('product_list'))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries, \d+ duplicate", tpl;dur=[\d.]+, total;dur=[\d.]+$')
+
+    @override_settings(QUERY_BUDGETS={'product_list': 1}, QUERY_BUDGET_RAISE=True)
+    def test_over_budget_raises_in_tests(self):
+        with self.assertRaises(instrumentation.QueryBudgetExceeded):
+            self.client.get(reverse('product_list'))
+
+    @override_settings(QUERY_BUDGETS={'product_list': 1}, QUERY_BUDGET_RAISE=False)
+    def test_over_budget_logs(self):
+        with self.assertLogs('shop.instrumentation', 'WARNING'):
+            self.client.get(reverse('product_list'))
+        self.assertIn('query_budget.exceeded{view="product_list"}', metrics.snapshot())
+
+    def test_duplicate_queries_are_detected(self):
+        instrumentation.instrument(connection)
+        instrumentation.instrument(connection)                                          # installed once only
+
+        stats = instrumentation.RequestStats()
+        token = instrumentation._current.set(stats)
+        try:
+            for _ in range(3):
+                list(models.Category.objects.filter(slug='shirts'))
+            list(models.Category.objects.filter(slug='shoes'))
+        finally:
+            instrumentation._current.reset(token)
+
+        self.assertEqual(stats.queries, 4)
+        self.assertEqual(stats.duplicates, 2)
+        self.assertEqual(stats.most_repeated()[0][1], 3)
+
+
+
+
+
+
+# Synthetic catalog generator & benchmark suite
+class BenchmarkTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        call_command('generate_catalog', categories=3, products=40, users=4, ratings=60, orders=10, stdout=StringIO())
+
+    def test_generator_fills_derived_data(self):
+        self.assertEqual(models.Product.objects.filter(slug__startswith='gen-').count(), 40)
+        self.assertEqual(models.Rating.objects.count(), 60)
+        self.assertEqual(models.Order.objects.count(), 10)
+
+        for product in models.Product.objects.filter(rating_count__gt=0)[:10]:
+            stats = product.ratings.aggregate(n=Count('id'), total=Sum('rating'))
+            self.assertEqual((product.rating_count, product.rating_sum), (stats['n'], stats['total']))
+
+        order = models.Order.objects.first()
+        self.assertEqual(order.total_amount, order.calculate_total_cost())
+
+        if search.backend():
+            self.assertTrue(search.matching_ids('generated'))
+
+    def test_generator_is_reproducible_and_clear_replaces(self):
+        names = list(models.Product.objects.order_by('slug').values_list('name', 'price'))
+
+        with self.assertRaises(CommandError):
+            call_command('generate_catalog', categories=3, products=40, users=4, ratings=60, orders=10, stdout=StringIO())
+
+        call_command('generate_catalog', categories=3, products=40, users=4, ratings=60, orders=10, clear=True, stdout=StringIO())
+        self.assertEqual(list(models.Product.objects.order_by('slug').values_list('name', 'price')), names)
+
+    def test_generator_refuses_counts_it_can_not_fill(self):
+        for counts in ({'users': 0, 'orders': 5}, {'products': 0, 'orders': 5}, {'categories': 0, 'products': 5}, {'orders': -1}):
+            with self.subTest(**counts), self.assertRaises(CommandError):
+                call_command('generate_catalog', **{'categories': 3, 'products': 40, 'users': 4, 'ratings': 0, 'orders': 0, **counts}, clear=True, stdout=StringIO())
+
+        self.assertEqual(models.Product.objects.filter(slug__startswith='gen-').count(), 40)         # nothing was cleared
+
+        call_command('generate_catalog', categories=3, products=40, users=0, ratings=0, orders=0, clear=True, stdout=StringIO())
+        self.assertFalse(models.Order.objects.exists())
+
+    def test_benchmark_reports_and_compares(self):
+        output = os.path.join(tempfile.mkdtemp(), 'bench.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(output))
+        orders = models.Order.objects.count()
+
+        call_command('benchmark_shop', requests=3, warmup=1, output=output, stdout=StringIO())
+
+        result = benchmark.load(output)
+        self.assertEqual(set(result['scenarios']), set(benchmark.SCENARIOS))
+        for row in result['scenarios'].values():
+            self.assertEqual(row['requests'], 3)
+            self.assertEqual(row['errors'], 0)
+            self.assertLessEqual(row['p50_ms'], row['p99_ms'])
+            self.assertIsNotNone(row['queries_per_request'])                          # 0 for page-cache hits
+
+        self.assertEqual(models.Order.objects.count(), orders)                          # checkout runs were rolled back
+
+        rows, regressions = benchmark.compare(result, result)
+        self.assertEqual(regressions, [])
+
+        slower = json.loads(json.dumps(result))
+        slower['scenarios']['home']['p95_ms'] = result['scenarios']['home']['p95_ms'] * 2 + 1
+        slower['scenarios']['home']['queries_per_request'] += 1
+        self.assertEqual(len(benchmark.compare(result, slower)[1]), 2)
+
+    def test_mixed_load_includes_gateway_checkouts(self):
+        gateway = make_server()
+        threading.Thread(target=gateway.serve_forever, daemon=True).start()
+        self.addCleanup(gateway.server_close)
+        self.addCleanup(gateway.shutdown)
+        self.addCleanup(reset_client)
+
+        with self.settings(SSLCOMMERZ_PAYMENT_URL=base_url(gateway) + PAYMENT_PATH):
+            reset_client()
+            result = benchmark.run(scenarios=['payment', 'mixed'], requests_per_scenario=10, warmup=0,
+                                   users=[('gen-user-0', 'bench-password')])
+
+        self.assertEqual(result['scenarios']['payment']['errors'], 0)
+        self.assertEqual(result['scenarios']['mixed']['errors'], 0)
+
+    def test_serve_runs_a_server_until_done(self):
+        with benchmark.serve(['{python}', '-m', 'http.server', '{port}', '--bind', '127.0.0.1']) as url:
+            self.assertEqual(requests.get(url, timeout=5).status_code, 200)
+        with self.assertRaises(requests.ConnectionError):
+            requests.get(url, timeout=5)
+
+        with self.assertRaises(ValueError):
+            with benchmark.serve(['{python}', '-c', 'raise SystemExit(3)']):
+                pass
+
+
+
+
+
+
+# Precomputed related products
+class RelatedProductTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.shirts = make_category('Shirts')
+        self.shoes = make_category('Shoes')
+        self.shirt = make_product(self.shirts, name='Blue Shirt')
+        self.polo = make_product(self.shirts, name='Polo', rating_avg=4.5, rating_count=3)
+        self.tee = make_product(self.shirts, name='Tee')
+        self.runner = make_product(self.shoes, name='Runner')
+        self.boot = make_product(self.shoes, name='Boot')
+        self.user = User.objects.create_user('buyer')
+
+    def buy_together(self, *products, paid=True):
+        order = make_paid_order(self.user, products[0])
+        for product in products[1:]:
+            models.OrderItem.objects.create(order=order, product=product, price=product.price, quantity=1)
+        models.Order.objects.filter(id=order.id).update(paid=paid)
+
+    def related_ids(self, product):
+        return list(models.RelatedProduct.objects.filter(product=product).order_by('rank').values_list('related_id', flat=True))
+
+    def test_co_purchases_rank_first_then_category_fills(self):
+        self.buy_together(self.shirt, self.runner)
+        self.buy_together(self.shirt, self.runner)
+        self.buy_together(self.shirt, self.boot)
+        self.buy_together(self.shirt, self.tee, paid=False)                              # unpaid orders don't count
+
+        recommendations.compute_related(k=4)
+
+        self.assertEqual(self.related_ids(self.shirt), [self.runner.id, self.boot.id, self.polo.id, self.tee.id])
+        self.assertEqual(self.related_ids(self.tee)[0], self.polo.id)                      # no co-purchase --> best rated in category
+
+    def test_unavailable_products_are_not_recommended(self):
+        self.buy_together(self.shirt, self.runner)
+        models.Product.objects.filter(id=self.runner.id).update(available=False)
+
+        recommendations.compute_related()
+        self.assertNotIn(self.runner.id, self.related_ids(self.shirt))
+        self.assertEqual(self.related_ids(self.runner), [])
+
+    def test_detail_page_reads_precomputed_list_in_one_query(self):
+        self.buy_together(self.shirt, self.runner)
+        recommendations.compute_related(k=2)
+
+        with self.assertNumQueries(1):
+            related = recommendations.related_products(self.shirt, k=2)
+        self.assertEqual([p.id for p in related], [self.runner.id, self.polo.id])
+
+        response = self.client.get(reverse('product_detail', args=[self.shirt.slug]))
+        self.assertEqual([p.id for p in response.context['related_products']], self.related_ids(self.shirt)[:recommendations.TOP_K])
+
+    def test_fallback_is_newest_of_same_category(self):
+        related = recommendations.related_products(self.shirt)
+        self.assertEqual([p.id for p in related], [self.tee.id, self.polo.id])
+
+    def test_command_and_job(self):
+        call_command('compute_related_products', '--queue', stdout=StringIO())
+        self.assertEqual(jobs.run_batch()['done'], 1)
+        self.assertTrue(self.related_ids(self.shirt))
+
+        models.RelatedProduct.objects.all().delete()
+        call_command('compute_related_products', top=1, stdout=StringIO())
+        self.assertEqual(len(self.related_ids(self.shirt)), 1)
+
+
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], REPLICA_STICKY_SECONDS=5)
+class ReplicaRoutingTests(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.router = db_router.PrimaryReplicaRouter()
+
+    # runs the middleware around a fake view; returns (database the view reads from, response)
+    def route(self, request, url_name, write=False):
+        seen = {}
+        middleware = db_router.ReplicaRoutingMiddleware(lambda request: self.view(request, seen, write))
+
+        request.resolver_match = mock.Mock(url_name=url_name)
+        response = middleware(request)
+        return seen['read'], response
+
+    def view(self, request, seen, write):
+        db_router.ReplicaRoutingMiddleware(None).process_view(request, None, (), {})
+        if write:
+            self.router.db_for_write(models.Product)
+        seen['read'] = self.router.db_for_read(models.Product)
+        return HttpResponse()
+
+    def test_catalog_get_reads_replica(self):
+        read, response = self.route(self.factory.get('/'), 'home')
+        self.assertEqual(read, 'replica')
+        self.assertNotIn(db_router.STICKY_COOKIE, response.cookies)
+
+    def test_other_views_and_unsafe_methods_read_primary(self):
+        self.assertEqual(self.route(self.factory.get('/cart/'), 'cart_detail')[0], 'default')
+        self.assertEqual(self.route(self.factory.post('/'), 'home')[0], 'default')
+
+    def test_write_pins_request_and_visitor_to_primary(self):
+        read, response = self.route(self.factory.get('/'), 'home', write=True)
+        self.assertEqual(read, 'default')
+        self.assertIn(db_router.STICKY_COOKIE, response.cookies)
+
+        request = self.factory.get('/')
+        request.COOKIES[db_router.STICKY_COOKIE] = response.cookies[db_router.STICKY_COOKIE].value
+        self.assertEqual(self.route(request, 'home')[0], 'default')                       # read-your-writes
+
+        request.COOKIES[db_router.STICKY_COOKIE] = str(time.time() - 1)                   # expired --> replica again
+        self.assertEqual(self.route(request, 'home')[0], 'replica')
+
+    def test_outside_requests_use_primary_and_only_primary_migrates(self):
+        self.assertEqual(self.router.db_for_read(models.Product), 'default')
+        self.assertTrue(self.router.allow_migrate('default', 'shop'))
+        self.assertFalse(self.router.allow_migrate('replica', 'shop'))
+
+
+
+
+class TieredCacheTests(TestCase):
+
+    def setUp(self):
+        self.server = fake_redis.make_server()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        metrics.reset()
+
+    def worker_cache(self, location=None, **options):
+        location = fake_redis.redis_url(self.server) if location is None else location
+        return cachetier.TieredCache(location, {'OPTIONS' : {'NAME' : 'test', **options}})
+
+    def test_l1_is_bounded_by_entries_and_bytes(self):
+        lru = cachetier.LocalLRU(max_entries=2, max_bytes=10)
+        lru.set('a', b'1234')
+        lru.set('b', b'1234')
+        lru.get('a')                                                                     # b is now the least recently used
+        lru.set('c', b'1234')
+
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual(lru.get('a'), b'1234')
+        lru.set('d', b'12345678')                                                       # over 10 bytes --> evicts until it fits
+        self.assertEqual(lru.stats()['entries'], 1)
+        self.assertLessEqual(lru.stats()['bytes'], 10)
+        self.assertEqual(lru.stats()['evictions'], 3)
+
+    def test_clear_keeps_other_aliases_on_the_same_database(self):
+        location = fake_redis.redis_url(self.server)
+        default = cachetier.TieredCache(location, {'KEY_PREFIX' : 'cache', 'OPTIONS' : {'NAME' : 'default'}})
+        session_cache = cachetier.TieredCache(location, {'KEY_PREFIX' : 'session', 'OPTIONS' : {'NAME' : 'sessions', 'L1_TIMEOUT' : 0}})
+
+        default.set_many({f'page-{i}' : i for i in range(5)})
+        session_cache.set('cart', {'product' : 1})
+        default.clear()
+
+        self.assertEqual(default.get_many([f'page-{i}' for i in range(5)]), {})
+        self.assertEqual(session_cache.get('cart'), {'product' : 1})                          # not logged out, cart kept
+
+    def test_workers_share_l2_and_count_hits_per_tier(self):
+        one, two = self.worker_cache(), self.worker_cache()
+
+        one.set('product', {'name' : 'Shirt'}, 60)
+        self.assertEqual(two.get('product'), {'name' : 'Shirt'})                           # L1 miss, L2 hit
+        self.assertEqual(two.get('product'), {'name' : 'Shirt'})                           # now in L1
+
+        one.set('version', 1)
+        self.assertEqual(two.incr('version'), 2)
+        self.assertEqual(one.get('version'), 1)                              # L1 copy, trusted for L1_TIMEOUT
+        self.assertFalse(one.add('version', 5))
+        self.assertEqual(one.get_many(['product', 'missing']), {'product' : {'name' : 'Shirt'}})
+
+        stats = metrics.cache_stats()
+        self.assertEqual(stats['test_l2']['hits'], 1)
+        self.assertEqual(stats['test_l1']['hits'], 3)
+        self.assertEqual(one.stats()['l2']['keys'], 2)
+        self.assertGreater(one.stats()['l2']['used_memory'], 0)
+
+    def test_l1_timeout_zero_reads_l2_every_time(self):
+        one, two = self.worker_cache(L1_TIMEOUT=0), self.worker_cache(L1_TIMEOUT=0)
+
+        one.set('cart', {'items' : 1})
+        two.get('cart')
+        one.set('cart', {'items' : 2})
+        self.assertEqual(two.get('cart'), {'items' : 2})
+        self.assertEqual(two.stats()['l1']['entries'], 0)
+
+    def test_unreachable_l2_falls_back_to_l1(self):
+        self.server.server_close()
+        self.server.shutdown()
+        cache = self.worker_cache(fake_redis.redis_url(self.server), RETRY_SECONDS=60)
+
+        with self.assertLogs('shop.cachetier', 'WARNING'):
+            cache.set('key', 'value')
+        self.assertEqual(cache.get('key'), 'value')
+        self.assertTrue(cache.add('lock', 1))
+        self.assertEqual(cache.incr('lock'), 2)
+        self.assertEqual(cache.stats()['l2'], {'available' : False})
+        self.assertEqual(metrics.cache_stats()['test_l2']['errors'], 1)               # then no more tries until RETRY_SECONDS
+
+    def test_metrics_view_reports_tiers(self):
+        User.objects.create_user('staff', password='pw', is_staff=True)
+        self.client.login(username='staff', password='pw')
+
+        tiers = self.client.get(reverse('metrics')).json()['cache_tiers']
+        self.assertEqual(set(tiers), {'default', 'sessions'})
+        self.assertIn('bytes', tiers['default']['l1'])
+
+
+
+
+class WriteBehindSessionTests(TestCase):
+
+    def setUp(self):
+        sessions.flush_pending()
+        shared = mock.patch.object(sessions, 'write_behind', return_value=True)           # as with a Redis L2
+        shared.start()
+        self.addCleanup(shared.stop)
+        self.addCleanup(sessions.flush_pending)
+
+    def test_session_is_written_to_database_later(self):
+        store = sessions.SessionStore()
+        store['cart'] = {'1' : 2}
+        store.save()
+        self.assertFalse(Session.objects.filter(session_key=store.session_key).exists())
+
+        with self.assertNumQueries(0):
+            self.assertEqual(sessions.SessionStore(store.session_key)['cart'], {'1' : 2})
+
+        caches['sessions'].clear()                                                      # lost from the cache, still waiting
+        self.assertEqual(sessions.SessionStore(store.session_key)['cart'], {'1' : 2})
+
+        self.assertEqual(sessions.flush_pending(), 1)
+        caches['sessions'].clear()
+        self.assertEqual(sessions.SessionStore(store.session_key)['cart'], {'1' : 2})     # from the database
+
+    def test_batch_size_triggers_flush_and_delete_is_immediate(self):
+        with mock.patch.object(sessions, 'WRITE_BEHIND_BATCH', 3):
+            stores = [sessions.SessionStore() for _ in range(3)]
+            for store in stores:
+                store['n'] = 1
+                store.save()
+        self.assertEqual(Session.objects.filter(session_key__in=[s.session_key for s in stores]).count(), 3)
+
+        stores[0]['n'] = 2
+        stores[0].save()
+        stores[0].delete()
+        self.assertEqual(sessions.flush_pending(), 0)
+        self.assertFalse(Session.objects.filter(session_key=stores[0].session_key).exists())
+
+    def test_without_shared_cache_writes_at_once(self):
+        self.assertIsNone(caches['sessions'].l2)                                          # no CACHE_URL here
+
+        with mock.patch.object(sessions, 'write_behind', return_value=False):
+            store = sessions.SessionStore()
+            store['cart'] = {'1' : 2}
+            store.save()
+        self.assertTrue(Session.objects.filter(session_key=store.session_key).exists())
+
+    def test_waiting_sessions_are_flushed_when_due(self):
+        store = sessions.SessionStore()
+        store['n'] = 1
+        store.save()
+        self.assertTrue(any(thread.name == 'session-write-behind' for thread in threading.enumerate()))
+        self.assertEqual(sessions.flush_due(), 0)                                         # not old enough yet
+
+        with mock.patch.object(sessions, 'WRITE_BEHIND_SECONDS', 0):
+            self.assertEqual(sessions.flush_due(), 1)
+        self.assertTrue(Session.objects.filter(session_key=store.session_key).exists())
+
+    def test_login_keeps_working(self):
+        User.objects.create_user('buyer', password='pw')
+        self.assertTrue(self.client.login(username='buyer', password='pw'))
+        self.assertEqual(self.client.get(reverse('profile')).status_code, 200)
+
+
+
+
+
+class AsyncViewTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        async_settings = override_settings(ASYNC_VIEWS=True)
+        async_settings.enable()
+        self.addCleanup(self.reload_urls)
+        self.addCleanup(async_settings.disable)
+        self.reload_urls()
+
+        self.product = make_product(make_category('Shirts'), name='Blue Shirt', stock=5)
+        self.user = User.objects.create_user('buyer', password='pw')
+
+    @staticmethod
+    def reload_urls():                                                                  # urls.py picks the views at import time
+        importlib.reload(shop_urls)
+        importlib.reload(project_urls)
+        clear_url_caches()
+
+    def test_urls_use_async_views(self):
+        for name, args in [('home', []), ('product_list', []), ('cart_add', [1]), ('payment_process', [])]:
+            self.assertTrue(iscoroutinefunction(resolve(reverse(name, args=args)).func), name)
+
+    async def test_catalog_pages(self):
+        response = await self.async_client.get(reverse('home'))
+        self.assertContains(response, 'Blue Shirt')
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertEqual((await self.async_client.get(reverse('home')))['X-Page-Cache'], 'hit')
+
+        response = await self.async_client.get(reverse('product_list'), {'sort' : 'price_low'})
+        self.assertContains(response, 'Blue Shirt')
+
+        response = await self.async_client.get(reverse('product_detail', args=[self.product.slug]))
+        self.assertEqual(response.context['product'], self.product)
+        self.assertEqual((await self.async_client.get(reverse('product_detail', args=['missing']))).status_code, 404)
+
+    async def test_cart_flow(self):
+        self.assertEqual((await self.async_client.get(reverse('cart_detail'))).status_code, 302)        # login required
+        await self.async_client.aforce_login(self.user)
+
+        await self.async_client.post(reverse('cart_add', args=[self.product.id]))
+        await self.async_client.post(reverse('cart_add', args=[self.product.id]))
+        item = await models.CartItem.objects.aget(cart__user=self.user)
+        self.assertEqual(item.quantity, 2)
+        self.assertEqual((await self.async_client.get(reverse('cart_count'))).json(), {'count' : 2})
+
+        await self.async_client.post(reverse('cart_update', args=[self.product.id]), {'quantity' : 9})   # only 5 in stock
+        response = await self.async_client.get(reverse('cart_detail'))
+        self.assertEqual(response.context['summary'].total_items, 5)
+
+        await self.async_client.post(reverse('cart_remove', args=[self.product.id]))
+        self.assertFalse(await models.CartItem.objects.filter(cart__user=self.user).aexists())
+        self.assertEqual((await self.async_client.get(reverse('cart_count'))).json(), {'count' : 0})
+
+    async def test_payment_process_awaits_gateway(self):
+        server = make_server()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        order = await sync_to_async(make_paid_order)(self.user, self.product)
+        await self.async_client.aforce_login(self.user)
+        session = await self.async_client.asession()
+        session['order_id'] = order.id
+        await session.asave()
+
+        with self.settings(SSLCOMMERZ_PAYMENT_URL=base_url(server) + PAYMENT_PATH):
+            reset_client()
+            self.addCleanup(reset_client)
+            response = await self.async_client.get(reverse('payment_process'))
+
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].startswith(base_url(server) + '/pay/'))
+
+
+
+
+
+
+# Read-only JSON catalog API
+class CatalogApiTests(TestCase):
+
+    def setUp(self):
+        self.category = make_category()
+        self.products = [make_product(self.category, name=f'Shirt {i}', price=100 + i) for i in range(5)]
+        self.product = self.products[0]
+        self.user = User.objects.create_user('buyer')
+
+
+    def get(self, name, *args, etag=None, **params):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return self.client.get(reverse(name, args=args), params, **headers)
+
+
+    def data(self, response):
+        if response.streaming:
+            return json.loads(b''.join(response.streaming_content))
+        return response.json()
+
+
+    def test_categories(self):
+        response = self.get('api_categories')
+        self.assertEqual(self.data(response)['results'][0]['slug'], 'shirts')
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get('api_categories', etag=response['ETag']).status_code, 304)
+
+        self.category.description = 'New'
+        self.category.save()
+        self.assertEqual(self.get('api_categories', etag=response['ETag']).status_code, 200)
+
+
+    def test_products_are_streamed_page_by_page(self):
+        response = self.get('api_products', sort='price_low', limit=2)
+        self.assertTrue(response.streaming)
+
+        seen = []
+        while True:
+            data = self.data(response)
+            seen += [product['name'] for product in data['results']]
+            if not data['next_cursor']:
+                break
+            response = self.get('api_products', sort='price_low', limit=2, cursor=data['next_cursor'])
+
+        self.assertEqual(seen, [f'Shirt {i}' for i in range(5)])
+        self.assertEqual(len(self.data(self.get('api_products', search='shirt', category='shirts'))['results']), 5)
+
+
+    def test_field_selection(self):
+        data = self.data(self.get('api_products', fields='id,category,price', limit=1))
+        self.assertEqual(data['results'], [{'id': self.products[-1].id, 'category': 'shirts', 'price': '104.00'}])
+
+        self.assertNotIn('description', self.data(self.get('api_products'))['results'][0])
+        self.assertEqual(self.get('api_products', fields='id,secret').status_code, 400)
+        self.assertEqual(self.get('api_products', limit=0).status_code, 400)
+        self.assertEqual(self.get('api_products', cursor='nope').status_code, 400)
+
+
+    def test_bad_filter_values(self):
+        for params in [{'min_price': 'abc'}, {'max_price': 'NaN'}, {'rating': '4 stars'}]:
+            self.assertEqual(self.get('api_products', **params).status_code, 400)
+            self.assertEqual(self.client.get(reverse('product_list_json'), params).status_code, 400)
+
+            response = self.client.get(reverse('product_list'), params)                       # ignored on the HTML page
+            self.assertEqual(len(response.context['products']), 5)
+
+        self.assertEqual(len(self.data(self.get('api_products', min_price='102.5', rating='0'))['results']), 2)
+
+
+    def test_unavailable_products_are_not_listed(self):
+        models.Product.objects.filter(id=self.product.id).update(available=False)
+        ids = [product['id'] for product in self.data(self.get('api_products'))['results']]
+        self.assertEqual(len(ids), 4)
+        self.assertNotIn(self.product.id, ids)
+
+
+    def test_product_list_not_modified(self):
+        etag = self.get('api_products')['ETag']
+
+        with self.assertNumQueries(1):                                                     # the version query only
+            response = self.get('api_products', etag=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        models.Product.objects.filter(id=self.product.id).update(stock=F('stock') - 1)     # checkout: no updated_at change
+        self.assertEqual(self.get('api_products', etag=etag).status_code, 200)
+
+
+    def test_product_detail(self):
+        response = self.get('api_product_detail', self.product.slug)
+        self.assertEqual(response.json()['description'], self.product.description)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get('api_product_detail', self.product.slug, etag=response['ETag']).status_code, 304)
+
+        models.Rating.objects.create(product=self.product, user=self.user, rating=4, comment='ok')
+        self.product.update_rating_stats()
+        self.assertEqual(self.get('api_product_detail', self.product.slug, etag=response['ETag']).status_code, 200)
+
+        models.Product.objects.filter(id=self.product.id).update(available=False)
+        self.assertEqual(self.get('api_product_detail', self.product.slug).status_code, 404)
+
+
+    def test_product_ratings(self):
+        other = User.objects.create_user('other')
+        models.Rating.objects.create(product=self.product, user=self.user, rating=4, comment='ok')
+        rating = models.Rating.objects.create(product=self.product, user=other, rating=2, comment='meh')
+
+        response = self.get('api_product_ratings', self.product.slug, limit=1)
+        data = self.data(response)
+        self.assertEqual(data['results'][0]['user'], 'other')                                # newest first
+        self.assertEqual(self.data(self.get('api_product_ratings', self.product.slug, cursor=data['next_cursor']))['results'][0]['user'], 'buyer')
+
+        self.assertEqual(self.get('api_product_ratings', self.product.slug, limit=1, etag=response['ETag']).status_code, 304)
+        rating.comment = 'better now'
+        rating.save()
+        self.assertEqual(self.get('api_product_ratings', self.product.slug, limit=1, etag=response['ETag']).status_code, 200)
@@ -1,7 +1,12 @@
 from django.contrib import admin
 from django.urls import path, include
+from django.conf import settings
 
-from . import views
+from . import views, async_views, api
+
+
+# ASGI deployment --> async versions of the catalog, cart & payment views (settings.ASYNC_VIEWS, see async_views.py)
+pages = async_views if settings.ASYNC_VIEWS else views
 
 
 urlpatterns = [
@@ -12,26 +17,40 @@ urlpatterns = [
     path('logout/', views.logout_view, name="logout"),
     
     # products related urls
-    path('', views.home, name="home"),
-    path('products/', views.product_list, name="product_list"),                                                         # All Product List
-    path('products/<slug:category_slug>/', views.product_list, name="product_list_by_category"),                        # All Product List By Category 
-    path('products/detail/<slug:slug>/', views.product_detail, name="product_detail"),
+    path('', pages.home, name="home"),
+    path('products/', pages.product_list, name="product_list"),                                                         # All Product List
+    path('products/json/', views.product_list_json, name="product_list_json"),                                          # JSON page of products (infinite scroll)
+    path('products/json/<slug:category_slug>/', views.product_list_json, name="product_list_json_by_category"),
+    path('products/<slug:category_slug>/', pages.product_list, name="product_list_by_category"),                        # All Product List By Category 
+    path('products/detail/<slug:slug>/', pages.product_detail, name="product_detail"),
     path('rate/<int:product_id>/', views.rate_product, name="rate_product"),
     
     # cart related urls
-    path('cart/', views.cart_detail, name="cart_detail"),
-    path('cart/add/<int:product_id>/', views.cart_add, name="cart_add"),
-    path('cart/remove/<int:product_id>/', views.cart_remove, name="cart_remove"),
-    path('cart/update/<int:product_id>/', views.cart_update, name="cart_update"),
+    path('cart/', pages.cart_detail, name="cart_detail"),
+    path('cart/count/', pages.cart_count, name="cart_count"),                                                           # navbar count (JSON)
+    path('cart/add/<int:product_id>/', pages.cart_add, name="cart_add"),
+    path('cart/remove/<int:product_id>/', pages.cart_remove, name="cart_remove"),
+    path('cart/update/<int:product_id>/', pages.cart_update, name="cart_update"),
     
     # checkout related urls
     path('checkout/', views.checkout, name="checkout"),
-    path('payment/process/', views.payment_process, name="payment_process"),
+    path('payment/process/', pages.payment_process, name="payment_process"),
     path('payment/success/<int:order_id>/', views.payment_success, name="payment_success"),
     path('payment/fail/<int:order_id>/', views.payment_fail, name="payment_fail"),
     path('payment/cancel/<int:order_id>/', views.payment_cancel, name="payment_cancel"),
+    path('payment/ipn/', views.payment_ipn, name="payment_ipn"),                                                       # SSLCommerz --> us
     
     # profile
     path('profile/', views.profile_view, name="profile"),
 
+    # read-only JSON catalog API (ETag / If-None-Match, see api.py)
+    path('api/categories/', api.categories, name="api_categories"),
+    path('api/products/', api.products, name="api_products"),
+    path('api/products/<slug:slug>/', api.product_detail, name="api_product_detail"),
+    path('api/products/<slug:slug>/ratings/', api.product_ratings, name="api_product_ratings"),
+
+    # instrumentation
+    path('metrics/', views.metrics_view, name="metrics"),
+    path('metrics/prometheus/', views.prometheus_metrics_view, name="prometheus_metrics"),
+
 ]
\ No newline at end of file
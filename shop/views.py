@@ -1,4 +1,6 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.http import JsonResponse, HttpResponse, HttpResponseForbidden
+from django.urls import reverse
 from django.contrib.auth import authenticate, login, logout
 from django.contrib import messages
 
@@ -6,16 +8,56 @@ from .forms import RatingForm, RegistrationForm, CheckoutForm
 
 from . import models 
 
-from django.db.models import Q, Min, Max, Avg
+from django.db import transaction
+
+from django.db.models import Q, Count, Sum, Prefetch
+
+from django.core.paginator import Paginator
+
+from decimal import Decimal, InvalidOperation
 
 from . import forms
 
-from .sslcommerz import generate_sslcommerz_payment, send_order_confirmation_email
+from .pagination import get_sort, paginate_products, InvalidCursor
+
+from . import search
+
+from .facets import get_facets
+
+from .inventory import reserve_stock, OutOfStock
+
+from .lifecycle import cancel_unpaid
+
+from .sslcommerz import generate_sslcommerz_payment
+
+from .context_processor import refresh_cart_items_count
+
+from .cart import get_cart_summary, load_cart, summarize_cart
+
+from .recommendations import related_products as related_products_for
+
+from .gateway import GatewayError
+
+from . import payments
+
+from django.conf import settings
 
 from django.contrib.auth.decorators import login_required
 
+from django.contrib.admin.views.decorators import staff_member_required
+
+from . import metrics
+
+from .pagecache import anonymous_page_cache
+
+from .context_processor import cart_items_count
+
 from django.views.decorators.csrf import csrf_exempt
 
+from django.views.decorators.cache import never_cache
+
+from django.core.cache import caches
+
 
 
 # manual Authentication
@@ -74,6 +116,7 @@ def logout_view(request):
 # Home page
 # 2 things-> Featured products | Shop by category
 
+@anonymous_page_cache
 def home(request):
     featured_products = models.Product.objects.filter(available=True).order_by('-created_at')[:8]                   # Query set- 8 products in descending order
     categories = models.Category.objects.all()
@@ -98,10 +141,17 @@ def home(request):
 # 2 types of URL -> Normal URL | Category-wise URL
 # This page has filtering options
 # Filter based on 3 things -> Category || Price || Rating
+# Products are shown page by page using a cursor (see pagination.py)
 
+@anonymous_page_cache
 def product_list(request, category_slug = None):
+    return render(request, 'shop/product_list.html', product_list_context(request, category_slug))
+
+
+
+# everything the product list shows (shared with the async view in async_views.py)
+def product_list_context(request, category_slug = None):
     category = None
-    categories = models.Category.objects.all()
     products = models.Product.objects.all()
 
 
@@ -112,67 +162,162 @@ def product_list(request, category_slug = None):
 
 
 
-    # Aggregate used to get a summary of the whole query set
-    min_price = products.aggregate(Min('price'))['price__min']                                  # calculating the 'minimum value' of the 'price' field from the all 'products' and storing it in the 'min_price' variable.
-    max_price = products.aggregate(Max('price'))['price__max']                                  # calculating the 'maximum value' of the 'price' field from the all 'products' and storing it in the 'max_price' variable.
+    # Sidebar facets --> price min/max, price histogram, products per category & per rating
+    # 1 grouped query for all of them, cached per filter set (see facets.py)
+    facets = get_facets(category_slug, request.GET.get('search'), request.GET.get('rating'))
+
+
+    products = filter_products(request, products)
+
+
+
+    # pagination
+    sort = get_sort(request)
+
+    try:
+        products, next_cursor = paginate_products(products, sort, request.GET.get('cursor'))
+    except InvalidCursor:
+        products, next_cursor = paginate_products(products, sort)                                  # broken/old cursor --> start from the first page
+
+
+    if request.GET.get('search'):
+        search.highlight(products, request.GET.get('search'))                                     # matched words in the description are wrapped in <mark>
+
 
+    next_url = None
+    if next_cursor:
+        params = request.GET.copy()                                                                # keep all the filters for the next page
+        params['cursor'] = next_cursor
+        next_url = f"{request.path}?{params.urlencode()}"
+
+
+
+
+    context = {
+        'category' : category,
+        'categories' : facets['categories'],
+        'products' : products,
+        'min_price' : facets['min_price'],
+        'max_price' : facets['max_price'],
+        'facets' : facets,
+        'sort' : sort,
+        'next_url' : next_url
+    }
+
+    return context
+
+
+
+
+
+# JSON version of the product list (for infinite scroll)
+# Same filters & sort as the HTML page; send 'cursor' from the previous response to get the next page
+
+def product_list_json(request, category_slug = None):
+    products = models.Product.objects.select_related('category')
+
+    if category_slug:
+        category = get_object_or_404(models.Category, slug = category_slug)
+        products = products.filter(category = category)
+
+    sort = get_sort(request)
+
+    try:
+        products = filter_products(request, products, strict=True)
+        products, next_cursor = paginate_products(products, sort, request.GET.get('cursor'))
+    except (InvalidCursor, InvalidFilter) as e:
+        return JsonResponse({'error' : str(e)}, status=400)
+
+
+    results = [
+        {
+            'id' : product.id,
+            'name' : product.name,
+            'slug' : product.slug,
+            'category' : product.category.slug,
+            'price' : str(product.price),
+            'stock' : product.stock,
+            'rating_avg' : float(product.rating_avg),
+            'rating_count' : product.rating_count,
+            'image' : product.image.url if product.image else None,
+            'url' : reverse('product_detail', args=[product.slug]),
+        }
+        for product in products
+    ]
+
+    return JsonResponse({'results' : results, 'next_cursor' : next_cursor})
+
+
+
+
+
+# Filters shared by the HTML & JSON product list
+# Price || Rating || Search
+# A filter value that is not a number: the HTML page ignores it, JSON (strict=True) gets InvalidFilter --> 400
+
+class InvalidFilter(ValueError):
+    pass
+
+
+
+def number_param(request, name, strict):
+    value = request.GET.get(name, '').strip()
+    if not value:
+        return None
+
+    try:
+        number = Decimal(value)
+    except InvalidOperation:
+        number = None
 
+    if number is None or not number.is_finite() or number < 0:
+        if strict:
+            raise InvalidFilter(f'{name} must be a number')
+        return None
+    return number
+
+
+
+def filter_products(request, products, strict=False):
+    min_price = number_param(request, 'min_price', strict)
+    max_price = number_param(request, 'max_price', strict)
+    min_rating = number_param(request, 'rating', strict)
 
     # filtering based on the 'min price'
-    if request.GET.get('min_price'):
-        products = products.filter(price__gte = request.GET.get('min_price'))                              # gte = greater than equal; if the price is grater equal to the user's min price
+    if min_price is not None:
+        products = products.filter(price__gte = min_price)                                                 # gte = greater than equal; if the price is grater equal to the user's min price
     
 
     # filtering based on the 'max price'
-    if request.GET.get('max_price'):
-        products = products.filter(price__lte = request.GET.get('max_price'))                               # lte = less than equal; if the price is less equal to the user's max price
+    if max_price is not None:
+        products = products.filter(price__lte = max_price)                                                  # lte = less than equal; if the price is less equal to the user's max price
 
 
 
     # filtering based on the 'rating'
-    if request.GET.get('rating'):
+    if min_rating is not None:
 
-        min_rating = request.GET.get('rating')
-       
-        products = products.annotate(
-            avg_rating = Avg('ratings__rating')
-            ).filter(avg_rating__gte=min_rating)
+        products = products.filter(rating_avg__gte=min_rating)
 
 
-        # 1. A temporary field named 'avg_rating' is created [needed this temp variable bcz in the Product Model there is no method/variable to calculate this AVG]
-        # 2. annotate() adds this 'avg_rating' field to each product
-        # 3. The average rating is calculated for each individual product
-        # 4. Aggregation (AVG) is applied on the rating field
-        # 5. For each product, the 'rating' value is accessed using the related_name 'ratings' from the Rating model
-        # 6. Products are filtered where avg_rating is greater than or equal ---> to the user-selected rating
+        # 1. 'rating_avg' is stored on the Product model (kept in sync when a rating is saved)
+        # 2. So no join with the Rating table and no AVG() for each product is needed
+        # 3. Products are filtered where rating_avg is greater than or equal ---> to the user-selected rating
 
 
 
 
 
     # search
+    # full-text index (FTS5 on SQLite, tsvector on Postgres) instead of icontains on 3 columns
     if request.GET.get('search'):
 
         query = request.GET.get('search')
 
-        products = products.filter(
-            Q(name__icontains = query) | 
-            Q(description__icontains = query) | 
-            Q(category__name__icontains = query)  
-        )
-
-
+        products = search.search_products(products, query)                                         # also adds 'search_rank' for the 'relevance' sort
 
 
-    context = {
-        'category' : category,
-        'categories' : categories,
-        'products' : products,
-        'min_price' : min_price,
-        'max_price' : max_price
-    }
-
-    return render(request, 'shop/product_list.html', context)
+    return products
     
 
 
@@ -186,9 +331,12 @@ def product_list(request, category_slug = None):
 # Single product details page
 
 def product_detail(request, slug):
-    product = get_object_or_404(models.Product, slug = slug, available = True)                                                      # comparing product's slug with the user's provided product slug
-    related_products = models.Product.objects.filter(category = product.category).exclude(id = product.id)                           # related_product == all products from the same category of the current product
-                                                                                                                                    # exclude == Excludes the product that is currently being viewed
+    product = get_object_or_404(
+        models.Product.objects.prefetch_related(Prefetch('ratings', queryset=models.Rating.objects.select_related('user'))),          # reviews & their usernames in 1 query, not 1 per review
+        slug = slug, available = True                                                                                               # comparing product's slug with the user's provided product slug
+    )
+    related_products = related_products_for(product)                                                                                # top 8, precomputed from co-purchases & category (see recommendations.py)
+                                                                                                                                    # not computed yet --> newest products of the same category
 
     user_rating = None
 
@@ -282,7 +430,10 @@ def rate_product(request, product_id):
             rating = form.save(commit=False)
             rating.product = product
             rating.user = request.user 
-            rating.save()
+
+            with transaction.atomic():                                                  # rating & the product's rating summary are saved together
+                rating.save()                                                           # the summary is updated by the Rating post_save signal
+
             return redirect('product_detail', slug=product.slug)
 
 
@@ -310,22 +461,27 @@ def rate_product(request, product_id):
 # Everything about Cart - feature
 
 
+# Navbar cart count as JSON
+# Pages can come from a cache (anonymous page cache, browser back/forward cache); base.html asks for the live count
+
+@never_cache
+def cart_count(request):
+    return JsonResponse({'count' : cart_items_count(request)['cart_items_count']})
+
+
+
+
 # cart details
 @login_required
 def cart_detail(request):
 
-    # user don't have any cart
-    try:
-        cart = models.Cart.objects.get(user=request.user)
+    # cart + items + products loaded once; line costs & totals calculated once (see cart.py)
+    # user don't have any cart --> an empty one is created
+    summary = get_cart_summary(request.user)
 
-    # user have any cart
-    except models.Cart.DoesNotExist:
-        cart = models.Cart.objects.create(user=request.user)
-    
 
 
-
-    return render(request, 'shop/cart.html', {'cart' : cart})
+    return render(request, 'shop/cart.html', {'cart' : summary.cart, 'summary' : summary})
 
 
 
@@ -365,6 +521,7 @@ def cart_add(request,product_id):
         models.CartItem.objects.create(cart=cart, product = product, quantity = 1)                         # then add the item in the cart; initial item quantity = 1
         messages.success(request, f"{product.name} has been added to your cart!")
 
+    refresh_cart_items_count(request.user)                                                                 # navbar count
     return redirect('product_detail', slug=product.slug)
 
 
@@ -407,7 +564,7 @@ def cart_update(request,product_id):
         messages.success(request, f"Cart updated successfully!!")
 
 
-
+    refresh_cart_items_count(request.user)                                                                 # navbar count
     return redirect('cart_detail')
 
 
@@ -430,6 +587,7 @@ def cart_remove(request,product_id):
     # delete
     cart_item.delete()
     messages.success(request, f"{product.name} has been Deleted from your cart!")
+    refresh_cart_items_count(request.user)                                                                 # navbar count
 
 
 
@@ -456,16 +614,18 @@ def cart_remove(request,product_id):
 @login_required
 def checkout(request):
 
-    try:
-        cart = models.Cart.objects.get(user=request.user)                                # user have a cart(cart has items)
-        if not cart.items.exists():                                                      # suppose deleted the items until the cart is 'empty'
-            messages.warning(request, 'Your cart is empty')                              # as the cart is empty, so it will not go to checkout page----> it will show a warning message
-            return redirect('cart_detail')
+    cart = load_cart(request.user)                                                       # cart + items + products (loaded once, see cart.py)
 
-    
-    except models.Cart.DoesNotExist:                                                 # user have no cart
+    if cart is None:                                                                 # user have no cart
         messages.warning(request, 'Your cart is empty!')                             # as there is no cart, so it will never go to checkout page----> it will show a warning message
         return redirect('cart_detail')
+
+
+    summary = summarize_cart(cart)
+
+    if not summary:                                                                  # suppose deleted the items until the cart is 'empty'
+        messages.warning(request, 'Your cart is empty')                              # as the cart is empty, so it will not go to checkout page----> it will show a warning message
+        return redirect('cart_detail')
     
 
 
@@ -475,23 +635,40 @@ def checkout(request):
         form = CheckoutForm(request.POST)
 
         if form.is_valid():
-            order = form.save(commit=False)                                         # "commit=False"--> form object created but not pushed in the DB
-            order.user = request.user
-            order.save()                                        # save means -> order done
-
-
-            for item in cart.items.all():
-                models.OrderItem.objects.create(                                # creating OrderItem for all objects
-                    order = order,
-                    product = item.product,                                     # here, cart item = order item
-                    price = item.product.price,                                 # product's main price = order item's main price
-                    quantity = item.quantity                                    # cart item's quantity = order item's quantity
-                )
-
-            
-            # order done finally
-            # As the order is completed, the cart will not has any value
-            cart.items.all().delete() 
+            try:
+                with transaction.atomic():                                              # order, order items, stock hold & empty cart --> all or nothing
+                    order = form.save(commit=False)                                         # "commit=False"--> form object created but not pushed in the DB
+                    order.user = request.user
+                    order.total_amount = summary.total_price                                # total is stored with the order
+                    order.save()                                        # save means -> order done
+
+
+                    models.OrderItem.objects.bulk_create([                              # all the OrderItems in 1 INSERT
+                        models.OrderItem(
+                            order = order,
+                            product = line.product,                                     # here, cart item = order item
+                            price = line.product.price,                                 # product's main price = order item's main price
+                            quantity = line.quantity                                    # cart item's quantity = order item's quantity
+                        )
+                        for line in summary.lines
+                    ])
+
+
+                    # hold the stock for this order (given back if the payment fails or is never finished)
+                    reserve_stock(order, [(line.product.id, line.quantity) for line in summary.lines])
+
+                    
+                    # order done finally
+                    # As the order is completed, the cart will not has any value
+                    models.CartItem.objects.filter(cart=cart).delete()                  # 1 DELETE statement
+
+            except OutOfStock as e:
+                product = models.Product.objects.get(id=e.product_id)
+                messages.warning(request, f"Sorry, not enough stock for {product.name}. Only {product.stock} left!")
+                return redirect('cart_detail')
+
+
+            refresh_cart_items_count(request.user, 0)                                       # cart is empty now
             request.session['order_id'] = order.id                                          # session delete
             return redirect('payment_process')
 
@@ -501,6 +678,7 @@ def checkout(request):
      
     context = {
         'cart' : cart,
+        'summary' : summary,
         'form' : form
     }
 
@@ -535,10 +713,15 @@ def payment_process(request):
         return redirect('home')
     
     order = get_object_or_404(models.Order, id=order_id)
-    payment_data = generate_sslcommerz_payment(request, order)
+
+    try:
+        payment_data = generate_sslcommerz_payment(request, order)
+    except GatewayError:                                                            # gateway down/slow (timeouts & retries already done)
+        messages.error(request, 'Payment gateway is not responding. Please Try again.')
+        return redirect('checkout')
     
 
-    if payment_data['status'] == 'SUCCESS':
+    if payment_data.get('status') == 'SUCCESS':
         return redirect(payment_data['GatewayPageURL'])
 
     else:
@@ -589,42 +772,57 @@ def payment_process(request):
 
 # 1. Payment Success 
 # another way to handle payment success
+# SSLCommerz posts tran_id & val_id here; the order is only marked paid after the validation API agrees (payments.py)
 @csrf_exempt
 def payment_success(request, order_id):
     order = get_object_or_404(models.Order, id=order_id)
 
-    if order.paid:
+    if order.paid:                                                                  # repeated callback / page reload --> 1 lookup
         return render(request, 'shop/payment_success.html', {'order': order})
 
-    order.paid = True
-    order.status = 'processing'
-    order.transaction_id = request.POST.get('tran_id', f"TXN-{order.id}")
-    order.save()
+    if request.method != 'POST' or request.POST.get('tran_id') != str(order.id):
+        messages.error(request, 'Payment could not be verified.')
+        return redirect('checkout')
 
-    # get all the order items
-    order_items = order.order_items.all()
+    try:
+        payments.process(order, request.POST['tran_id'], request.POST.get('val_id'))
+    except payments.InvalidPayment:
+        messages.error(request, 'Payment could not be verified.')
+        return redirect('checkout')
+    except GatewayError:                                                            # validated later by the worker
+        messages.info(request, 'Payment received. Your order will be confirmed shortly.')
+        return redirect('profile')
 
-    # for each item:
-    for item in order_items:
-        product = item.product                                  # get the exact one product each time
-        product.stock -= item.quantity                          # product stock --> decrease
+    order.refresh_from_db()
+    return render(request, 'shop/payment_success.html', {'order': order})
 
 
-        if product.stock < 0:
-            product.stock = 0                                    # if negative value comes by any issue, make stock 0
-    
-        product.save()
 
 
-  ## Send Confirmation email
+# IPN (Instant Payment Notification): SSLCommerz --> us, server to server
+# Answered at once; the validation call is made by the worker in a batch ('validate_payments' job)
+# A repeated IPN for a paid transaction costs 1 indexed lookup (Payment.tran_id is unique)
+@csrf_exempt
+def payment_ipn(request):
+    if request.method != 'POST':
+        return HttpResponse(status=405)
+
+    tran_id = request.POST.get('tran_id', '')
+
+    if models.Payment.objects.filter(tran_id=tran_id, status='paid').exists():
+        return HttpResponse('OK')
+
+    if request.POST.get('status') not in payments.VALID_STATUSES:                  # failed / cancelled: the browser callbacks handle those
+        return HttpResponse('IGNORED')
+
     try:
-        send_order_confirmation_email(order)
-    except Exception as e:
-        # This will catch the Network error and print it to your Render logs
-        # instead of crashing the checkout page for the user.
-        print(f"Email failed to send: {e}")
+        with transaction.atomic():
+            payments.record(payments.order_for(tran_id), tran_id, request.POST.get('val_id'), 'ipn')
+            payments.queue_validation()
+    except payments.InvalidPayment:
+        return HttpResponse('INVALID', status=400)
 
-    return render(request, 'shop/payment_success.html', {'order': order})
+    return HttpResponse('OK')
 
 
 
@@ -639,9 +837,7 @@ def payment_success(request, order_id):
 def payment_fail(request, order_id):
     order = get_object_or_404(models.Order, id = order_id, user=request.user)
 
-    order.status = 'canceled'
-
-    order.save()
+    cancel_unpaid(order)                                                            # paid orders are left alone; held stock given back
     return redirect('checkout')
 
 
@@ -654,9 +850,7 @@ def payment_fail(request, order_id):
 def payment_cancel(request, order_id):
     order = get_object_or_404(models.Order, id = order_id, user=request.user)
 
-    order.status = 'canceled'
-
-    order.save()
+    cancel_unpaid(order)                                                            # paid orders are left alone; held stock given back
     return redirect('cart_detail')
 
 
@@ -670,24 +864,60 @@ def payment_cancel(request, order_id):
 @login_required
 def profile_view(request):
     tab = request.GET.get('tab')                                                             # which tab is active               
-    orders = models.Order.objects.filter(user = request.user).order_by('-created_at')        # "order_by('-created_at')" --> newest first
-    completed_orders = orders.filter(status = 'delivered')                                   # "filter(status = 'delivered')" --> completed orders
+    orders = models.Order.objects.filter(user = request.user).order_by('-created_at', '-id')        # "order_by('-created_at')" --> newest first
+
 
-    total_spent = sum(order.get_total_cost() for order in orders)
+    # counts & total spent of all the orders in 1 query
+    stats = orders.aggregate(
+        order_count = Count('id'),
+        total_spent = Sum('total_amount', filter=Q(paid=True)),                              # only paid orders count as spent
+        **{status : Count('id', filter=Q(status=status)) for status, _ in models.Order.STATUS}
+    )
+
+    status_counts = [(label, stats[status]) for status, label in models.Order.STATUS]
     order_history_active = (tab == 'orders')                                          # true if 'orders' tab is active, else false    
 
-    for order in orders:
-        print(order.id, "status:", order.status, "display:", order.get_status_display())
+
+    # order history, 10 orders per page; items + products + categories of the page in 2 more queries
+    items = models.OrderItem.objects.select_related('product__category')
+    paginator = Paginator(orders.prefetch_related(Prefetch('order_items', queryset=items)), 10)
+    page = paginator.get_page(request.GET.get('page'))
 
 
 
     context = {
         'user' : request.user,
-        'orders' : orders,
-        'completed_orders' : completed_orders,
-        'total_spent' : total_spent,
+        'orders' : page,
+        'order_count' : stats['order_count'],
+        'completed_count' : stats['delivered'],                                       # "status = 'delivered'" --> completed orders
+        'status_counts' : status_counts,
+        'total_spent' : stats['total_spent'] or 0,
         'order_history_active' : order_history_active
     }
    
 
-    return render(request, 'shop/profile.html', context)    
\ No newline at end of file
+    return render(request, 'shop/profile.html', context)
+
+
+
+
+
+
+# Instrumentation (staff only)
+# cache hit/miss counters of this worker process, memory used by each cache tier
+
+@staff_member_required
+def metrics_view(request):
+    tiers = {alias : caches[alias].stats() for alias in settings.CACHES if hasattr(caches[alias], 'stats')}
+    return JsonResponse({'caches' : metrics.cache_stats(), 'cache_tiers' : tiers, 'counters' : metrics.snapshot()})
+
+
+
+# Same numbers + per-view query counts & timings (shop/instrumentation.py) in the Prometheus text format
+# for the monitoring server on this machine (INTERNAL_IPS) or a staff user
+
+def prometheus_metrics_view(request):
+    if request.META.get('REMOTE_ADDR') not in settings.INTERNAL_IPS and not request.user.is_staff:
+        return HttpResponseForbidden()
+
+    return HttpResponse(metrics.prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')